@@ -0,0 +1,79 @@
+# Кэш ответов на первые реплики: поток первых сообщений новых чатов, где популярные вопросы
+# повторяются с разным регистром и пунктуацией. Без кэша каждый ход платит за фильтры, поиск
+# и генерацию ответа (заглушки с типичной длительностью), с кэшем — только за фильтры и поиск в кэше.
+# Эмбеддинги — локальный HashingEmbedder. Отдельно — время поиска в заполненном кэше.
+# Запуск из корня проекта: python -m benchmarks.bench_answer_cache
+import time
+import random
+import statistics
+from utils.answer_cache import AnswerCache, make_answer_key
+from utils.embedders import HashingEmbedder
+
+TURNS = 400
+CACHE_SIZE = 1000
+FILTERS = 0.8
+SEARCH = 0.1
+ANSWER = 3.0
+QUESTIONS = (
+    ("какие есть ЖК на Патрокле", {"area": "патрокл"}),
+    ("самая дешёвая студия", {"num_rooms": [0], "sort_price": "asc"}),
+    ("двушка до 7 млн на Эгершельде", {"area": "эгершельд", "num_rooms": [2], "max_price": 7000000}),
+    ("есть ли квартиры с видом на море", {"complex_search": True, "complex_search_phrase": "вид на море"}),
+    ("что есть в Артёме", {"city": "Артём"}),
+    ("однушки в центре", {"area": "центр", "num_rooms": [1]}),
+)
+
+
+def variant(text):
+    # Те же вопросы, как их пишут люди: регистр, знаки препинания, «ё»
+    text = random.choice((text, text.capitalize(), text.replace("ё", "е")))
+    return text + random.choice(("", "?", "??", " ?", "!"))
+
+
+def unique(i):
+    # Редкий вопрос с уникальными параметрами поиска
+    return f"квартира у дома {i} с парковкой", {"max_price": 5000000 + i * 1000}
+
+
+def main():
+    random.seed(0)
+    embedder = HashingEmbedder(workers=1)
+    cache = AnswerCache(max_size=CACHE_SIZE, ttl=3600)
+
+    latencies = []
+    for i in range(TURNS):
+        text, filters = random.choice(QUESTIONS) if random.random() < 0.6 else unique(i)
+        text = variant(text)
+        key = make_answer_key(filters)
+        embedding = embedder.encode_one(text)
+        answer = cache.get(embedding, key)
+        if answer is None:
+            latencies.append(FILTERS + SEARCH + ANSWER)
+            cache.put(embedding, key, f"ответ на «{text}»", version=0)
+        else:
+            latencies.append(FILTERS)
+    stats = cache.get_stats()
+    print(
+        f"ходов {TURNS}: попаданий {stats['hits']} ({stats['hit_rate']:.0%}), записей {stats['size']}; "
+        f"средняя задержка {statistics.mean(latencies):.2f} с вместо {FILTERS + SEARCH + ANSWER:.2f} с"
+    )
+
+    # Заполненный кэш: все записи с одними фильтрами — худший случай для перебора
+    full = AnswerCache(max_size=CACHE_SIZE, ttl=3600)
+    key = make_answer_key({})
+    vectors = [embedder.encode_one(f"вопрос номер {i} про квартиры") for i in range(CACHE_SIZE)]
+    for i, vector in enumerate(vectors):
+        full.put(vector, key, f"ответ {i}", version=0)
+    timings = []
+    for vector in vectors[:200]:
+        started = time.perf_counter()
+        full.get(vector, key)
+        timings.append(time.perf_counter() - started)
+    print(
+        f"поиск в кэше из {full.get_stats()['size']} записей с одним ключом фильтров: "
+        f"медиана {statistics.median(timings) * 1000:.2f} мс, максимум {max(timings) * 1000:.2f} мс"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# Замер двух путей get_filtered_apartments (sql и columnar) на текущей complexes.db.
+# Отдельно замеряется повторный прогон через кэш результатов фильтров.
+# Совпадение выдачи и число SQL-запросов на вызов проверяются тестами на заполненном каталоге (tests/).
+# Запуск из корня проекта: python -m benchmarks.bench_apartment_search
+import io
+import time
+import random
+import itertools
+import statistics
+import contextlib
+from sqlalchemy import select, event
+from config import Config
+from models.models import Area, ResidentialComplex, Session, engine
+from models.query import get_filtered_apartments
+from models.filter_cache import filter_result_cache
+
+SAMPLE = 400
+
+
+def filter_grid(session):
+    area_names = [None, "нет такого района"] + list(session.scalars(select(Area.name)))
+    cities = [None] + [c for c in session.scalars(select(ResidentialComplex.city).distinct()) if c]
+    names = list(session.scalars(select(ResidentialComplex.complex_name)))
+    complex_names = [None, ["нет такого ЖК"]] + [[n] for n in names[:5]] + [names[:3]]
+    rooms = [None, [0], [1], [2], [2, 3], [3, 2, 2], [4, 5]]
+    prices = [(None, None), (None, 7_000_000), (5_000_000, 9_000_000), (None, 100)]
+    squares = [(None, None), (40, None), (None, 60)]
+    for r, p, sq, a, c, n, sort, limit in itertools.product(
+        rooms, prices, squares, area_names, cities, complex_names, ["asc", "desc", None], [3, None]
+    ):
+        yield dict(
+            num_rooms=r, min_price=p[0], max_price=p[1], min_square=sq[0], max_square=sq[1],
+            area=a, city=c, complex_names=n, sort_price=sort, limit=limit,
+        )
+
+
+def run(engine_name, filters, cache=False):
+    Config.APARTMENT_SEARCH_ENGINE = engine_name
+    Config.FILTER_CACHE_ENABLED = cache
+    get_filtered_apartments(**filters[0])  # прогрев (для columnar — построение индекса)
+    outputs, timings, statements = [], [], []
+    counter = [0]
+
+    def count_statement(*args):
+        counter[0] += 1
+
+    event.listen(engine, "before_cursor_execute", count_statement)
+    try:
+        for f in filters:
+            counter[0] = 0
+            start = time.perf_counter()
+            outputs.append(get_filtered_apartments(**f))
+            timings.append((time.perf_counter() - start) * 1000)
+            statements.append(counter[0])
+    finally:
+        event.remove(engine, "before_cursor_execute", count_statement)
+    return outputs, timings, statements
+
+
+def main():
+    session = Session()
+    filters = list(filter_grid(session))
+    session.close()
+    random.seed(0)
+    filters = random.sample(filters, min(SAMPLE, len(filters)))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        sql_outputs, sql_timings, sql_statements = run("sql", filters)
+        _, columnar_timings, columnar_statements = run("columnar", filters)
+        run("columnar", filters, cache=True)  # заполнение кэша
+        _, cached_timings, cached_statements = run("columnar", filters, cache=True)
+
+    found = sum("нету квартир" not in output for output in sql_outputs)
+    print(f"запросов с найденными квартирами: {found} из {len(filters)}")
+
+    print(f"sql: запросов на вызов не больше {max(sql_statements)}, columnar: {max(columnar_statements)}")
+    print(f"кэш фильтров: {filter_result_cache.get_stats()}")
+    for name, timings in (("sql", sql_timings), ("columnar", columnar_timings), ("cached", cached_timings)):
+        timings = sorted(timings)
+        p99 = timings[int(len(timings) * 0.99) - 1]
+        print(f"{name:<10} mean {statistics.mean(timings):8.3f} ms   p50 {statistics.median(timings):8.3f} ms   p99 {p99:8.3f} ms")
+    if any(columnar_statements) or any(cached_statements):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# Серии коротких сообщений подряд: каждый ход отдельно (как раньше) и через ChatMailbox.
+# Ход — заглушка с двумя вызовами модели (фильтры и ответ); считаются вызовы модели, завершённые
+# ответы и пересечения ходов одного чата, при которых записи в историю перемешиваются.
+# Запуск из корня проекта: python -m benchmarks.bench_chat_mailbox
+import random
+import asyncio
+from utils.chat_mailbox import ChatMailbox, Turn
+
+CHATS = 50
+BURST = 4
+GAP = (0.1, 0.6)  # пауза между сообщениями серии, секунды
+FILTERS = 0.8
+ANSWER = 1.5
+
+
+class Counters:
+
+    def __init__(self):
+        self.llm_calls = 0
+        self.answers = 0
+        self.active = {}
+        self.overlaps = 0
+        self.answered_messages = 0
+
+
+def make_handler(counters):
+    async def handle(turn):
+        counters.active[turn.chat_id] = counters.active.get(turn.chat_id, 0) + 1
+        if counters.active[turn.chat_id] > 1:
+            counters.overlaps += 1
+        try:
+            counters.llm_calls += 1
+            await asyncio.sleep(FILTERS)
+            counters.llm_calls += 1
+            await asyncio.sleep(ANSWER)
+            turn.commit()
+            counters.answers += 1
+            counters.answered_messages += len(turn.items)
+        finally:
+            counters.active[turn.chat_id] -= 1
+    return handle
+
+
+async def send_bursts(submit, seed=0):
+    rng = random.Random(seed)
+
+    async def chat(chat_id):
+        for i in range(BURST):
+            await submit(chat_id, f"сообщение {i}")
+            await asyncio.sleep(rng.uniform(*GAP))
+
+    await asyncio.gather(*(chat(chat_id) for chat_id in range(CHATS)))
+
+
+async def main():
+    counters = Counters()
+    handler = make_handler(counters)
+    tasks = []
+
+    async def submit_direct(chat_id, text):
+        # Как без очереди при concurrent_updates: каждое сообщение — свой обработчик
+        tasks.append(asyncio.create_task(handler(Turn(chat_id, [text]))))
+
+    await send_bursts(submit_direct)
+    await asyncio.gather(*tasks)
+    direct = counters
+
+    counters = Counters()
+    mailbox = ChatMailbox(make_handler(counters), debounce=0.5, max_delay=3.0, cancel_superseded=True)
+
+    async def submit_mailbox(chat_id, text):
+        mailbox.submit(chat_id, text)
+
+    await send_bursts(submit_mailbox)
+    await mailbox.drain()
+
+    for name, c in (("без очереди", direct), ("ChatMailbox", counters)):
+        print(
+            f"{name:<12} вызовов модели {c.llm_calls:4d}   ответов {c.answers:4d}   "
+            f"сообщений в ответах {c.answered_messages:4d}   пересечений ходов {c.overlaps:3d}"
+        )
+    print(f"статистика очереди: {mailbox.get_stats()}")
+    if counters.overlaps or counters.answered_messages != CHATS * BURST:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+# Накладные расходы журнала диалогов на одно сообщение: ConversationManager в памяти,
+# с отложенной записью (ConversationStore) и, для сравнения, с синхронным commit на каждое событие.
+# Запуск из корня проекта: python -m benchmarks.bench_conversation_store
+import os
+import time
+import tempfile
+import statistics
+from config import Config
+from models.conversation_manager import ConversationManager
+from models.conversation_store import ConversationStore
+
+CHATS = 200
+TURNS = 25
+TEXT = "Подберите двухкомнатную квартиру до 8 млн во Владивостоке " * 3
+CONTEXT = "Результат промежуточного анализа запроса: /n" + "Двухкомнатная квартира Цена: 7 900 000 ЖК: Gavan\n" * 20
+
+
+def run_turns(manager):
+    timings = []
+    for turn in range(TURNS):
+        for chat_id in range(CHATS):
+            start = time.perf_counter()
+            manager.add_user_message(chat_id, TEXT)
+            manager.add_update_message(chat_id, CONTEXT, "Результат промежуточного анализа запроса")
+            manager.add_assistant_message(chat_id, TEXT)
+            manager.increment_message_count(chat_id)
+            timings.append((time.perf_counter() - start) * 1e6)
+    return timings
+
+
+class SyncStore(ConversationStore):
+    # Запись без буфера: commit на каждое событие
+    def _append(self, event):
+        with self._db_lock, self._db:
+            self._db.execute(
+                "INSERT INTO events (chat_id, kind, name, role, content, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                event,
+            )
+
+    def set_message_count(self, chat_id, count):
+        with self._db_lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO message_counts (chat_id, message_count) VALUES (?, ?)", (chat_id, count)
+            )
+
+
+def make_manager(store):
+    manager = ConversationManager()
+    manager.chats.clear()
+    manager.total_bytes = 0
+    manager.store = store
+    return manager
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    p99 = timings[int(len(timings) * 0.99) - 1]
+    print(f"{name:<14} mean {statistics.mean(timings):8.2f} мкс   p50 {statistics.median(timings):8.2f} мкс   p99 {p99:8.2f} мкс")
+
+
+def main():
+    Config.CONVERSATION_PERSISTENCE = False
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {"memory": run_turns(make_manager(None))}
+
+        store = ConversationStore(os.path.join(tmp, "write_behind.sqlite3"), max_turns=Config.MAX_HISTORY_TURNS)
+        results["write-behind"] = run_turns(make_manager(store))
+        start = time.perf_counter()
+        store.flush()
+        drain = time.perf_counter() - start
+        stats = store.get_stats()
+
+        # Проверка восстановления: чат после вытеснения из памяти совпадает с исходным
+        manager = make_manager(store)
+        expected = manager.get_history(0)[:-1]
+        manager.chats.clear()
+        restored = manager.get_history(0)[:-1]
+        store.close()
+
+        sync_store = SyncStore(os.path.join(tmp, "sync.sqlite3"), max_turns=Config.MAX_HISTORY_TURNS)
+        results["sync commit"] = run_turns(make_manager(sync_store))
+        sync_store.close()
+
+    for name, timings in results.items():
+        report(name, timings)
+    print(f"журнал: {stats}, дозапись остатка {drain * 1000:.1f} мс")
+    print(f"восстановление чата из журнала: {'совпадает' if restored == expected else 'РАСХОЖДЕНИЕ'}")
+    if restored != expected:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
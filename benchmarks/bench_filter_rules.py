@@ -0,0 +1,71 @@
+# Быстрый разбор параметров поиска правилами: время на сообщение и доля сообщений, для которых
+# разбор уверенный и запрос к мини-модели (FILTERS секунд) можно пропустить.
+# Словари районов и ЖК берутся из каталога (complexes.db), если он загружен, иначе — небольшой пример.
+# Запуск из корня проекта: python -m benchmarks.bench_filter_rules
+import time
+import asyncio
+import statistics
+from config import Config
+from utils.filter_rules import RuleFilterExtractor, _index_entries
+from utils.lexical_index import tokenize
+
+FILTERS = 0.8
+ROUNDS = 200
+AREAS = ("эгершельд", "бам", "чуркин", "первая речка", "центр", "седанка", "снеговая падь")
+# (сообщение, это уточнение посреди диалога)
+MESSAGES = (
+    ("двушка до 7 млн на Эгершельде", False),
+    ("студии в Артёме", False),
+    ("Ищу однушку или двушку от 5 до 7,5 млн на Первой речке", False),
+    ("3-к от 60 до 80 м² в центре, бюджет 12 000 000", False),
+    ("двухкомнатная 40-55 метров на Седанке", False),
+    ("покажите все варианты недорогих студий во Владивостоке", False),
+    ("Здравствуйте! Интересует трёхкомнатная квартира на Чуркине", False),
+    ("однушка не дороже 6 млн", True),
+    ("а на Баме?", True),
+    ("а подешевле есть?", True),
+    ("квартиры с видом на море рядом со школой", False),
+    ("какие условия ипотеки?", True),
+    ("до 7", True),
+    ("привет", False),
+    ("двушка на Снеговой пади площадью от 50 метров", False),
+    ("хочу евродвушку до 8 млн", False),
+)
+
+
+async def main():
+    extractor = RuleFilterExtractor()
+    await extractor.refresh()
+    if not extractor.get_stats()["areas"]:
+        extractor._areas = _index_entries({tuple(tokenize(name)): name for name in AREAS})
+
+    durations = []
+    for _ in range(ROUNDS):
+        for text, follow_up in MESSAGES:
+            started = time.perf_counter()
+            extractor.extract(text, follow_up=follow_up)
+            durations.append(time.perf_counter() - started)
+
+    confident = 0
+    for text, follow_up in MESSAGES:
+        params, confidence = extractor.extract(text, follow_up=follow_up)
+        skip = confidence >= Config.FAST_FILTERS_CONFIDENCE
+        confident += skip
+        found = {k: v for k, v in params.items() if v not in (None, False) and k not in ("isfilter", "limit")}
+        print(f"{'без модели' if skip else 'модель    '}  {confidence:4.2f}  {text:<60} {found}")
+
+    share = confident / len(MESSAGES)
+    durations.sort()
+    print(
+        f"\nразбор правилами: медиана {statistics.median(durations) * 1e6:.0f} мкс, "
+        f"p95 {durations[int(len(durations) * 0.95)] * 1e6:.0f} мкс на сообщение"
+    )
+    print(
+        f"уверенно разобрано {confident} из {len(MESSAGES)} ({share:.0%}); при FAST_FILTERS=on "
+        f"средняя задержка этапа фильтров {FILTERS * (1 - share) * 1000:.0f} мс вместо {FILTERS * 1000:.0f} мс"
+    )
+    print(f"словари: {extractor.get_stats()['areas']} районов, {extractor.get_stats()['complex_aliases']} названий ЖК")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+# Холодный и тёплый запрос через HttpPool. Локальный HTTP-сервер задерживает каждое новое соединение
+# на HANDSHAKE секунд (как TLS и рукопожатие с прокси до api.openai.com) и отвечает за SERVER_TIME.
+# Запуск из корня проекта: python -m benchmarks.bench_http_pool
+import asyncio
+import statistics
+from utils.http_pool import HttpPool
+
+HANDSHAKE = 0.15
+SERVER_TIME = 0.02
+BURST = 4
+ROUNDS = 5
+
+
+class SlowHandshakeServer:
+
+    def __init__(self):
+        self.connections = 0
+        self.server = None
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        await asyncio.sleep(HANDSHAKE)
+        try:
+            while True:
+                headers = await reader.readuntil(b"\r\n\r\n")
+                if not headers:
+                    break
+                await asyncio.sleep(SERVER_TIME)
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: keep-alive\r\n\r\nok")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}/"
+
+
+async def burst(pool, url):
+    loop = asyncio.get_running_loop()
+
+    async def one():
+        started = loop.time()
+        response = await pool.client.get(url)
+        await response.aread()
+        return (loop.time() - started) * 1000
+
+    return await asyncio.gather(*(one() for _ in range(BURST)))
+
+
+async def main():
+    server = SlowHandshakeServer()
+    url = await server.start()
+
+    cold, warm = [], []
+    for _ in range(ROUNDS):
+        pool = HttpPool(warm_url=url)
+        cold.extend(await burst(pool, url))
+        await pool.stop()
+
+        pool = HttpPool(warm_url=url)
+        await pool.warm_up(BURST)
+        warm.extend(await burst(pool, url))
+        stats = pool.get_stats()
+        await pool.stop()
+
+    print(f"холодный пул   среднее {statistics.mean(cold):6.1f} мс   максимум {max(cold):6.1f} мс")
+    print(f"прогретый пул  среднее {statistics.mean(warm):6.1f} мс   максимум {max(warm):6.1f} мс")
+    print(f"соединений открыто сервером: {server.connections}; пул после прогрева: {stats}")
+    server.server.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
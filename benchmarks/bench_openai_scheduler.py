@@ -0,0 +1,105 @@
+# Всплеск запросов сверх лимита провайдера: прямые вызовы с повторами как у SDK по умолчанию
+# (2 повтора, Retry-After) и через OpenAIScheduler. Провайдер — заглушка с ведром токенов в минуту,
+# которая отвечает 429 с retry-after-ms, когда лимит исчерпан. Всплеск — вдвое больше минутного лимита.
+# Запуск из корня проекта: python -m benchmarks.bench_openai_scheduler
+import time
+import random
+import asyncio
+import httpx
+import openai
+from utils.openai_scheduler import OpenAIScheduler, TokenBucket, INTERACTIVE, BACKGROUND
+
+MODEL = "gpt-4o"
+RPM = 6000
+TPM = 600000
+REQUESTS = 400
+TOKENS = 2000
+LATENCY = 0.2
+SDK_RETRIES = 2
+
+
+class ProviderStub:
+
+    def __init__(self):
+        self.requests = TokenBucket(RPM)
+        self.tokens = TokenBucket(TPM)
+        self.served_tokens = 0
+        self.rejected = 0
+
+    async def create(self, tokens):
+        now = time.monotonic()
+        delay = max(self.requests.delay(1, now), self.tokens.delay(tokens, now))
+        if delay > 0:
+            self.rejected += 1
+            request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+            response = httpx.Response(429, headers={"retry-after-ms": str(int(delay * 1000))}, request=request)
+            raise openai.RateLimitError("Rate limit reached", response=response, body=None)
+        self.requests.consume(1, now)
+        self.tokens.consume(tokens, now)
+        await asyncio.sleep(LATENCY)
+        self.served_tokens += tokens
+        return tokens
+
+
+async def direct(provider):
+    # Поведение прежнего клиента: повторы SDK, затем ошибка превращается в ответ «Произошла ошибка»
+    for attempt in range(SDK_RETRIES + 1):
+        try:
+            return await provider.create(TOKENS)
+        except openai.RateLimitError as e:
+            if attempt == SDK_RETRIES:
+                raise
+            retry_after = float(e.response.headers["retry-after-ms"]) / 1000
+            await asyncio.sleep(retry_after + random.uniform(0, 0.5))
+
+
+async def scheduled(provider, scheduler, priority):
+    return await scheduler.submit(MODEL, lambda: provider.create(TOKENS), tokens=TOKENS, priority=priority)
+
+
+async def measure(name, make_call):
+    provider = ProviderStub()
+    started = time.monotonic()
+    finished = []
+
+    async def one(i):
+        try:
+            await make_call(provider, i)
+            finished.append((i, time.monotonic() - started))
+            return True
+        except Exception:
+            return False
+
+    results = await asyncio.gather(*(one(i) for i in range(REQUESTS)))
+    elapsed = time.monotonic() - started
+    ok = sum(results)
+    # Первую минуту провайдер пропускает запас на TPM токенов сразу, поэтому темп считаем сверх него
+    sustained = max(provider.served_tokens - TPM, 0) / elapsed * 60
+    print(
+        f"{name:<12} успешно {ok:4d} из {REQUESTS}   ошибок {REQUESTS - ok:4d}   ответов 429 {provider.rejected:5d}   "
+        f"за {elapsed:5.1f} с   токенов в минуту сверх запаса {sustained:7.0f} (лимит {TPM})"
+    )
+    return finished
+
+
+async def main():
+    random.seed(0)
+    await measure("напрямую", lambda provider, i: direct(provider))
+    scheduler = OpenAIScheduler(max_queue=REQUESTS, queue_timeout=120)
+    scheduler.set_limits(MODEL, RPM, TPM)
+    # Каждый четвёртый запрос — фоновый (пересчёт индекса), остальные — ответы в диалоге
+    finished = await measure(
+        "планировщик",
+        lambda provider, i: scheduled(provider, scheduler, BACKGROUND if i % 4 == 0 else INTERACTIVE),
+    )
+    interactive = [t for i, t in finished if i % 4]
+    background = [t for i, t in finished if i % 4 == 0]
+    print(
+        f"  среднее время ответа: диалог {sum(interactive) / len(interactive):5.1f} с, "
+        f"фон {sum(background) / len(background):5.1f} с"
+    )
+    print(f"  статистика: {scheduler.get_stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,137 @@
+# Доля prompt-токенов из кэша провайдера при старой раскладке истории (без обрезки) и новой —
+# с обрезкой до бюджета на каждом ходе и с обрезкой до TRIM_TARGET_RATIO бюджета.
+# Вместо OpenAI — локальная заглушка с правилами кэша префиксов: кэшируется общий с прошлыми
+# запросами префикс от 1024 токенов с шагом 128. Статистика собирается через OpenAIClient._ask_openai.
+# Запуск из корня проекта: python -m benchmarks.bench_prompt_cache
+import os
+import asyncio
+import hashlib
+from types import SimpleNamespace
+
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+os.environ["CONVERSATION_PERSISTENCE"] = "0"
+# Заглушка не ограничивает запросы, лимиты планировщика здесь только мешают замеру
+os.environ.setdefault("OPENAI_TPM", str(10 ** 9))
+
+from config import Config
+from models.conversation_manager import ConversationManager, Role, get_vladivostok_time
+from utils.openai_client import OpenAIClient
+
+CHATS = 10
+TURNS = 40
+# Бюджет меньше боевого MAX_TOKENS, чтобы обрезка включалась уже через несколько ходов
+MAX_TOKENS = 5000
+MIN_PREFIX = 1024
+BLOCK = 128
+KNOWLEDGE = "Результат поиска в базе знаний запроса"
+FILTER = "Результат промежуточного анализа запроса"
+
+
+class PrefixCacheStub:
+    # Токен заглушки — 3 символа сериализованного сообщения; этого достаточно для сравнения раскладок
+
+    def __init__(self):
+        self.seen = set()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    @staticmethod
+    def _tokens(messages):
+        text = "".join(f"<{m['role']}>{m['content']}" for m in messages)
+        return [text[i:i + 3] for i in range(0, len(text), 3)]
+
+    async def create(self, messages, **kwargs):
+        tokens = self._tokens(messages)
+        digest = hashlib.sha256()
+        cached = 0
+        prefixes = []
+        for end in range(BLOCK, len(tokens) + 1, BLOCK):
+            digest.update("".join(tokens[end - BLOCK:end]).encode("utf-8"))
+            prefix = digest.copy().hexdigest()
+            prefixes.append(prefix)
+            if end >= MIN_PREFIX and prefix in self.seen:
+                cached = end
+        self.seen.update(prefixes)
+        usage = SimpleNamespace(
+            prompt_tokens=len(tokens),
+            completion_tokens=10,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=cached),
+        )
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="Ответ менеджера"))], usage=usage
+        )
+
+
+class LegacyHistory:
+    # Раскладка до изменений: вставки удаляются из середины и дописываются в конец, время до секунды
+
+    def __init__(self, prompt):
+        self.prompt = prompt
+        self.histories = {}
+
+    def add(self, chat_id, role, content):
+        self.histories.setdefault(chat_id, [{"role": Role.SYSTEM.value, "content": self.prompt}])
+        self.histories[chat_id].append({"role": role, "content": content})
+
+    def add_update(self, chat_id, content, rep_text):
+        self.histories[chat_id] = [
+            m for m in self.histories[chat_id] if not (m["role"] == Role.SYSTEM.value and rep_text in m["content"])
+        ]
+        self.add(chat_id, Role.SYSTEM.value, content)
+
+    def get(self, chat_id, turn):
+        seconds = f"{turn:02d}"  # каждый запрос — в новую секунду
+        time_line = f"Текущее время во Владивостоке: {get_vladivostok_time()[:-2]}{seconds}"
+        return self.histories[chat_id] + [{"role": Role.SYSTEM.value, "content": time_line}]
+
+
+def turn_texts(chat_id, turn):
+    user = f"Чат {chat_id}: подберите двухкомнатную квартиру до {7 + turn % 5} млн, вариант {turn}. " * 4
+    knowledge = f"{KNOWLEDGE}:/n" + f"ЖК {chat_id}-{turn // 3}: описание, район, сроки сдачи. " * 40
+    filters = f"{FILTER}: /n" + f"Двухкомнатная квартира Цена: {7_000_000 + turn * 1000} ЖК: Gavan\n" * 15
+    return user, knowledge, filters
+
+
+async def run():
+    client = OpenAIClient()
+    manager = ConversationManager()
+    legacy = LegacyHistory(manager.promt)
+    # У каждой раскладки свой кэш, чтобы они не попадали в префиксы друг друга
+    stubs = {name: PrefixCacheStub() for name in ("legacy", "trim-each", "hysteresis")}
+    trim_ratios = {"trim-each": 1.0, "hysteresis": Config.TRIM_TARGET_RATIO}
+
+    for turn in range(TURNS):
+        for chat_id in range(CHATS):
+            user, knowledge, filters = turn_texts(chat_id, turn)
+
+            # Старая раскладка без обрезки истории
+            legacy.add(chat_id, Role.USER.value, user)
+            if turn % 3 == 0:
+                legacy.add_update(chat_id, knowledge, KNOWLEDGE)
+            legacy.add_update(chat_id, filters, FILTER)
+            client._client = stubs["legacy"]
+            reply, _, _ = await client._ask_openai(legacy.get(chat_id, turn), model="legacy")
+            legacy.add(chat_id, Role.ASSISTANT.value, reply)
+
+            # Новая раскладка: обрезка до бюджета на каждом ходе и обрезка с запасом
+            for offset, (name, ratio) in enumerate(trim_ratios.items()):
+                key = (offset + 1) * 1000 + chat_id
+                Config.TRIM_TARGET_RATIO = ratio
+                manager.initialize_conversation(key)
+                manager.add_user_message(key, user)
+                if turn % 3 == 0:
+                    manager.add_update_message(key, knowledge, KNOWLEDGE)
+                manager.add_update_message(key, filters, FILTER, volatile=True)
+                manager.trim_history(key, max_tokens=MAX_TOKENS)
+                client._client = stubs[name]
+                reply, _, _ = await client._ask_openai(manager.get_history(key), model=name)
+                manager.add_assistant_message(key, reply)
+
+    for model, stats in client.get_usage_stats().items():
+        print(
+            f"{model:<11} запросов {stats['requests']:4d}   prompt/запрос {stats['prompt_tokens'] // stats['requests']:6d}   "
+            f"из кэша {stats['cached_tokens']:9d}   доля {stats['cache_hit_rate']:.1%}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
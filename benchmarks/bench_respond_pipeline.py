@@ -0,0 +1,105 @@
+# Задержка обработки сообщения: этапы по очереди (как раньше) и графом через utils.pipeline.
+# Сетевые вызовы заменены ожиданием с типичной длительностью, поэтому замер показывает только
+# выигрыш от наложения этапов, а не скорость моделей.
+# Запуск из корня проекта: python -m benchmarks.bench_respond_pipeline
+import asyncio
+import statistics
+from utils.pipeline import Pipeline
+
+RUNS = 10
+# Длительности этапов в секундах
+FILTERS = 0.8
+EMBEDDING = 0.25
+VECTOR_QUERY = 0.05
+APARTMENTS = 0.06
+ANSWER = 1.5
+
+
+class EmbeddingStub:
+
+    def __init__(self):
+        self.cache = set()
+        self.requests = 0
+
+    async def embed(self, text):
+        if text in self.cache:
+            return
+        self.requests += 1
+        await asyncio.sleep(EMBEDDING)
+        self.cache.add(text)
+
+    async def search(self, phrase):
+        await self.embed(phrase)
+        await asyncio.sleep(VECTOR_QUERY)
+
+
+async def sequential(embedder, user_input, phrase):
+    await asyncio.sleep(FILTERS)
+    await embedder.search(phrase)
+    await asyncio.sleep(APARTMENTS)
+    await asyncio.sleep(ANSWER)
+
+
+def build_pipeline(embedder):
+    pipeline = Pipeline("bench", window=RUNS)
+
+    @pipeline.stage("speculative_embedding", speculative=True)
+    async def speculative_embedding(run):
+        await embedder.embed(run.inputs["user_input"])
+
+    @pipeline.stage("filters")
+    async def filters(run):
+        await asyncio.sleep(FILTERS)
+        return run.inputs["phrase"]
+
+    @pipeline.stage("knowledge_search", deps=("filters",))
+    async def knowledge_search(run):
+        phrase = run.results["filters"]
+        if phrase == run.inputs["user_input"]:
+            await run.result("speculative_embedding")
+        else:
+            run.cancel("speculative_embedding")
+        await embedder.search(phrase)
+
+    @pipeline.stage("apartments", deps=("filters",))
+    async def apartments(run):
+        await asyncio.sleep(APARTMENTS)
+
+    @pipeline.stage("answer", deps=("knowledge_search", "apartments"))
+    async def answer(run):
+        await asyncio.sleep(ANSWER)
+
+    return pipeline
+
+
+async def measure(name, call):
+    timings = []
+    loop = asyncio.get_running_loop()
+    for i in range(RUNS):
+        started = loop.time()
+        await call(i)
+        timings.append((loop.time() - started) * 1000)
+    print(f"{name:<32} mean {statistics.mean(timings):7.0f} ms   max {max(timings):7.0f} ms")
+
+
+async def main():
+    for title, same_phrase in (("фраза совпадает с сообщением", True), ("фраза отличается", False)):
+        print(title)
+
+        def texts(i):
+            user_input = f"сообщение {i}"
+            return user_input, user_input if same_phrase else f"фраза {i}"
+
+        embedder = EmbeddingStub()
+        await measure("  по очереди", lambda i: sequential(embedder, *texts(i)))
+        embedder = EmbeddingStub()
+        pipeline = build_pipeline(embedder)
+        await measure(
+            "  граф этапов",
+            lambda i: pipeline.run(user_input=texts(i)[0], phrase=texts(i)[1]),
+        )
+        print(f"  запросов эмбеддингов: {embedder.requests}, отменено этапов: {pipeline.get_stats()['cancelled']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
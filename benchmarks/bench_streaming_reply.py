@@ -0,0 +1,96 @@
+# Время до первого видимого текста: обычный ответ одним сообщением и потоковый с правками.
+# OpenAI и Telegram заменены заглушками с типичными задержками: первый токен через FIRST_TOKEN,
+# дальше по фрагменту каждые CHUNK_INTERVAL секунд, каждый запрос к Telegram — TELEGRAM_LATENCY.
+# Запуск из корня проекта: python -m benchmarks.bench_streaming_reply
+import os
+import asyncio
+from types import SimpleNamespace
+
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+os.environ["CONVERSATION_PERSISTENCE"] = "0"
+# Заглушка не ограничивает запросы, лимиты планировщика здесь только мешают замеру
+os.environ.setdefault("OPENAI_TPM", str(10 ** 9))
+
+from models.conversation_manager import ConversationManager
+from utils.openai_client import OpenAIClient
+from utils.telegram_stream import StreamingReply
+
+FIRST_TOKEN = 0.5
+CHUNKS = 300
+CHUNK_INTERVAL = 0.015
+TELEGRAM_LATENCY = 0.05
+CHUNK_TEXT = "слово "
+
+
+class CompletionsStub:
+
+    async def create(self, messages, stream=False, **kwargs):
+        if not stream:
+            await asyncio.sleep(FIRST_TOKEN + CHUNKS * CHUNK_INTERVAL)
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content=CHUNK_TEXT * CHUNKS))], usage=None
+            )
+        return self._stream()
+
+    async def _stream(self):
+        await asyncio.sleep(FIRST_TOKEN)
+        for _ in range(CHUNKS):
+            await asyncio.sleep(CHUNK_INTERVAL)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=CHUNK_TEXT))], usage=None)
+
+
+class TelegramMessageStub:
+
+    def __init__(self, started):
+        self.started = started
+        self.events = []
+
+    def _record(self, kind, text):
+        self.events.append((kind, asyncio.get_running_loop().time() - self.started, len(text)))
+
+    async def reply_text(self, text):
+        await asyncio.sleep(TELEGRAM_LATENCY)
+        self._record("send", text)
+        return SimpleNamespace(edit_text=self.edit_text)
+
+    async def edit_text(self, text):
+        await asyncio.sleep(TELEGRAM_LATENCY)
+        self._record("edit", text)
+
+
+async def answer(client, chat_id, streaming):
+    loop = asyncio.get_running_loop()
+    message = TelegramMessageStub(loop.time())
+    if streaming:
+        reply = StreamingReply(message)
+        await reply.start()
+        text, _, _ = await client.create_gpt4o_response("", chat_id, on_delta=reply.update)
+        await reply.finish(text)
+    else:
+        text, _, _ = await client.create_gpt4o_response("", chat_id)
+        await message.reply_text(text)
+    return message.events
+
+
+async def main():
+    client = OpenAIClient()
+    client._client = SimpleNamespace(chat=SimpleNamespace(completions=CompletionsStub()))
+    manager = ConversationManager()
+    for chat_id, streaming in ((1, False), (2, True)):
+        manager.initialize_conversation(chat_id)
+        manager.add_user_message(chat_id, "Подберите двухкомнатную квартиру")
+        events = await answer(client, chat_id, streaming)
+        first = events[0][1] * 1000
+        first_text = next(t for kind, t, size in events if size > 1) * 1000
+        print(
+            f"{'потоковый' if streaming else 'обычный':<10} первое сообщение {first:6.0f} мс   "
+            f"первый текст ответа {first_text:6.0f} мс   полный ответ {events[-1][1] * 1000:6.0f} мс   "
+            f"запросов к Telegram {len(events)}"
+        )
+        # В историю попадает полный ответ
+        replies = [m["content"] for m in manager.get_history(chat_id) if m["role"] == "assistant"]
+        assert replies[-1] == (CHUNK_TEXT * CHUNKS).strip()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+# Сравнение бэкендов векторного хранилища на синтетическом корпусе размера нашей базы знаний.
+# Запуск из корня проекта: python -m benchmarks.bench_vector_store
+import time
+import tempfile
+import statistics
+import numpy as np
+from utils.vector_store import ChromaVectorStore, NumpyVectorStore
+
+DOCS = 60
+DIM = 3072
+QUERIES = 200
+N_RESULTS = 100
+CITIES = ("Владивосток", "Артём", "Находка")
+
+
+def make_corpus(rng):
+    vectors = rng.standard_normal((DOCS, DIM)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    ids = [f"doc{i}_chunk_0" for i in range(DOCS)]
+    metadatas = [
+        {"source": f"doc{i}", "chunk_index": 0, "content": f"doc {i}", "complex_name": f"doc{i}", "city": CITIES[i % len(CITIES)]}
+        for i in range(DOCS)
+    ]
+    return ids, vectors, metadatas
+
+
+def run(store, queries, where=None):
+    timings = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        result = store.query(query, n_results=N_RESULTS, where=where)
+        timings.append((time.perf_counter() - start) * 1000)
+        results.append(result["ids"][0][:3])
+    return timings, results
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    p99 = timings[int(len(timings) * 0.99) - 1]
+    print(f"{name:<28} mean {statistics.mean(timings):8.3f} ms   p50 {statistics.median(timings):8.3f} ms   p99 {p99:8.3f} ms")
+
+
+def main():
+    rng = np.random.default_rng(0)
+    ids, vectors, metadatas = make_corpus(rng)
+    queries = [vectors[rng.integers(DOCS)] + 0.1 * rng.standard_normal(DIM).astype(np.float32) for _ in range(QUERIES)]
+    queries = [q.tolist() for q in queries]
+
+    with tempfile.TemporaryDirectory() as chroma_dir, tempfile.TemporaryDirectory() as numpy_dir:
+        stores = {
+            "chroma": ChromaVectorStore(chroma_dir),
+            "numpy": NumpyVectorStore(numpy_dir),
+        }
+        for store in stores.values():
+            store.upsert(ids, vectors.tolist(), metadatas)
+
+        for where in (None, {"city": CITIES[0]}):
+            top = {}
+            for name, store in stores.items():
+                run(store, queries[:10], where)  # прогрев
+                timings, top[name] = run(store, queries, where)
+                report(f"{name} where={where and where['city']}", timings)
+            agreement = sum(a == b for a, b in zip(top["chroma"], top["numpy"])) / len(queries)
+            print(f"совпадение top-3: {agreement:.0%}")
+
+
+if __name__ == "__main__":
+    main()
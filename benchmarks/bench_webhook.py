@@ -0,0 +1,171 @@
+# Вебхук под нагрузкой: локальный «Telegram» (фейковый Bot API на starlette) и бот в режиме webhook
+# в одном процессе. USERS пользователей пишут одновременно; модель — заглушка с задержкой FILTERS
+# на разбор фильтров и ANSWER на потоковый ответ. Сравниваются последовательная обработка обновлений
+# (как у run_polling по умолчанию) и ChatOrderedUpdateProcessor. Порядок сообщений одного чата,
+# /healthz и остановка по SIGTERM проверяются в tests/test_update_processor.py и tests/test_webhook_server.py.
+# Запуск из корня проекта: python -m benchmarks.bench_webhook
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:bench")
+os.environ.setdefault("CONVERSATION_PERSISTENCE", "0")
+os.environ.setdefault("CATALOG_SYNC", "0")
+os.environ.setdefault("EMBEDDER", "hashing")
+os.environ.setdefault("OPENAI_TPM", "100000000")
+os.environ.setdefault("OPENAI_RPM", "100000")
+
+import json
+import time
+import socket
+import asyncio
+import statistics
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from config import Config
+import main
+from utils.webhook_server import WebhookServer
+
+USERS = 10
+FILTERS = 0.3
+ANSWER = 0.6
+FINAL_MARK = "конец"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class FakeTelegram:
+    # Минимальный Bot API: getMe, sendMessage, editMessageText, deleteMessage, setWebhook
+
+    def __init__(self):
+        self.port = free_port()
+        self.message_ids = 1000
+        self.finished = {}
+        self.calls = {}
+        self.app = Starlette(routes=[Route("/bot{token}/{method}", self.handle, methods=["POST"])])
+        self.server = uvicorn.Server(uvicorn.Config(self.app, host="127.0.0.1", port=self.port, log_level="warning"))
+
+    def message(self, chat_id, text):
+        self.message_ids += 1
+        return {
+            "message_id": self.message_ids, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "text": text,
+        }
+
+    async def handle(self, request):
+        method = request.path_params["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = {key: values[0] for key, values in parse_qs((await request.body()).decode()).items()}
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method in ("sendMessage", "editMessageText"):
+            chat_id = int(params["chat_id"])
+            if FINAL_MARK in params.get("text", ""):
+                self.finished.setdefault(chat_id, []).append(time.monotonic())
+            result = self.message(chat_id, params.get("text", ""))
+        else:
+            result = True
+        return JSONResponse({"ok": True, "result": result})
+
+
+class Completions:
+    # Заглушка OpenAI: структурированный ответ с фильтрами и потоковый ответ пользователю
+
+    async def create(self, messages, stream=False, **kwargs):
+        if "response_format" in kwargs:
+            await asyncio.sleep(FILTERS)
+            message = SimpleNamespace(content=json.dumps({}), refusal=None)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+        async def chunks():
+            parts = ["Подобрали ", "для вас ", "несколько ", "вариантов, ", FINAL_MARK]
+            for part in parts:
+                await asyncio.sleep(ANSWER / len(parts))
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=part))], usage=None)
+        return chunks()
+
+
+def update(update_id, chat_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": int(time.time()), "text": text,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+        },
+    }
+
+
+async def wait_finished(telegram, expected, timeout=120):
+    deadline = time.monotonic() + timeout
+    while sum(len(times) for times in telegram.finished.values()) < expected:
+        if time.monotonic() > deadline:
+            raise TimeoutError("бот не ответил всем пользователям")
+        await asyncio.sleep(0.02)
+
+
+async def run_mode(name, telegram, concurrent, mailbox, chat_base):
+    Config.CONCURRENT_UPDATES = concurrent
+    Config.CHAT_MAILBOX = mailbox
+    Config.WEBHOOK_PORT = free_port()
+    server = WebhookServer(main.build_application(), health=main.health_stats)
+    task = asyncio.create_task(server.run())
+    base = f"http://127.0.0.1:{Config.WEBHOOK_PORT}"
+    async with httpx.AsyncClient(base_url=base) as client:
+        while True:
+            try:
+                if (await client.get("/healthz")).status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.05)
+
+        telegram.finished.clear()
+        started = time.monotonic()
+        await asyncio.gather(*(
+            client.post(Config.WEBHOOK_PATH, json=update(chat_base + i, chat_base + i, f"Вопрос {i}: что посоветуете?"))
+            for i in range(USERS)
+        ))
+        await wait_finished(telegram, USERS)
+        latencies = [times[0] - started for times in telegram.finished.values()]
+        print(
+            f"{name:<34} все {USERS} ответов за {max(latencies):5.2f} с, "
+            f"медиана {statistics.median(latencies):5.2f} с"
+        )
+
+    server.stop()
+    await task
+
+
+async def run():
+    telegram = FakeTelegram()
+    telegram_task = asyncio.create_task(telegram.server.serve())
+    while not telegram.server.started:
+        await asyncio.sleep(0.01)
+    Config.TELEGRAM_API_URL = f"http://127.0.0.1:{telegram.port}"
+    Config.TELEGRAM_MODE = "webhook"
+    Config.WEBHOOK_LISTEN = "127.0.0.1"
+    Config.WEBHOOK_URL = None
+    # Разные пользователи задают похожие вопросы — кэш ответов исказил бы замер
+    Config.ANSWER_CACHE = False
+    main.openai_client._client = SimpleNamespace(chat=SimpleNamespace(completions=Completions()))
+
+    await run_mode("по очереди (CONCURRENT_UPDATES=1)", telegram, concurrent=1, mailbox=False, chat_base=1000)
+    await run_mode("параллельно, порядок по чатам", telegram, concurrent=64, mailbox=False, chat_base=2000)
+    await run_mode("параллельно + ChatMailbox", telegram, concurrent=64, mailbox=True, chat_base=3000)
+    print(f"вызовы Bot API: {telegram.calls}")
+
+    telegram.server.should_exit = True
+    await telegram_task
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
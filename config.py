@@ -16,7 +16,147 @@ class Config:
     MAX_MESSAGES = os.getenv('MAX_MESSAGES', None)
     TEMPERATURE = float(os.getenv('TEMPERATURE', 0.5))
     ASSISTANT_DELAY = int(os.getenv('ASSISTANT_DELAY', 1))
-    PROXY_URL = os.getenv('PROXY_URL', 1)
+    PROXY_URL = os.getenv('PROXY_URL') or None
     MODEL_GPT4O = "gpt-4o"
     MODEL_GPT4OMINI = "gpt-4o-mini"
-    MAX_TOKENS = 10500
\ No newline at end of file
+    MAX_TOKENS = 10500
+    # Кэш промптов у провайдера: точность времени в промпте (минуты, 0 — до секунды)
+    # и до какой доли бюджета обрезать диалог, когда он перестал в него помещаться
+    TIME_PROMPT_RESOLUTION = int(os.getenv('TIME_PROMPT_RESOLUTION', 15))
+    TRIM_TARGET_RATIO = float(os.getenv('TRIM_TARGET_RATIO', 0.75))
+    # Как часто проверять, не изменились ли файлы промптов
+    PROMPT_RELOAD_INTERVAL = float(os.getenv('PROMPT_RELOAD_INTERVAL', 1.0))
+
+    # История диалогов в памяти: реплик на чат, число чатов, простой до вытеснения и общий лимит памяти
+    MAX_HISTORY_TURNS = int(os.getenv('MAX_HISTORY_TURNS', 60))
+    MAX_CHATS = int(os.getenv('MAX_CHATS', 5000))
+    CHAT_TTL = int(os.getenv('CHAT_TTL', 24 * 3600))
+    CONVERSATION_MEMORY_LIMIT = int(os.getenv('CONVERSATION_MEMORY_LIMIT', 256 * 1024 * 1024))
+    # Журнал диалогов и счётчиков сообщений на диске, пишется фоновым потоком
+    CONVERSATION_PERSISTENCE = os.getenv('CONVERSATION_PERSISTENCE', '1') == '1'
+    CONVERSATION_DB_PATH = os.getenv('CONVERSATION_DB_PATH', 'data/conversations.sqlite3')
+    CONVERSATION_FLUSH_INTERVAL = float(os.getenv('CONVERSATION_FLUSH_INTERVAL', 0.5))
+    CONVERSATION_RETENTION = int(os.getenv('CONVERSATION_RETENTION', 30 * 24 * 3600))
+
+    # База знаний и векторный индекс
+    KNOWLEDGE_DIR = os.getenv('KNOWLEDGE_DIR', 'knowledge_files')
+    VECTOR_STORE = os.getenv('VECTOR_STORE', 'chroma')  # chroma | numpy
+    CHROMA_DB_PATH = os.getenv('CHROMA_DB_PATH', 'chroma_db')
+    NUMPY_INDEX_PATH = os.getenv('NUMPY_INDEX_PATH', 'numpy_index')
+    EMBEDDER = os.getenv('EMBEDDER', 'openai')  # openai | hashing | sentence_transformers
+    EMBEDDING_MODEL = "text-embedding-3-large"
+    EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 64))
+    EMBEDDING_DIMENSIONS = int(os.getenv('EMBEDDING_DIMENSIONS')) if os.getenv('EMBEDDING_DIMENSIONS') else None
+    HASHING_EMBEDDER_DIMENSIONS = int(os.getenv('HASHING_EMBEDDER_DIMENSIONS', 1024))
+    SENTENCE_TRANSFORMER_MODEL = os.getenv('SENTENCE_TRANSFORMER_MODEL', 'paraphrase-multilingual-MiniLM-L12-v2')
+    EMBEDDER_WORKERS = int(os.getenv('EMBEDDER_WORKERS', 4))
+
+    # Гибридный поиск: BM25 по названиям и текстам ЖК + векторный поиск, слияние через RRF
+    HYBRID_SEARCH = os.getenv('HYBRID_SEARCH', '1') == '1'
+    RRF_K = int(os.getenv('RRF_K', 60))
+    LEXICAL_MIN_COVERAGE = float(os.getenv('LEXICAL_MIN_COVERAGE', 0.5))
+
+    # Поиск квартир: columnar — индекс в памяти на numpy, sql — запрос в БД на каждое сообщение
+    APARTMENT_SEARCH_ENGINE = os.getenv('APARTMENT_SEARCH_ENGINE', 'columnar')
+    # Кэш готовых ответов на одинаковые фильтры квартир, сбрасывается при перезагрузке каталога
+    FILTER_CACHE_ENABLED = os.getenv('FILTER_CACHE_ENABLED', '1') == '1'
+    FILTER_CACHE_SIZE = int(os.getenv('FILTER_CACHE_SIZE', 1024))
+    # Файл БД каталога и параметры его перезагрузки
+    DB_PATH = os.getenv('DB_PATH', 'complexes.db')
+    DB_RELOAD_CHECK_INTERVAL = float(os.getenv('DB_RELOAD_CHECK_INTERVAL', 1.0))
+    PARSER_WORKERS = int(os.getenv('PARSER_WORKERS', os.cpu_count() or 1))
+    # Справочник районов для полной пересборки каталога (в JSON ЖК районов нет).
+    # Если файла нет, районы переносятся из текущей БД
+    AREAS_FILE = os.getenv('AREAS_FILE', 'areas.json')
+    # Синхронизация каталога с knowledge_files без перезапуска
+    CATALOG_SYNC = os.getenv('CATALOG_SYNC', '1') == '1'
+    CATALOG_SYNC_DEBOUNCE_MS = int(os.getenv('CATALOG_SYNC_DEBOUNCE_MS', 500))
+    CATALOG_SYNC_POLL_INTERVAL = float(os.getenv('CATALOG_SYNC_POLL_INTERVAL', 30))
+    # Размер пула потоков для запросов к БД и пула соединений SQLAlchemy
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 4))
+
+    # Мониторинг задержки event loop
+    LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', 0.1))
+    LOOP_LAG_WARNING = float(os.getenv('LOOP_LAG_WARNING', 0.25))
+    LOOP_LAG_REPORT_INTERVAL = float(os.getenv('LOOP_LAG_REPORT_INTERVAL', 60))
+
+    # Этапы обработки сообщения: эмбеддинг текста сообщения заранее, пока модель разбирает фильтры
+    SPECULATIVE_EMBEDDING = os.getenv('SPECULATIVE_EMBEDDING', '1') == '1'
+    PIPELINE_STATS_WINDOW = int(os.getenv('PIPELINE_STATS_WINDOW', 500))
+    # Потоковый ответ: заглушка сразу, затем правки сообщения не чаще раза в STREAM_EDIT_INTERVAL секунд
+    STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', '1') == '1'
+    STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', 1.0))
+    STREAM_MIN_CHARS = int(os.getenv('STREAM_MIN_CHARS', 20))
+    STREAM_PLACEHOLDER = os.getenv('STREAM_PLACEHOLDER', '…')
+    # Очередь сообщений на чат: несколько сообщений подряд обрабатываются одним ходом
+    CHAT_MAILBOX = os.getenv('CHAT_MAILBOX', '1') == '1'
+    CHAT_DEBOUNCE = float(os.getenv('CHAT_DEBOUNCE', 0.5))
+    CHAT_DEBOUNCE_MAX = float(os.getenv('CHAT_DEBOUNCE_MAX', 3.0))
+    CHAT_CANCEL_SUPERSEDED = os.getenv('CHAT_CANCEL_SUPERSEDED', '1') == '1'
+    CHAT_DRAIN_TIMEOUT = float(os.getenv('CHAT_DRAIN_TIMEOUT', 30))
+
+    # Приём обновлений Telegram: polling или webhook (свой HTTP-сервер с /healthz).
+    # CONCURRENT_UPDATES — сколько обновлений обрабатывается одновременно, порядок внутри чата сохраняется
+    TELEGRAM_MODE = os.getenv('TELEGRAM_MODE', 'polling')
+    TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL') or None
+    CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', 64))
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL') or None
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+    WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))
+    WEBHOOK_GRACEFUL_TIMEOUT = float(os.getenv('WEBHOOK_GRACEFUL_TIMEOUT', 10))
+
+    # Планировщик запросов к OpenAI: лимиты на модель в минуту, очередь с приоритетами и повторы
+    OPENAI_RPM = int(os.getenv('OPENAI_RPM', 500))
+    OPENAI_TPM = int(os.getenv('OPENAI_TPM', 30000))
+    OPENAI_EMBEDDING_RPM = int(os.getenv('OPENAI_EMBEDDING_RPM', 3000))
+    OPENAI_EMBEDDING_TPM = int(os.getenv('OPENAI_EMBEDDING_TPM', 1000000))
+    # Оценка токенов ответа, которые резервируются до получения фактического usage
+    OPENAI_COMPLETION_ESTIMATE = int(os.getenv('OPENAI_COMPLETION_ESTIMATE', 600))
+    OPENAI_MAX_QUEUE = int(os.getenv('OPENAI_MAX_QUEUE', 1000))
+    OPENAI_QUEUE_TIMEOUT = float(os.getenv('OPENAI_QUEUE_TIMEOUT', 60))
+    OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', 5))
+    OPENAI_BACKOFF_BASE = float(os.getenv('OPENAI_BACKOFF_BASE', 0.5))
+    OPENAI_BACKOFF_MAX = float(os.getenv('OPENAI_BACKOFF_MAX', 20))
+
+    # Пул HTTP-соединений к API: лимиты, таймауты, HTTP/2 (если установлен h2) и прогрев
+    HTTP2 = os.getenv('HTTP2', '1') == '1'
+    HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', 100))
+    HTTP_MAX_KEEPALIVE = int(os.getenv('HTTP_MAX_KEEPALIVE', 20))
+    HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 120))
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+    HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 60))
+    HTTP_WRITE_TIMEOUT = float(os.getenv('HTTP_WRITE_TIMEOUT', 10))
+    HTTP_POOL_TIMEOUT = float(os.getenv('HTTP_POOL_TIMEOUT', 10))
+    HTTP_WARM_CONNECTIONS = int(os.getenv('HTTP_WARM_CONNECTIONS', 4))
+    # Пинг в простое — чаще, чем истекает keep-alive, чтобы соединения не закрывались
+    HTTP_PING_INTERVAL = float(os.getenv('HTTP_PING_INTERVAL', 60))
+
+    # Параметры поиска квартир извлекаются структурированным ответом (JSON по схеме) на мини-модели;
+    # если она не справилась — повтор на запасной модели. 0 — прежний разбор строк «ключ = значение»
+    STRUCTURED_FILTERS = os.getenv('STRUCTURED_FILTERS', '1') == '1'
+    FILTER_MODEL = os.getenv('FILTER_MODEL', MODEL_GPT4OMINI)
+    FILTER_FALLBACK_MODEL = os.getenv('FILTER_FALLBACK_MODEL', MODEL_GPT4O) or None
+    # Быстрый разбор параметров поиска правилами (utils.filter_rules): off — выключен,
+    # shadow — только сверяется с моделью в логах и статистике, on — уверенный разбор заменяет запрос к модели
+    FAST_FILTERS = os.getenv('FAST_FILTERS', 'shadow')
+    FAST_FILTERS_CONFIDENCE = float(os.getenv('FAST_FILTERS_CONFIDENCE', 0.9))
+
+    # Кэш ответов на первые реплики: похожий вопрос (косинус эмбеддингов не ниже порога) с теми же
+    # параметрами поиска получает готовый ответ. Только для чатов, где было не больше
+    # ANSWER_CACHE_MAX_TURNS ответов; сбрасывается при обновлении каталога
+    ANSWER_CACHE = os.getenv('ANSWER_CACHE', '1') == '1'
+    ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', 1000))
+    ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', 6 * 3600))
+    ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', 0.95))
+    ANSWER_CACHE_MAX_TURNS = int(os.getenv('ANSWER_CACHE_MAX_TURNS', 0))
+
+    # Кэш эмбеддингов поисковых фраз
+    EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', 'cache/query_embeddings.sqlite3')
+    EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', 2048))
+    EMBEDDING_CACHE_TTL = int(os.getenv('EMBEDDING_CACHE_TTL', 30 * 24 * 3600))
+    # Сколько строк держать на диске и как часто чистить устаревшие и лишние
+    EMBEDDING_CACHE_MAX_DISK_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_DISK_ENTRIES', 200000))
+    EMBEDDING_CACHE_PRUNE_INTERVAL = int(os.getenv('EMBEDDING_CACHE_PRUNE_INTERVAL', 3600))
@@ -1,3 +1,4 @@
+import asyncio
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext
 from dotenv import load_dotenv
@@ -6,7 +7,18 @@ from models.conversation_manager import ConversationManager, PromptType
 from config import Config
 from utils.db_parser import parse_json_files, parse_filter_text
 from utils.chromadb_client import ChromaDbClient
-from models.query import get_filtered_apartments
+from models.async_query import get_filtered_apartments_async
+from utils.loop_monitor import LoopLagMonitor
+from utils.catalog_sync import CatalogSyncService
+from utils.embedding_cache import normalize_phrase
+from utils.pipeline import Pipeline
+from utils.telegram_stream import StreamingReply
+from utils.filter_rules import rule_filter_extractor
+from utils.answer_cache import answer_cache, make_answer_key
+from models.catalog import get_catalog_version
+from utils.chat_mailbox import ChatMailbox, Turn
+from utils.update_processor import ChatOrderedUpdateProcessor
+from utils.webhook_server import WebhookServer
 from logger_config import logger
 
 load_dotenv()
@@ -14,79 +26,253 @@ load_dotenv()
 openai_client = OpenAIClient()
 chromadb_client = ChromaDbClient(openai_client._client)
 conversation_manager = ConversationManager()
+loop_monitor = LoopLagMonitor()
+catalog_sync = CatalogSyncService(chromadb_client)
+respond_pipeline = Pipeline("respond")
 
-conversation_histories = {}
-user_message_count = {}
+
+@respond_pipeline.stage("speculative_embedding", speculative=True)
+async def speculative_embedding(run):
+    # Пока модель разбирает фильтры, считаем эмбеддинг самого сообщения: если поисковая фраза
+    # совпадёт с ним, векторный поиск возьмёт готовый вектор из кэша запросов; он же ключ кэша ответов
+    if Config.SPECULATIVE_EMBEDDING and chromadb_client.vector_store is not None:
+        return await chromadb_client.embed_query(run.inputs["user_input"])
+
+
+@respond_pipeline.stage("filters")
+async def extract_filters(run):
+    chat_id = run.inputs["chat_id"]
+    fast_filters = None
+    if Config.FAST_FILTERS in ("shadow", "on"):
+        await rule_filter_extractor.refresh()
+        # Уже был ответ в этом чате — сообщение может уточнять прошлый запрос
+        fast_filters, confidence = rule_filter_extractor.extract(
+            run.inputs["user_input"], follow_up=conversation_manager.get_message_count(chat_id) > 0
+        )
+        if Config.FAST_FILTERS == "on" and confidence >= Config.FAST_FILTERS_CONFIDENCE:
+            rule_filter_extractor.stats["skipped_llm"] += 1
+            logger.info(f"Параметры поиска разобраны без модели: {fast_filters}")
+            return fast_filters
+    # Запрашиваем анализ запроса клиента и получаем параметры поиска ЖК и квартир
+    if Config.STRUCTURED_FILTERS:
+        filters = (await openai_client.extract_filters(chat_id, PromptType.MINI_DIALOG)).to_params()
+    else:
+        result = await openai_client.get_gpt4o_mini_response(chat_id, PromptType.MINI_DIALOG)
+        filters = parse_filter_text(result)
+    logger.info(filters)
+    if fast_filters is not None:
+        rule_filter_extractor.record(fast_filters, confidence, filters)
+    return filters
+
+
+@respond_pipeline.stage("cached_answer", deps=("filters",))
+async def cached_answer(run):
+    # Первые реплики диалога часто повторяются: похожий вопрос с теми же параметрами поиска
+    # получает готовый ответ без поиска и без GPT-4o
+    chat_id = run.inputs["chat_id"]
+    if not Config.ANSWER_CACHE:
+        return None
+    if conversation_manager.get_message_count(chat_id) > Config.ANSWER_CACHE_MAX_TURNS:
+        answer_cache.stats["ineligible"] += 1
+        return None
+    version = get_catalog_version()
+    try:
+        embedding = await run.result("speculative_embedding")
+        if embedding is None:
+            embedding = await chromadb_client.embed_query(run.inputs["user_input"])
+    except Exception as e:
+        logger.warning(f"Кэш ответов пропущен, не удалось получить эмбеддинг: {e}")
+        return None
+    key = make_answer_key(run.results["filters"])
+    return {"embedding": embedding, "key": key, "version": version, "answer": answer_cache.get(embedding, key)}
+
+
+def _cache_hit(run):
+    lookup = run.results["cached_answer"]
+    return lookup is not None and lookup["answer"] is not None
+
+
+@respond_pipeline.stage("knowledge_search", deps=("filters", "cached_answer"))
+async def knowledge_search(run):
+    if _cache_hit(run):
+        return None
+    filters = run.results["filters"]
+    if not (filters["complex_search"] or filters["complex_search_phrase"] is not None):
+        run.cancel("speculative_embedding")
+        return None
+    user_phase = filters["complex_search_phrase"]
+    if user_phase is not None and normalize_phrase(user_phase) == normalize_phrase(run.inputs["user_input"]):
+        # Вектор для этой фразы уже считается — дожидаемся его, а не запрашиваем второй раз
+        try:
+            await run.result("speculative_embedding")
+        except Exception:
+            pass
+    else:
+        run.cancel("speculative_embedding")
+    chromadb_result, complex_names = await chromadb_client.search_in_vector_db(user_phase)
+    logger.info('complex_names setted')
+    return chromadb_result
+
+
+@respond_pipeline.stage("apartments", deps=("filters", "cached_answer"))
+async def search_apartments(run):
+    # Поиск квартир не зависит от поиска в базе знаний и идёт параллельно с ним
+    if _cache_hit(run):
+        return None
+    filters = dict(run.results["filters"])
+    filters.pop('complex_search_phrase', None)
+    filters.pop('complex_search', None)
+    results = await get_filtered_apartments_async(**filters)
+    logger.info('--- Результат промежуточного анализа запроса:')
+    logger.info(results)
+    logger.info("-----")
+    return results
+
+
+@respond_pipeline.stage("answer", deps=("knowledge_search", "apartments"))
+async def answer(run):
+    chat_id = run.inputs["chat_id"]
+    lookup = run.results["cached_answer"]
+    if _cache_hit(run):
+        logger.info("Ответ взят из кэша ответов")
+        conversation_manager.add_assistant_message(chat_id, lookup["answer"])
+        run.inputs["turn"].commit()
+        return lookup["answer"]
+    if run.results["knowledge_search"] is not None:
+        conversation_manager.add_update_message(chat_id, run.results["knowledge_search"], "Результат поиска в базе знаний запроса")
+    conversation_manager.add_update_message(chat_id, run.results["apartments"], "Результат промежуточного анализа запроса", volatile=True)
+    # Запрашиваем ответ от GPT-4, передавая результат поиска из векторной базы данных
+    reply = run.inputs["reply"]
+    final_response, input_tokens, _ = await openai_client.create_gpt4o_response(
+        run.inputs["user_input"], chat_id, on_delta=reply.update if reply is not None else None
+    )
+    # Ответ уже в истории — с этого момента ход не отменяется новыми сообщениями
+    run.inputs["turn"].commit()
+    # Без токенов запроса — это текст ошибки обращения к OpenAI, его не кэшируем
+    if lookup is not None and input_tokens:
+        answer_cache.put(lookup["embedding"], lookup["key"], final_response, lookup["version"])
+    return final_response
 
 
 async def start(update: Update, context: CallbackContext):
     chat_id = update.message.chat_id
+    # Недописанный ответ по старому диалогу больше не нужен
+    chat_mailbox.cancel(chat_id)
+    # Сброс диалога обнуляет и счётчик сообщений чата
     conversation_manager.reset_conversation(chat_id)
-
-    if chat_id in user_message_count:
-        del user_message_count[chat_id]
-        
     conversation_manager.initialize_conversation(chat_id)
     conversation_manager.add_user_message(chat_id, "Hello")
     conversation_manager.add_assistant_message(chat_id, Config.WELCOME_PHRASE)
-    user_message_count[chat_id] = 0
 
     await update.message.reply_text(Config.WELCOME_PHRASE.replace("\\n", "\n"))
     
 async def respond(update: Update, context: CallbackContext):
     chat_id = update.message.chat_id
     user_input = update.message.text
+    await conversation_manager.preload(chat_id)
     conversation_manager.initialize_conversation(chat_id)
 
-    if chat_id not in user_message_count:
-        user_message_count[chat_id] = 0
-
-    if Config.MAX_MESSAGES and user_message_count[chat_id] >= int(Config.MAX_MESSAGES):
-        update.message.reply_text(
+    if Config.MAX_MESSAGES and conversation_manager.get_message_count(chat_id) >= int(Config.MAX_MESSAGES):
+        await update.message.reply_text(
             "Вы превысили количество сообщений для демо-версии ИИ Менеджера, по вопросам сотрудничества обращайтесь по номеру +79146738418")
         return
     logger.info('+ Пользователь ++++++++++++++++++++++')
     logger.info(user_input)
     logger.info('+++++++++++++++++++++++')
+    # Сообщение попадает в историю сразу и в порядке прихода, даже если его ход потом склеится со следующим
     conversation_manager.add_user_message(chat_id, user_input)
-    
-    # Запрашиваем анализ запроса клиента и получаем параметры поиска ЖК и квартир
-    result = await openai_client.get_gpt4o_mini_response(chat_id, PromptType.MINI_DIALOG)
-    filters = parse_filter_text(result)
-    logger.info(filters)
-    complex_names = None
-    if filters["complex_search"] or filters["complex_search_phrase"] is not None:
-        user_phase = filters.pop('complex_search_phrase', None)
-        chromadb_result = await chromadb_client.search_in_vector_db(user_phase)
-        conversation_manager.add_update_message(chat_id, chromadb_result, "Результат поиска в базе знаний запроса")
-        logger.info('complex_names setted')
-    # if complex_names:
-        # filters['complex_names'] = complex_names
-    logger.info(filters)
-    filters.pop('complex_search_phrase', None)
-    filters.pop('complex_search', None)
-    results = get_filtered_apartments(**filters)
-    logger.info('--- Результат промежуточного анализа запроса:')
-    logger.info(results)
-    logger.info("-----")
-    
-    conversation_manager.add_update_message(chat_id, results, "Результат промежуточного анализа запроса")
-    
-    # Запрашиваем ответ от GPT-4, передавая результат поиска из векторной базы данных
-    final_response, _, _ = await openai_client.create_gpt4o_response(user_input, chat_id)
+    if Config.CHAT_MAILBOX:
+        chat_mailbox.submit(chat_id, update)
+    else:
+        await process_turn(Turn(chat_id, [update]))
+
+
+async def process_turn(turn: Turn):
+    chat_id = turn.chat_id
+    message = turn.items[-1].message
+    user_input = "\n".join(update.message.text for update in turn.items)
+
+    reply = None
+    if Config.STREAM_RESPONSES:
+        # Заглушка уходит сразу, дальше она правится по мере генерации ответа
+        reply = StreamingReply(message)
+        await reply.start()
+    try:
+        run = await respond_pipeline.run(chat_id=chat_id, user_input=user_input, reply=reply, turn=turn)
+    except asyncio.CancelledError:
+        # Пришли новые сообщения — этот ответ уже не нужен, его заменит ответ на все сообщения сразу
+        if reply is not None:
+            await reply.discard()
+        raise
+    except Exception:
+        if reply is not None:
+            await reply.finish("Произошла ошибка при обработке запроса.")
+        raise
+    final_response = run.results["answer"]
     logger.info('+ Ответ ++++++++++++++++++++++')
     logger.info(final_response)
     logger.info('+++++++++++++++++++++++')
-    user_message_count[chat_id] += 1
-    await update.message.reply_text(final_response)
+    conversation_manager.increment_message_count(chat_id)
+    if reply is not None:
+        await reply.finish(final_response)
+    else:
+        await message.reply_text(final_response)
 
 
-def main():
-    # parse_json_files()
-    application = Application.builder().token(Config.TELEGRAM_BOT_TOKEN).build()
+chat_mailbox = ChatMailbox(process_turn)
+
+
+async def post_init(application: Application):
+    loop_monitor.start()
+    # Соединения к OpenAI открываются до первого пользователя и дальше поддерживаются в простое
+    await openai_client.http_pool.start()
+    if Config.CATALOG_SYNC:
+        # Догружаем изменённые файлы в каталог и индекс и дальше следим за knowledge_files
+        await catalog_sync.start()
+    else:
+        # Досчитываем эмбеддинги только для новых или изменённых файлов базы знаний
+        await chromadb_client.load_knowledge_files()
+
+
+async def post_shutdown(application: Application):
+    await chat_mailbox.drain(timeout=Config.CHAT_DRAIN_TIMEOUT)
+    await catalog_sync.stop()
+    await loop_monitor.stop()
+    conversation_manager.close()
+    await openai_client.http_pool.stop()
+
+
+def health_stats():
+    return {
+        "mailbox": chat_mailbox.get_stats(),
+        "openai_queue": openai_client.scheduler.get_stats()["queue_depth"],
+        "loop_lag": loop_monitor.stats(),
+    }
+
+
+def build_application():
+    builder = Application.builder().token(Config.TELEGRAM_BOT_TOKEN).post_init(post_init).post_shutdown(post_shutdown)
+    if Config.TELEGRAM_API_URL:
+        builder = builder.base_url(f"{Config.TELEGRAM_API_URL.rstrip('/')}/bot")
+    if Config.CONCURRENT_UPDATES > 1:
+        builder = builder.concurrent_updates(ChatOrderedUpdateProcessor(Config.CONCURRENT_UPDATES))
+    if Config.TELEGRAM_MODE == "webhook":
+        # Обновления принимает свой HTTP-сервер, Updater для опроса не нужен
+        builder = builder.updater(None)
+    application = builder.build()
     application.add_handler(CommandHandler("start", start))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, respond))
-    application.run_polling()
+    return application
+
+
+def main():
+    # parse_json_files()
+    application = build_application()
+    if Config.TELEGRAM_MODE == "webhook":
+        server = WebhookServer(application, post_init=post_init, post_shutdown=post_shutdown, health=health_stats)
+        asyncio.run(server.run())
+    else:
+        application.run_polling()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,154 @@
+import re
+from typing import List, Literal, Optional
+from pydantic import BaseModel, ConfigDict, Field, ValidationInfo, field_validator, model_validator
+
+INVALID_AREA = "неправильный район"
+DEFAULT_LIMIT = 3
+
+
+def parse_number(value):
+    # «5 000 000», «5,5 млн», «3.2млн», «800 тыс» → число; всё, что не похоже на число, — None.
+    # Дробная часть сохраняется («7.5» без единиц может оказаться миллионами), округляет вызывающий
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value) if float(value).is_integer() else value
+    text = str(value).lower().replace("\u00A0", " ").replace("\u202F", " ")
+    match = re.search(r"\d[\d\s]*(?:[.,]\d+)?", text)
+    if not match:
+        return None
+    number = float(match.group(0).replace(" ", "").replace(",", "."))
+    if "млн" in text[match.end():]:
+        number *= 1_000_000
+    elif "тыс" in text[match.end():]:
+        number *= 1_000
+    return int(number) if number.is_integer() else number
+
+
+def normalize_city(value):
+    if not value:
+        return None
+    value = value.strip()
+    return "Артём" if value.lower() == "артем" else value
+
+
+# Параметры поиска квартир, которые модель извлекает из диалога.
+# Поля и описания повторяют параметры промпта promt_dialog.docx, схема уходит в response_format.
+class ApartmentFilters(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    complex_search: bool = Field(False, description="Поиск ЖК: да, если ЖК ищут по признакам (море, школа и т.п.)")
+    city: Optional[str] = Field(None, description="Город: Владивосток, Артём или null")
+    complex_search_phrase: Optional[str] = Field(
+        None, description="Фраза для поиска ЖК по признакам, без комнат, района, площади и цены"
+    )
+    complex_names: Optional[List[str]] = Field(
+        None, description="Английские названия выбранных ЖК из списка соответствия"
+    )
+    area: Optional[str] = Field(None, description="Район, если выбран конкретный район из списка")
+    num_rooms: Optional[List[int]] = Field(None, description="Количество комнат, 0 — студия; null — любое")
+    min_square: Optional[int] = Field(None, description="Минимальная площадь, м²")
+    max_square: Optional[int] = Field(None, description="Максимальная площадь, м²")
+    # В схеме цена — number: модель может ответить дробными миллионами (7.5), после проверки это целые рубли
+    min_price: Optional[float] = Field(None, description="Минимальная цена в рублях")
+    max_price: Optional[float] = Field(None, description="Максимальная цена в рублях")
+    sort_price: Optional[Literal["asc", "desc"]] = Field(
+        None, description="asc — ищут дешёвые квартиры, desc — дорогие"
+    )
+    full_list: bool = Field(False, description="Весь список: пользователь просит показать все варианты")
+
+    @field_validator("city", "area", "complex_search_phrase", mode="before")
+    @classmethod
+    def _empty_to_none(cls, value):
+        if isinstance(value, str) and value.strip().lower() in ("", "пусто", "null", "none"):
+            return None
+        return value
+
+    @field_validator("city")
+    @classmethod
+    def _city(cls, value):
+        return normalize_city(value)
+
+    @field_validator("complex_names")
+    @classmethod
+    def _complex_names(cls, value):
+        names = [name.strip() for name in value or [] if name and name.strip()]
+        return names or None
+
+    @field_validator("num_rooms")
+    @classmethod
+    def _num_rooms(cls, value):
+        rooms = sorted({room for room in value or [] if 0 <= room <= 10})
+        return rooms or None
+
+    @field_validator("min_square", "max_square", "min_price", "max_price", mode="before")
+    @classmethod
+    def _number(cls, value, info: ValidationInfo):
+        if value is not None and not isinstance(value, int):
+            value = parse_number(value)
+        # Площадь — целые м², цена остаётся дробной до масштабирования в _price
+        if info.field_name.endswith("_square") and isinstance(value, float):
+            return round(value)
+        return value
+
+    @field_validator("min_price", "max_price")
+    @classmethod
+    def _price(cls, value):
+        # Модель иногда пишет цену в миллионах: квартир дешевле тысячи рублей не бывает.
+        # Масштабируем дробное значение и только потом округляем до рубля
+        if value is None or value <= 0:
+            return None
+        if value < 1000:
+            value *= 1_000_000
+        return round(value)
+
+    @model_validator(mode="after")
+    def _bounds(self):
+        if self.min_square is not None and self.max_square is not None and self.min_square > self.max_square:
+            self.min_square, self.max_square = self.max_square, self.min_square
+        if self.min_price is not None and self.max_price is not None and self.min_price > self.max_price:
+            self.min_price, self.max_price = self.max_price, self.min_price
+        return self
+
+    def to_params(self):
+        # Тот же словарь, что возвращает parse_filter_text: дальше по конвейеру ничего не меняется
+        invalid_area = self.area is not None and self.area.strip().lower() == INVALID_AREA
+        return {
+            "complex_search": self.complex_search,
+            "city": self.city,
+            "area": None if invalid_area or self.area is None else self.area.strip().lower(),
+            "complex_search_phrase": self.complex_search_phrase,
+            "complex_names": self.complex_names,
+            "num_rooms": self.num_rooms,
+            "min_square": self.min_square,
+            "max_square": self.max_square,
+            "min_price": self.min_price,
+            "max_price": self.max_price,
+            "sort_price": self.sort_price,
+            "isfilter": not invalid_area,
+            "limit": None if self.full_list else DEFAULT_LIMIT,
+        }
+
+
+def _strict_schema(schema):
+    # Structured Outputs в strict-режиме: все поля обязательны (необязательные — через null),
+    # лишние поля запрещены, значения по умолчанию не допускаются
+    if isinstance(schema, dict):
+        schema = {key: _strict_schema(value) for key, value in schema.items() if key not in ("default", "title")}
+        if schema.get("type") == "object" and "properties" in schema:
+            schema["required"] = list(schema["properties"])
+            schema["additionalProperties"] = False
+        return schema
+    if isinstance(schema, list):
+        return [_strict_schema(item) for item in schema]
+    return schema
+
+
+FILTER_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "apartment_filters",
+        "strict": True,
+        "schema": _strict_schema(ApartmentFilters.model_json_schema()),
+    },
+}
@@ -0,0 +1,188 @@
+import threading
+import numpy as np
+from sqlalchemy import select
+from models.models import Apartment, ResidentialComplex, Area, Session
+from models.catalog import get_catalog_version
+from logger_config import logger
+
+
+class ApartmentSearchEngine:
+    # Колоночный индекс каталога в памяти. Строится один раз на версию каталога,
+    # фильтры считаются векторными масками numpy без обращения к БД.
+
+    def __init__(self, version, complexes, areas, apartments):
+        self.version = version
+
+        # ЖК: позиции в массивах совпадают с порядком id
+        self._complexes = complexes
+        self._complex_position = {c["id"]: i for i, c in enumerate(complexes)}
+        self._complex_names = np.array([c["complex_name"] for c in complexes], dtype=object)
+        self._complex_cities = np.array([c["city"] for c in complexes], dtype=object)
+        self._complex_area_ids = np.array(
+            [c["area_id"] if c["area_id"] is not None else -1 for c in complexes], dtype=np.int64
+        )
+
+        # Районы: для района — он сам и его микрорайоны, для микрорайона — только он сам
+        self._area_names = {area["id"]: area["name"] for area in areas}
+        self._area_by_name = {}
+        for area in areas:
+            self._area_by_name.setdefault(area["name"], area)
+        self._area_members = {}
+        for area in areas:
+            members = {area["id"]}
+            if area["parent_id"] is None:
+                members.update(a["id"] for a in areas if a["parent_id"] == area["id"])
+            self._area_members[area["id"]] = np.array(sorted(members), dtype=np.int64)
+
+        # Квартиры: числовые колонки для фильтров, исходные значения — для вывода
+        self._apartments = apartments
+        self._apartment_ids = np.array([a["id"] for a in apartments], dtype=np.int64)
+        self._prices = np.array([np.nan if a["price"] is None else a["price"] for a in apartments], dtype=np.float64)
+        self._sizes = np.array([np.nan if a["size_sqm"] is None else a["size_sqm"] for a in apartments], dtype=np.float64)
+        self._rooms = np.array([np.nan if a["num_rooms"] is None else a["num_rooms"] for a in apartments], dtype=np.float64)
+        self._apartment_complex = np.array(
+            [self._complex_position.get(a["complex_id"], -1) for a in apartments], dtype=np.int64
+        )
+        self._apartments_by_complex = {}
+        for i, a in enumerate(apartments):
+            self._apartments_by_complex.setdefault(a["complex_id"], []).append(i)
+
+    @classmethod
+    def load(cls, session, version):
+        complexes = [
+            row._asdict() for row in session.execute(
+                select(
+                    ResidentialComplex.id,
+                    ResidentialComplex.complex_name,
+                    ResidentialComplex.city,
+                    ResidentialComplex.area_id,
+                    ResidentialComplex.short_text,
+                    ResidentialComplex.general_texts,
+                ).order_by(ResidentialComplex.id)
+            )
+        ]
+        areas = [
+            row._asdict() for row in session.execute(
+                select(Area.id, Area.name, Area.parent_id).order_by(Area.id)
+            )
+        ]
+        apartments = [
+            row._asdict() for row in session.execute(
+                select(
+                    Apartment.id,
+                    Apartment.apartment_type,
+                    Apartment.price,
+                    Apartment.size_sqm,
+                    Apartment.num_rooms,
+                    Apartment.complex_id,
+                ).order_by(Apartment.id)
+            )
+        ]
+        logger.info(f"Колоночный индекс каталога построен: ЖК {len(complexes)}, квартир {len(apartments)}, версия {version}")
+        return cls(version, complexes, areas, apartments)
+
+    def _complex_mask(self, city, complex_names, area_members):
+        mask = np.ones(len(self._complexes), dtype=bool)
+        if complex_names:
+            mask &= np.isin(self._complex_names, list(complex_names))
+        if city is not None:
+            mask &= self._complex_cities == city
+        if area_members is not None:
+            mask &= np.isin(self._complex_area_ids, area_members)
+        return mask
+
+    def find(
+        self,
+        area=None,
+        num_rooms=None,
+        min_square=None,
+        max_square=None,
+        min_price=None,
+        max_price=None,
+        city=None,
+        sort_price="asc",
+        complex_names=None,
+    ):
+        # Тот же контракт, что и у SQL-пути: строки в порядке выдачи и список ЖК района
+        area_members = None
+        complex_filtered = ""
+        if area is not None:
+            area_row = self._area_by_name.get(area)
+            if area_row is None:
+                return [], ""
+            area_members = self._area_members[area_row["id"]]
+            area_complexes = self._complex_mask(city, None, area_members)
+            complex_filtered = "Список ЖК в этом районе, но не факт что в них есть квартира: \n"
+            complex_filtered += "\n".join(
+                f"{c['short_text']} ({c['city']}, {self._area_names.get(c['area_id'])})"
+                for c in (self._complexes[i] for i in np.flatnonzero(area_complexes))
+                if c["short_text"]
+            )
+
+        mask = ~np.isnan(self._prices)
+        if num_rooms is not None:
+            mask &= np.isin(self._rooms, list(num_rooms))
+        if min_square is not None:
+            mask &= self._sizes >= min_square
+        if max_square is not None:
+            mask &= self._sizes <= max_square
+        if min_price is not None:
+            mask &= self._prices >= min_price
+        if max_price is not None:
+            mask &= self._prices <= max_price
+        complex_mask = self._complex_mask(city, complex_names, area_members)
+        mask &= (self._apartment_complex >= 0) & complex_mask[self._apartment_complex]
+
+        selected = np.flatnonzero(mask)
+        prices = self._prices[selected]
+        order = np.lexsort((self._apartment_ids[selected], -prices if sort_price == "desc" else prices))
+        rows = []
+        for i in selected[order]:
+            apartment = self._apartments[i]
+            complex_row = self._complexes[self._apartment_complex[i]]
+            rows.append((
+                complex_row["complex_name"],
+                apartment["apartment_type"],
+                apartment["price"],
+                apartment["num_rooms"],
+                apartment["size_sqm"],
+                complex_row["general_texts"],
+            ))
+        return rows, complex_filtered
+
+    def complex_details(self, complex_name):
+        # Те же строки, что и у SQL-пути: ЖК с названием района и его квартиры по id, или None
+        positions = np.flatnonzero(self._complex_names == complex_name)
+        if len(positions) == 0:
+            return None
+        complex_row = self._complexes[positions[0]]
+        details = {
+            "complex_name": complex_row["complex_name"],
+            "city": complex_row["city"],
+            "area_name": self._area_names.get(complex_row["area_id"]),
+            "short_text": complex_row["short_text"],
+            "general_texts": complex_row["general_texts"],
+        }
+        apartments = [self._apartments[i] for i in self._apartments_by_complex.get(complex_row["id"], [])]
+        return details, apartments
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_apartment_search_engine():
+    # Индекс перестраивается лениво при первом запросе после смены версии каталога
+    global _engine
+    version = get_catalog_version()
+    engine = _engine
+    if engine is not None and engine.version == version:
+        return engine
+    with _engine_lock:
+        if _engine is None or _engine.version != version:
+            session = Session()
+            try:
+                _engine = ApartmentSearchEngine.load(session, version)
+            finally:
+                session.close()
+        return _engine
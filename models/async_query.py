@@ -0,0 +1,32 @@
+import asyncio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from models.models import session_scope
+from models.query import get_filtered_apartments, format_complex_with_apartments, get_complex_info_by_names
+
+# Запросы к SQLite блокирующие, поэтому выполняются в отдельном пуле потоков, а не в event loop.
+# Размер пула совпадает с размером пула соединений движка, так что каждый поток держит не больше одного соединения.
+_executor = ThreadPoolExecutor(max_workers=Config.DB_POOL_SIZE, thread_name_prefix="db")
+
+
+async def run_in_db_executor(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+
+async def get_filtered_apartments_async(**filters):
+    return await run_in_db_executor(get_filtered_apartments, **filters)
+
+
+def _format_complex_with_apartments(complex_name):
+    with session_scope() as session:
+        return format_complex_with_apartments(session, complex_name)
+
+
+async def format_complex_with_apartments_async(complex_name):
+    return await run_in_db_executor(_format_complex_with_apartments, complex_name)
+
+
+async def get_complex_info_by_names_async(complex_name_list):
+    return await run_in_db_executor(get_complex_info_by_names, complex_name_list)
@@ -0,0 +1,67 @@
+import os
+import time
+import threading
+
+# Версия каталога квартир. Всё, что кэширует данные каталога, сверяется с ней
+# и перестраивается после перезагрузки данных.
+_catalog_version = 0
+_lock = threading.Lock()
+
+# Файл БД каталога. parse_json_files подменяет его целиком (os.replace), синхронизация меняет
+# отдельные ЖК на месте — другие процессы узнают об этом по смене inode или времени изменения файла
+# и тоже поднимают версию.
+_watched_path = None
+_watched_identity = None
+_on_replaced = []
+_check_interval = 1.0
+_next_check = 0.0
+
+
+def _file_identity(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def watch_catalog_file(path, on_replaced=None, check_interval=1.0):
+    global _watched_path, _watched_identity, _check_interval
+    with _lock:
+        _watched_path = path
+        _watched_identity = _file_identity(path)
+        _check_interval = check_interval
+        if on_replaced is not None:
+            _on_replaced.append(on_replaced)
+
+
+def _check_catalog_file():
+    global _catalog_version, _watched_identity, _next_check
+    now = time.monotonic()
+    if _watched_path is None or now < _next_check:
+        return
+    with _lock:
+        _next_check = now + _check_interval
+        identity = _file_identity(_watched_path)
+        if identity is None or identity == _watched_identity:
+            return
+        _watched_identity = identity
+        _catalog_version += 1
+        callbacks = list(_on_replaced)
+    for callback in callbacks:
+        callback()
+
+
+def get_catalog_version():
+    _check_catalog_file()
+    return _catalog_version
+
+
+def bump_catalog_version():
+    global _catalog_version, _watched_identity
+    with _lock:
+        _catalog_version += 1
+        # Файл изменили в этом же процессе — повторно реагировать на это не нужно
+        if _watched_path is not None:
+            _watched_identity = _file_identity(_watched_path)
+        return _catalog_version
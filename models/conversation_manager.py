@@ -1,10 +1,18 @@
+import sys
+import time
+import asyncio
 import pytz
-# from utils.helpers import trim_conversation_history
-# from config import Config
-from docx import Document
+from collections import OrderedDict, deque
+from config import Config
+from utils.helpers import count_message_tokens, REPLY_TOKEN_OVERHEAD
 from enum import Enum
 from datetime import datetime
-from logger_config import logger
+from models.conversation_store import ConversationStore
+from models.prompt_registry import PromptRegistry
+
+
+# Ключ основного промпта диалога в реестре промптов
+MAIN_PROMPT = "main"
 
 
 class Role(Enum):
@@ -26,53 +34,267 @@ weekdays = {
     6: 'Воскресенье',
 }    
     
-def get_vladivostok_time():
+def get_vladivostok_time(resolution_minutes=None):
     vladivostok_tz = pytz.timezone('Asia/Vladivostok')
     vladivostok_time = datetime.now(vladivostok_tz)
     weekday = weekdays[vladivostok_time.weekday()]
+    if resolution_minutes:
+        # Время с точностью до resolution_minutes: строка не меняется от запроса к запросу
+        minute = vladivostok_time.minute - vladivostok_time.minute % resolution_minutes
+        vladivostok_time = vladivostok_time.replace(minute=minute)
+        return f"{weekday}, {vladivostok_time.strftime('%Y-%m-%d %H:%M')}"
     return f"{weekday}, {vladivostok_time.strftime('%Y-%m-%d %H:%M:%S')}"
+
+
+def assemble_messages(prompt, turns, context=(), tail=()):
+    # Сообщения идут от самых стабильных к самым изменчивым: статический промпт, диалог
+    # (от хода к ходу только дописывается в конец), затем вставки, которые меняются каждый ход,
+    # и время, округлённое до TIME_PROMPT_RESOLUTION. Так общий префикс соседних запросов
+    # максимален и попадает в кэш промптов провайдера.
+    messages = [{"role": Role.SYSTEM.value, "content": prompt}]
+    messages.extend(message.as_dict() for message in turns)
+    messages.extend(message.as_dict() for message in context)
+    messages.extend({"role": Role.SYSTEM.value, "content": content} for content in tail)
+    return messages
     
     
+# Примерные накладные расходы на объекты сверх размера строк, для оценки памяти на чат
+MESSAGE_OVERHEAD = sys.getsizeof(object()) + 3 * 8
+CHAT_OVERHEAD = 1024
+
+
+class Message:
+    # Число токенов считается один раз при создании сообщения
+    __slots__ = ("role", "content", "nbytes", "tokens", "seq", "volatile")
+
+    def __init__(self, role, content, volatile=False):
+        self.role = role
+        self.content = content
+        self.nbytes = MESSAGE_OVERHEAD + sys.getsizeof(content)
+        self.tokens = count_message_tokens(content)
+        # seq — порядковый номер в диалоге; volatile — вставка, которая меняется каждый ход
+        self.seq = 0
+        self.volatile = volatile
+
+    def as_dict(self):
+        return {"role": self.role, "content": self.content}
+
+
+class ChatState:
+    # Диалог чата: реплики в ограниченной очереди и именованные системные вставки
+    # (результат поиска в базе знаний, результат фильтра и т.п.), которые заменяются целиком.
+    __slots__ = ("turns", "slots", "last_seen", "nbytes", "message_count", "turn_tokens", "slot_tokens", "seq")
+
+    def __init__(self, max_turns):
+        self.turns = deque(maxlen=max_turns)
+        self.slots = OrderedDict()
+        self.last_seen = time.monotonic()
+        self.nbytes = CHAT_OVERHEAD
+        self.message_count = 0
+        self.turn_tokens = 0
+        self.slot_tokens = 0
+        self.seq = 0
+
+    def _next_seq(self):
+        self.seq += 1
+        return self.seq
+
+    def add_turn(self, message):
+        if len(self.turns) == self.turns.maxlen:
+            self._pop_oldest_turn()
+        message.seq = self._next_seq()
+        self.turns.append(message)
+        self.nbytes += message.nbytes
+        self.turn_tokens += message.tokens
+
+    def _pop_oldest_turn(self):
+        removed = self.turns.popleft()
+        self.nbytes -= removed.nbytes
+        self.turn_tokens -= removed.tokens
+
+    def set_slot(self, name, message):
+        previous = self.slots.pop(name, None)
+        if previous is not None:
+            self.nbytes -= previous.nbytes
+            self.slot_tokens -= previous.tokens
+        # Обновлённая вставка идёт последней, чтобы не оказаться где-то позади
+        message.seq = self._next_seq()
+        self.slots[name] = message
+        self.nbytes += message.nbytes
+        self.slot_tokens += message.tokens
+
+    def render(self):
+        # Редко меняющиеся вставки остаются на месте в диалоге, где их последний раз обновили,
+        # и не сбивают кэш префикса на следующих ходах. Вставки, которые обновляются каждый ход,
+        # возвращаются отдельно — их место в самом конце.
+        anchored = sorted((m for m in self.slots.values() if not m.volatile), key=lambda m: m.seq)
+        volatile = [m for m in self.slots.values() if m.volatile]
+        if not anchored:
+            return list(self.turns), volatile
+        dialog = []
+        position = 0
+        for turn in self.turns:
+            while position < len(anchored) and anchored[position].seq < turn.seq:
+                dialog.append(anchored[position])
+                position += 1
+            dialog.append(turn)
+        dialog.extend(anchored[position:])
+        return dialog, volatile
+
+    def trim(self, budget, target=None):
+        # Старые реплики уходят, пока диалог не уложится в бюджет; последняя реплика остаётся всегда.
+        # Каждая реплика удаляется не больше одного раза, поэтому в среднем O(1) на реплику.
+        # Обрезаем сразу до target < budget: начало диалога потом не меняется несколько ходов
+        # и остаётся в кэше промптов, а не сдвигается на каждом запросе.
+        if self.turn_tokens <= budget:
+            return
+        target = budget if target is None else target
+        while len(self.turns) > 1 and self.turn_tokens > target:
+            self._pop_oldest_turn()
+
+
 class ConversationManager:
     
     _instance = None  
     
     DEFAULT_PROMPT_PATH = "promts/promt.docx"  # Дефолтный путь
     MINI_PROMPT_PATH = "promts/promt_dialog.docx"  # Путь для решения успешности диалога
+    MINI_PING_PROMPT_PATH = "promts/promt_ping.docx"  # Пока файла нет, используется промпт диалога
 
     def __new__(cls, *args, **kwargs):
         if not cls._instance:
             cls._instance = super().__new__(cls)
-            cls._instance.conversation_histories = {} 
+            # Чаты в порядке последней активности: в начале — самые давние, их и вытесняем
+            cls._instance.chats = OrderedDict()
+            cls._instance.total_bytes = 0
+            cls._instance.stats = {"evicted_lru": 0, "evicted_ttl": 0, "evicted_memory": 0, "restored": 0}
+            # Поправка оценки токенов по фактическому usage из ответов API
+            cls._instance.prompt_token_ratio = 1.0
+            cls._instance.token_stats = {"requests": 0, "estimated_prompt_tokens": 0, "actual_prompt_tokens": 0}
+            # Вытесненный из памяти или потерянный при перезапуске чат поднимается из журнала при первом обращении
+            cls._instance.store = None
+            if Config.CONVERSATION_PERSISTENCE:
+                cls._instance.store = ConversationStore(
+                    Config.CONVERSATION_DB_PATH,
+                    flush_interval=Config.CONVERSATION_FLUSH_INTERVAL,
+                    max_turns=Config.MAX_HISTORY_TURNS,
+                    retention=Config.CONVERSATION_RETENTION,
+                )
         return cls._instance
     
     def __init__(self):
-        self.promt = self._read_prompt_from_word(self.DEFAULT_PROMPT_PATH)
-        self.mini_promt_dialog = self._read_prompt_from_word(self.MINI_PROMPT_PATH)
+        # Синглтон: __init__ вызывается при каждом ConversationManager(), промпты регистрируем один раз
+        if getattr(self, "_initialized", False):
+            return
+        self.prompts = PromptRegistry(check_interval=Config.PROMPT_RELOAD_INTERVAL)
+        self.prompts.register(MAIN_PROMPT, self.DEFAULT_PROMPT_PATH)
+        self.prompts.register(PromptType.MINI_DIALOG, self.MINI_PROMPT_PATH)
+        self.prompts.register(PromptType.MINI_PING, self.MINI_PING_PROMPT_PATH, fallback=PromptType.MINI_DIALOG)
+        self.time_prompt_tokens = count_message_tokens(self._time_prompt())
+        self._initialized = True
 
-    def _read_prompt_from_word(self, file_path: str) -> str:
-        try:
-            document = Document(file_path)
-            return "\n".join([para.text for para in document.paragraphs])
-        except Exception as e:
-            logger.error(f"Ошибка при чтении файла {file_path}: {e}")
-            return "Произошла ошибка при загрузке промпта."
+    @property
+    def promt(self):
+        return self.prompts.get(MAIN_PROMPT).text
+
+    def _get_chat(self, chat_id, create=True):
+        chat = self.chats.get(chat_id)
+        if chat is None:
+            chat = self._restore(chat_id)
+            if chat is None:
+                if not create:
+                    return None
+                chat = ChatState(Config.MAX_HISTORY_TURNS)
+            self._attach(chat_id, chat)
+        else:
+            self.chats.move_to_end(chat_id)
+        chat.last_seen = time.monotonic()
+        return chat
+
+    def _attach(self, chat_id, chat):
+        self.chats[chat_id] = chat
+        self.total_bytes += chat.nbytes
+        chat.last_seen = time.monotonic()
+
+    async def preload(self, chat_id):
+        # Чат, которого нет в памяти, поднимается из журнала в потоке, а не в цикле событий.
+        # Вызывается в начале обработки сообщения; синхронный _restore остаётся запасным путём.
+        if self.store is None or chat_id in self.chats:
+            return
+        events, message_count = await asyncio.get_running_loop().run_in_executor(None, self.store.load, chat_id)
+        if chat_id in self.chats:
+            return
+        chat = self._build_chat(events, message_count)
+        if chat is None:
+            # Нового чата в журнале нет: пустое состояние, чтобы _restore не читал БД из цикла событий
+            chat = ChatState(Config.MAX_HISTORY_TURNS)
+        self._attach(chat_id, chat)
+        self._evict()
+
+    def _restore(self, chat_id):
+        if self.store is None:
+            return None
+        return self._build_chat(*self.store.load(chat_id))
+
+    def _build_chat(self, events, message_count):
+        if not events and not message_count:
+            return None
+        chat = ChatState(Config.MAX_HISTORY_TURNS)
+        for kind, name, role, content in events:
+            if kind == ConversationStore.TURN:
+                chat.add_turn(Message(role, content))
+            elif kind == ConversationStore.SLOT:
+                chat.set_slot(name, Message(role, content))
+        chat.message_count = message_count
+        self.stats["restored"] += 1
+        return chat
+
+    def _update(self, chat, change, *args):
+        before = chat.nbytes
+        change(*args)
+        self.total_bytes += chat.nbytes - before
+        self._evict()
+
+    def _evict(self):
+        # Простаивающие дольше TTL, лишние сверх MAX_CHATS и самые давние при превышении лимита памяти.
+        # Самый свежий чат не вытесняется, даже если он один больше лимита.
+        now = time.monotonic()
+        while len(self.chats) > 1:
+            chat_id, chat = next(iter(self.chats.items()))
+            if now - chat.last_seen > Config.CHAT_TTL:
+                reason = "evicted_ttl"
+            elif len(self.chats) > Config.MAX_CHATS:
+                reason = "evicted_lru"
+            elif self.total_bytes > Config.CONVERSATION_MEMORY_LIMIT:
+                reason = "evicted_memory"
+            else:
+                break
+            self._drop(chat_id)
+            self.stats[reason] += 1
+
+    def _drop(self, chat_id):
+        chat = self.chats.pop(chat_id, None)
+        if chat is not None:
+            self.total_bytes -= chat.nbytes
 
     def initialize_conversation(self, chat_id):
-        if chat_id not in self.conversation_histories:
-            self.conversation_histories[chat_id]=[{"role": Role.SYSTEM.value, "content": self.promt}]
+        self._get_chat(chat_id)
+        self._evict()
 
     def reset_conversation(self, chat_id):
-        if chat_id in self.conversation_histories:
-            del self.conversation_histories[chat_id]
+        self._drop(chat_id)
+        if self.store is not None:
+            self.store.reset(chat_id)
+        # После сброса поднимать из журнала нечего — чат начинается пустым без чтения БД
+        self._attach(chat_id, ChatState(Config.MAX_HISTORY_TURNS))
                     
-    def add_update_message(self, chat_id, content, rep_text):
-        # удаляем старую запись и вставляем новую, чтобы она не была где-то позади
-        self.conversation_histories[chat_id] = [
-            msg for msg in self.conversation_histories[chat_id]
-            if not (msg['role'] == Role.SYSTEM.value and rep_text in msg['content'])
-        ]
-        self.add_message(chat_id, Role.SYSTEM, content)
+    def add_update_message(self, chat_id, content, rep_text, volatile=False):
+        # заменяем прежнюю вставку с тем же назначением;
+        # volatile=True для вставок, которые обновляются на каждом ходе (идут в конец запроса)
+        chat = self._get_chat(chat_id)
+        self._update(chat, chat.set_slot, rep_text, Message(Role.SYSTEM.value, content, volatile))
+        if self.store is not None:
+            self.store.append_slot(chat_id, rep_text, Role.SYSTEM.value, content)
             
     def add_user_message(self, chat_id, content):
         self.add_message(chat_id, Role.USER, content)
@@ -81,29 +303,105 @@ class ConversationManager:
         self.add_message(chat_id, Role.ASSISTANT, content)
 
     def add_message(self, chat_id, role, content):
-        self.conversation_histories[chat_id].append({"role": role.value, "content": content})
+        chat = self._get_chat(chat_id)
+        self._update(chat, chat.add_turn, Message(role.value, content))
+        if self.store is not None:
+            self.store.append_turn(chat_id, role.value, content)
+
+    @staticmethod
+    def _time_prompt():
+        return f"Текущее время во Владивостоке: {get_vladivostok_time(Config.TIME_PROMPT_RESOLUTION)}"
 
     def get_history(self, chat_id):
-        vladivostok_time = get_vladivostok_time()
-        time_promt  = list()
-        time_promt.append({"role": Role.SYSTEM.value, "content": f"Текущее время во Владивостоке: {vladivostok_time}"})
-        b = self.conversation_histories.get(chat_id, [])
-        # print(b)
-        return self.conversation_histories.get(chat_id, []) + time_promt
+        chat = self._get_chat(chat_id, create=False)
+        if chat is None:
+            return [{"role": Role.SYSTEM.value, "content": self._time_prompt()}]
+        dialog, context = chat.render()
+        return assemble_messages(self.promt, dialog, context, tail=[self._time_prompt()])
     
     def get_history_for_mini(self, chat_id, prompt_type: PromptType = PromptType.MINI_DIALOG):
-        prompt_map = {
-            PromptType.MINI_DIALOG: self.mini_promt_dialog,
-        }
-        prompt = prompt_map.get(prompt_type)
-        result = list()
-        result.append({"role": Role.SYSTEM.value, "content": prompt})
-        for message in self.get_history(chat_id)[1:]:
-            if message['role'] in (Role.USER.value, Role.ASSISTANT.value):
-                result.append(message)
-        return result
+        prompt = self.prompts.get(prompt_type).text
+        chat = self._get_chat(chat_id, create=False)
+        turns = []
+        if chat is not None:
+            turns = [m for m in chat.turns if m.role in (Role.USER.value, Role.ASSISTANT.value)]
+        return assemble_messages(prompt, turns)
     
     def trim_history(self, chat_id, max_tokens=3500):
-        history = self.conversation_histories.get(chat_id, [])
-        # trim_conversation_history(history, max_tokens)
-        self.conversation_histories[chat_id] = history
\ No newline at end of file
+        # Системный промпт, вставки и время остаются, под реплики — оставшийся бюджет.
+        # Бюджет переводится в единицы нашей оценки через поправку по фактическому usage.
+        chat = self._get_chat(chat_id, create=False)
+        if chat is None:
+            return
+        budget = (
+            max_tokens / self.prompt_token_ratio
+            - self.prompts.get(MAIN_PROMPT).tokens - self.time_prompt_tokens - REPLY_TOKEN_OVERHEAD - chat.slot_tokens
+        )
+        self._update(chat, chat.trim, budget, budget * Config.TRIM_TARGET_RATIO)
+
+    def estimate_history_tokens(self, chat_id, prompt_type=None):
+        # Оценка токенов запроса по уже посчитанным значениям, без повторной токенизации
+        chat = self._get_chat(chat_id, create=False)
+        if prompt_type is not None:
+            turn_tokens = sum(
+                m.tokens for m in chat.turns if m.role in (Role.USER.value, Role.ASSISTANT.value)
+            ) if chat is not None else 0
+            return self.prompts.get(prompt_type).tokens + turn_tokens + REPLY_TOKEN_OVERHEAD
+        if chat is None:
+            return self.time_prompt_tokens + REPLY_TOKEN_OVERHEAD
+        return (
+            self.prompts.get(MAIN_PROMPT).tokens + chat.turn_tokens + chat.slot_tokens
+            + self.time_prompt_tokens + REPLY_TOKEN_OVERHEAD
+        )
+
+    def record_prompt_usage(self, estimated_tokens, actual_tokens):
+        # Скользящее среднее отношения фактических prompt_tokens к нашей оценке
+        if not estimated_tokens or not actual_tokens:
+            return
+        self.token_stats["requests"] += 1
+        self.token_stats["estimated_prompt_tokens"] += estimated_tokens
+        self.token_stats["actual_prompt_tokens"] += actual_tokens
+        ratio = min(max(actual_tokens / estimated_tokens, 0.5), 2.0)
+        self.prompt_token_ratio = 0.9 * self.prompt_token_ratio + 0.1 * ratio
+
+    def get_message_count(self, chat_id):
+        chat = self._get_chat(chat_id, create=False)
+        return chat.message_count if chat is not None else 0
+
+    def increment_message_count(self, chat_id):
+        chat = self._get_chat(chat_id)
+        chat.message_count += 1
+        if self.store is not None:
+            self.store.set_message_count(chat_id, chat.message_count)
+        return chat.message_count
+
+    def get_chat_stats(self, chat_id):
+        chat = self.chats.get(chat_id)
+        if chat is None:
+            return None
+        return {
+            "turns": len(chat.turns),
+            "slots": len(chat.slots),
+            "bytes": chat.nbytes,
+            "messages": chat.message_count,
+        }
+
+    def get_stats(self):
+        sizes = [chat.nbytes for chat in self.chats.values()]
+        stats = dict(self.stats)
+        stats.update(
+            chats=len(sizes),
+            total_bytes=self.total_bytes,
+            bytes_per_chat=self.total_bytes // len(sizes) if sizes else 0,
+            max_chat_bytes=max(sizes, default=0),
+        )
+        stats["prompts"] = self.prompts.get_stats()
+        stats["tokens"] = dict(self.token_stats, prompt_token_ratio=round(self.prompt_token_ratio, 3))
+        if self.store is not None:
+            stats["store"] = self.store.get_stats()
+        return stats
+
+    def close(self):
+        # Дописать накопленные события перед остановкой
+        if self.store is not None:
+            self.store.close()
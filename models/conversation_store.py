@@ -0,0 +1,193 @@
+import os
+import time
+import atexit
+import sqlite3
+import threading
+from logger_config import logger
+
+
+# Журнал событий диалогов в SQLite с отложенной записью: события копятся в памяти
+# и пишутся фоновым потоком пачками, поэтому путь ответа пользователю не ждёт диска.
+# Состояние чата восстанавливается повтором его событий после последнего сброса.
+class ConversationStore:
+
+    TURN = "turn"
+    SLOT = "slot"
+    RESET = "reset"
+
+    def __init__(self, path, flush_interval=0.5, batch_size=500, max_turns=None, retention=None,
+                 compact_interval=3600):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_turns = max_turns
+        self.retention = retention
+        self.compact_interval = compact_interval
+        self._pending_events = []
+        self._pending_counts = {}
+        self._pending_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = threading.Event()
+        self.stats = {"events": 0, "flushes": 0, "flushed_events": 0, "flush_errors": 0, "loads": 0}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # Потеря последних миллисекунд при отключении питания допустима, fsync на каждую пачку — нет
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL, kind TEXT NOT NULL, "
+            "name TEXT, role TEXT, content TEXT, created_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS ix_events_chat_id ON events (chat_id, id)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS message_counts (chat_id INTEGER PRIMARY KEY, message_count INTEGER NOT NULL)"
+        )
+        self._db.commit()
+        self.compact()
+
+        self._thread = threading.Thread(target=self._run, name="conversation-store", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _append(self, event):
+        with self._pending_lock:
+            self._pending_events.append(event)
+            self.stats["events"] += 1
+            if len(self._pending_events) >= self.batch_size:
+                self._wakeup.set()
+
+    def append_turn(self, chat_id, role, content):
+        self._append((chat_id, self.TURN, None, role, content, time.time()))
+
+    def append_slot(self, chat_id, name, role, content):
+        self._append((chat_id, self.SLOT, name, role, content, time.time()))
+
+    def reset(self, chat_id):
+        self._append((chat_id, self.RESET, None, None, None, time.time()))
+        self.set_message_count(chat_id, 0)
+
+    def set_message_count(self, chat_id, count):
+        with self._pending_lock:
+            self._pending_counts[chat_id] = count
+
+    def load(self, chat_id):
+        # События чата после последнего сброса и счётчик сообщений: строки из БД плюс ещё не записанное.
+        # flush забирает очередь только под _db_lock, поэтому каждое событие видно ровно один раз.
+        # Чтение блокирующее — из цикла событий вызывается через ConversationManager.preload.
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT kind, name, role, content FROM events "
+                "WHERE chat_id = ? AND id > COALESCE("
+                "(SELECT MAX(id) FROM events WHERE chat_id = ? AND kind = ?), 0) ORDER BY id",
+                (chat_id, chat_id, self.RESET),
+            ).fetchall()
+            count = self._db.execute(
+                "SELECT message_count FROM message_counts WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+            count = count[0] if count else 0
+            with self._pending_lock:
+                pending = [event[1:5] for event in self._pending_events if event[0] == chat_id]
+                count = self._pending_counts.get(chat_id, count)
+        for position in range(len(pending) - 1, -1, -1):
+            if pending[position][0] == self.RESET:
+                rows, pending = [], pending[position + 1:]
+                break
+        self.stats["loads"] += 1
+        return rows + pending, count
+
+    def flush(self):
+        with self._db_lock:
+            with self._pending_lock:
+                events, self._pending_events = self._pending_events, []
+                counts, self._pending_counts = self._pending_counts, {}
+            if not events and not counts:
+                return
+            try:
+                with self._db:
+                    if events:
+                        self._db.executemany(
+                            "INSERT INTO events (chat_id, kind, name, role, content, created_at) "
+                            "VALUES (?, ?, ?, ?, ?, ?)",
+                            events,
+                        )
+                    if counts:
+                        self._db.executemany(
+                            "INSERT OR REPLACE INTO message_counts (chat_id, message_count) VALUES (?, ?)",
+                            counts.items(),
+                        )
+                self.stats["flushes"] += 1
+                self.stats["flushed_events"] += len(events)
+            except sqlite3.Error as e:
+                # Возвращаем пачку в очередь, следующая попытка — на следующем цикле
+                self.stats["flush_errors"] += 1
+                logger.error(f"Ошибка записи истории диалогов: {e}")
+                with self._pending_lock:
+                    self._pending_events[:0] = events
+                    for chat_id, count in counts.items():
+                        self._pending_counts.setdefault(chat_id, count)
+
+    def compact(self):
+        # Удаляем то, что уже не попадёт в восстановленное состояние: события до последнего сброса,
+        # заменённые вставки, реплики сверх лимита истории и чаты, простаивающие дольше срока хранения
+        started = time.perf_counter()
+        with self._db_lock, self._db:
+            deleted = self._db.execute(
+                "DELETE FROM events WHERE id < ("
+                "SELECT MAX(id) FROM events AS r WHERE r.chat_id = events.chat_id AND r.kind = ?)",
+                (self.RESET,),
+            ).rowcount
+            deleted += self._db.execute(
+                "DELETE FROM events WHERE kind = ? AND id < ("
+                "SELECT MAX(id) FROM events AS s WHERE s.chat_id = events.chat_id "
+                "AND s.kind = events.kind AND s.name = events.name)",
+                (self.SLOT,),
+            ).rowcount
+            if self.max_turns:
+                deleted += self._db.execute(
+                    "DELETE FROM events WHERE id IN (SELECT id FROM ("
+                    "SELECT id, ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY id DESC) AS position "
+                    "FROM events WHERE kind = ?) WHERE position > ?)",
+                    (self.TURN, self.max_turns),
+                ).rowcount
+            if self.retention:
+                deleted += self._db.execute(
+                    "DELETE FROM events WHERE chat_id IN ("
+                    "SELECT chat_id FROM events GROUP BY chat_id HAVING MAX(created_at) < ?)",
+                    (time.time() - self.retention,),
+                ).rowcount
+        if deleted:
+            logger.info(f"История диалогов сжата: удалено событий {deleted}, {time.perf_counter() - started:.2f} с.")
+
+    def _run(self):
+        next_compact = time.monotonic() + self.compact_interval
+        while not self._closed.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            if self.compact_interval and time.monotonic() >= next_compact:
+                next_compact = time.monotonic() + self.compact_interval
+                try:
+                    self.compact()
+                except sqlite3.Error as e:
+                    logger.error(f"Ошибка сжатия истории диалогов: {e}")
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._wakeup.set()
+        self._thread.join(timeout=5)
+        self.flush()
+        with self._db_lock:
+            self._db.close()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        with self._pending_lock:
+            stats["pending"] = len(self._pending_events)
+        return stats
@@ -0,0 +1,101 @@
+import re
+import threading
+from collections import OrderedDict
+from config import Config
+from models.catalog import get_catalog_version
+
+
+def normalize_filter_value(value):
+    if value is None:
+        return None
+    return re.sub(r"\s+", " ", str(value)).strip() or None
+
+
+def make_filter_key(
+    area=None,
+    num_rooms=None,
+    min_square=None,
+    max_square=None,
+    min_price=None,
+    max_price=None,
+    city=None,
+    sort_price="asc",
+    complex_names=None,
+    limit=3,
+):
+    # Одинаковые по смыслу фильтры дают один ключ: списки комнат и ЖК сортируются
+    # (в запросе это IN), любая сортировка кроме desc считается asc
+    return (
+        normalize_filter_value(area),
+        tuple(sorted(set(num_rooms))) if num_rooms is not None else None,
+        min_square,
+        max_square,
+        min_price,
+        max_price,
+        normalize_filter_value(city),
+        "desc" if sort_price == "desc" else "asc",
+        tuple(sorted(complex_names)) if complex_names is not None else None,
+        limit,
+    )
+
+
+# LRU готовых ответов get_filtered_apartments. Весь кэш сбрасывается, когда меняется версия каталога.
+class FilterResultCache:
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._version = get_catalog_version()
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "invalidations": 0,
+        }
+
+    def _check_version(self):
+        version = get_catalog_version()
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+            self.stats["invalidations"] += 1
+        return version
+
+    def get(self, key):
+        with self._lock:
+            self._check_version()
+            result = self._entries.get(key)
+            if result is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return result
+
+    def put(self, key, result, version):
+        # version — версия каталога, на которой посчитан результат; устаревший ответ не сохраняем
+        with self._lock:
+            if self._check_version() != version:
+                return
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["size"] = len(self._entries)
+            stats["version"] = self._version
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+filter_result_cache = FilterResultCache(max_size=Config.FILTER_CACHE_SIZE)
@@ -1,15 +1,44 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, create_engine
+from contextlib import contextmanager
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Index, create_engine
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
+from config import Config
+from models.catalog import watch_catalog_file
 
 # Создаём базовый класс
 Base = declarative_base()
 
 # Движок и фабрика сессий
-engine = create_engine("sqlite:///complexes.db", echo=False)
+# Запросы выполняются из пула потоков models.async_query, по одному соединению на поток
+engine = create_engine(
+    f"sqlite:///{Config.DB_PATH}",
+    echo=False,
+    pool_size=Config.DB_POOL_SIZE,
+    max_overflow=0,
+)
 Session = sessionmaker(bind=engine)
+# Каталог перезагружается подменой файла БД: старые соединения смотрят на прежний файл, их закрываем
+watch_catalog_file(Config.DB_PATH, on_replaced=engine.dispose, check_interval=Config.DB_RELOAD_CHECK_INTERVAL)
+
+
+@contextmanager
+def session_scope():
+    # Сессия всегда закрывается и возвращает соединение в пул
+    session = Session()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
 
 class Area(Base):
     __tablename__ = 'areas'
+    __table_args__ = (
+        Index('ix_areas_name', 'name'),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
@@ -30,6 +59,9 @@ class Area(Base):
 
 class ResidentialComplex(Base):
     __tablename__ = 'residential_complexes'
+    __table_args__ = (
+        Index('ix_residential_complexes_complex_name', 'complex_name'),
+    )
 
     id = Column(Integer, primary_key=True)
     complex_name = Column(String, nullable=False)
@@ -40,7 +72,7 @@ class ResidentialComplex(Base):
     short_text = Column(String, nullable=True)
     city = Column(String, nullable=True, default="Владивосток")
 
-    apartments = relationship("Apartment", back_populates="complex")
+    apartments = relationship("Apartment", back_populates="complex", order_by="Apartment.id")
 
 # Добавляем обратную связь для Area -> ResidentialComplex
 Area.complexes = relationship(
@@ -51,6 +83,10 @@ Area.complexes = relationship(
 # Модель квартиры
 class Apartment(Base):
     __tablename__ = 'apartments'
+    __table_args__ = (
+        Index('ix_apartments_num_rooms_price', 'num_rooms', 'price'),
+        Index('ix_apartments_complex_id', 'complex_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     apartment_type = Column(String, nullable=False)
@@ -62,5 +98,19 @@ class Apartment(Base):
     complex = relationship("ResidentialComplex", back_populates="apartments")
 
 
+# Какой файл knowledge_files и с каким содержимым загружен в каталог — по хешу синхронизация
+# находит изменённые файлы и обновляет только их ЖК
+class CatalogFile(Base):
+    __tablename__ = 'catalog_files'
+
+    filename = Column(String, primary_key=True)
+    content_hash = Column(String, nullable=False)
+    complex_id = Column(Integer, ForeignKey('residential_complexes.id'), nullable=True)
+
+
 # Создаём таблицы
-Base.metadata.create_all(engine)
\ No newline at end of file
+Base.metadata.create_all(engine)
+# create_all не добавляет индексы в уже существующие таблицы — досоздаём их отдельно
+for table in Base.metadata.sorted_tables:
+    for index in table.indexes:
+        index.create(engine, checkfirst=True)
\ No newline at end of file
@@ -0,0 +1,91 @@
+import os
+import time
+import hashlib
+import threading
+from docx import Document
+from logger_config import logger
+from utils.helpers import count_message_tokens
+
+PROMPT_LOAD_ERROR = "Произошла ошибка при загрузке промпта."
+
+
+class Prompt:
+    __slots__ = ("text", "tokens", "sha256", "mtime_ns", "path")
+
+    def __init__(self, text, path=None, mtime_ns=None):
+        self.text = text
+        self.tokens = count_message_tokens(text)
+        self.sha256 = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        self.mtime_ns = mtime_ns
+        self.path = path
+
+
+# Промпты из .docx: каждый файл разбирается один раз, затем перечитывается только при смене mtime.
+# Новый текст полностью готовится до замены, поэтому читатели видят либо старую, либо новую версию.
+class PromptRegistry:
+
+    def __init__(self, check_interval=1.0):
+        self.check_interval = check_interval
+        self._paths = {}
+        self._fallbacks = {}
+        self._prompts = {}
+        self._next_check = {}
+        self._lock = threading.Lock()
+        self.stats = {"loads": 0, "reloads": 0, "errors": 0}
+
+    def register(self, key, path, fallback=None):
+        # fallback — ключ промпта, который используется, пока своего файла нет
+        self._paths[key] = path
+        self._fallbacks[key] = fallback
+        self._load(key)
+
+    def _load(self, key):
+        path = self._paths[key]
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            if key not in self._prompts and self._fallbacks[key] is None:
+                logger.error(f"Файл промпта {path} не найден")
+                self._prompts[key] = Prompt(PROMPT_LOAD_ERROR, path)
+            return
+        current = self._prompts.get(key)
+        if current is not None and current.mtime_ns == mtime_ns:
+            return
+        try:
+            document = Document(path)
+            text = "\n".join([para.text for para in document.paragraphs])
+        except Exception as e:
+            # Файл могут сохранять прямо сейчас — оставляем прежнюю версию и попробуем позже
+            self.stats["errors"] += 1
+            logger.error(f"Ошибка при чтении файла {path}: {e}")
+            if current is None:
+                self._prompts[key] = Prompt(PROMPT_LOAD_ERROR, path)
+            return
+        prompt = Prompt(text, path, mtime_ns)
+        self._prompts[key] = prompt
+        if current is not None and current.mtime_ns is not None:
+            self.stats["reloads"] += 1
+            if current.sha256 != prompt.sha256:
+                logger.info(f"Промпт {path} перезагружен, токенов: {prompt.tokens}")
+        else:
+            self.stats["loads"] += 1
+
+    def get(self, key):
+        now = time.monotonic()
+        if now >= self._next_check.get(key, 0.0):
+            with self._lock:
+                if now >= self._next_check.get(key, 0.0):
+                    self._next_check[key] = now + self.check_interval
+                    self._load(key)
+        prompt = self._prompts.get(key)
+        if prompt is None and self._fallbacks.get(key) is not None:
+            return self.get(self._fallbacks[key])
+        return prompt
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["prompts"] = {
+            str(key): {"tokens": prompt.tokens, "sha256": prompt.sha256[:12]}
+            for key, prompt in self._prompts.items()
+        }
+        return stats
@@ -1,8 +1,11 @@
-from sqlalchemy import asc, desc
-from sqlalchemy import or_, func
-from models.models import Apartment, ResidentialComplex, Area, Session
+from sqlalchemy import asc, desc, select
+from sqlalchemy import or_, and_
+from models.models import Apartment, ResidentialComplex, Area, Session, session_scope
+from models.apartment_search import get_apartment_search_engine
+from models.filter_cache import filter_result_cache, make_filter_key, normalize_filter_value
+from models.catalog import get_catalog_version
 from collections import defaultdict
-from itertools import islice
+from config import Config
 from logger_config import logger
 import re
 
@@ -22,139 +25,167 @@ def get_filtered_apartments(
 ):
     if isfilter == False:
         return "Для указанного района отсутствуют варианты!"
-    session = Session()
-    query = session.query(Apartment).join(Apartment.complex)
-    query_ResidentialComplex = session.query(
-        ResidentialComplex.short_text, 
-        ResidentialComplex.city, 
-        ResidentialComplex.area,
-        Area.name.label("area_name")
+    filters = dict(
+        area=normalize_filter_value(area),
+        num_rooms=num_rooms,
+        min_square=min_square,
+        max_square=max_square,
+        min_price=min_price,
+        max_price=max_price,
+        city=normalize_filter_value(city),
+        sort_price=sort_price,
+        complex_names=complex_names,
+    )
+    if not Config.FILTER_CACHE_ENABLED:
+        return _get_filtered_apartments(limit=limit, **filters)
+
+    key = make_filter_key(limit=limit, **filters)
+    result = filter_result_cache.get(key)
+    if result is not None:
+        return result
+    # Версию берём до запроса: если каталог перезагрузят во время поиска, ответ не попадёт в кэш
+    version = get_catalog_version()
+    result = _get_filtered_apartments(limit=limit, **filters)
+    filter_result_cache.put(key, result, version)
+    return result
+
+
+def _get_filtered_apartments(limit, **filters):
+    complex_names = filters["complex_names"]
+    if Config.APARTMENT_SEARCH_ENGINE == "columnar":
+        engine = get_apartment_search_engine()
+        rows, complex_filtered = engine.find(**filters)
+        if not rows:
+            return "Результат промежуточного анализа запроса: /n нету квартир под ваши параметры."
+        complex_full_info = ""
+        if complex_names is not None and len(complex_names) == 1:
+            complex_full_info = format_complex_details(complex_names[0], engine.complex_details(complex_names[0]))
+        return _format_filtered_apartments(rows, complex_filtered, complex_names, limit, complex_full_info)
+
+    with session_scope() as session:
+        rows, complex_filtered = _find_apartments_sql(session, **filters)
+        if not rows:
+            return "Результат промежуточного анализа запроса: /n нету квартир под ваши параметры."
+        complex_full_info = ""
+        if complex_names is not None and len(complex_names) == 1:
+            complex_full_info = format_complex_with_apartments(session, complex_names[0])
+    return _format_filtered_apartments(rows, complex_filtered, complex_names, limit, complex_full_info)
+
+
+def _area_member_ids(area):
+    # Для района (parent_id IS NULL) — сам район и его микрорайоны, для микрорайона — только он сам.
+    # Берётся первый район с таким именем, как раньше делал .first()
+    target = (
+        select(Area.id, Area.parent_id)
+        .where(Area.name == area)
+        .order_by(Area.id)
+        .limit(1)
+        .subquery()
+    )
+    return select(Area.id).where(
+        or_(
+            Area.id == target.c.id,
+            and_(target.c.parent_id.is_(None), Area.parent_id == target.c.id),
+        )
+    )
+
+
+def _find_apartments_sql(
+    session,
+    area=None,
+    num_rooms=None,
+    min_square=None,
+    max_square=None,
+    min_price=None,
+    max_price=None,
+    city=None,
+    sort_price="asc",
+    complex_names=None,
+):
+    # Возвращает строки (complex_name, apartment_type, price, num_rooms, size_sqm, general_texts)
+    # в порядке выдачи и список ЖК района. Не больше двух запросов: квартиры и, если задан район, ЖК района.
+    query = (
+        select(
+            ResidentialComplex.complex_name,
+            Apartment.apartment_type,
+            Apartment.price,
+            Apartment.num_rooms,
+            Apartment.size_sqm,
+            ResidentialComplex.general_texts,
+        )
+        .join(ResidentialComplex, Apartment.complex_id == ResidentialComplex.id)
+        .where(Apartment.price.is_not(None))
     )
-    query = query.filter(Apartment.price != None)
-    complex_filtered = ""
     if num_rooms is not None:
-        query = query.filter(Apartment.num_rooms.in_(num_rooms))
+        query = query.where(Apartment.num_rooms.in_(num_rooms))
     if min_square is not None:
-        query = query.filter(Apartment.size_sqm >= min_square)
+        query = query.where(Apartment.size_sqm >= min_square)
     if max_square is not None:
-        query = query.filter(Apartment.size_sqm <= max_square)
+        query = query.where(Apartment.size_sqm <= max_square)
     if min_price is not None:
-        query = query.filter(Apartment.price >= min_price)
+        query = query.where(Apartment.price >= min_price)
     if max_price is not None:
-        query = query.filter(Apartment.price <= max_price)
+        query = query.where(Apartment.price <= max_price)
+    if complex_names:
+        query = query.where(ResidentialComplex.complex_name.in_(complex_names))
+    if city is not None:
+        query = query.where(ResidentialComplex.city == city)
+    if area is not None:
+        # Если района нет в БД, подзапрос пустой и квартир не найдётся — как и раньше
+        query = query.where(ResidentialComplex.area_id.in_(_area_member_ids(area)))
 
+    # id как второй ключ делает порядок квартир с одинаковой ценой детерминированным
     if sort_price == "desc":
-        query = query.order_by(desc(Apartment.price))
+        query = query.order_by(desc(Apartment.price), Apartment.id)
     else:
-        query = query.order_by(asc(Apartment.price))
-    
-    if complex_names:
-        query = query.filter(ResidentialComplex.complex_name.in_(complex_names))
+        query = query.order_by(asc(Apartment.price), Apartment.id)
+
+    rows = [tuple(row) for row in session.execute(query)]
+    if not rows or area is None:
+        return rows, ""
+
+    complexes_query = (
+        select(ResidentialComplex.short_text, ResidentialComplex.city, Area.name.label("area_name"))
+        .join(Area, ResidentialComplex.area_id == Area.id)
+        .where(ResidentialComplex.area_id.in_(_area_member_ids(area)))
+        .order_by(ResidentialComplex.id)
+    )
     if city is not None:
-        query = query.filter(ResidentialComplex.city == city)
-        query_ResidentialComplex = query_ResidentialComplex.filter(ResidentialComplex.city == city)
-    if area is not None:
-        # area_name = "БАМ"
-        # area = session.query(Area).filter(func.lower(Area.name) == area.lower()).first()
-        area_obj = session.query(Area).filter(Area.name == area).first()
-        if not area_obj:
-            return "Результат промежуточного анализа запроса: /n нету квартир под ваши параметры."
-        
-        # Если это район (parent_id IS NULL), ищем комплексы в районе и его микрорайонах
-        if area_obj.parent_id is None:
-            query = query.join(Area, ResidentialComplex.area_id == Area.id).filter(
-                or_(Area.id == area_obj.id, Area.parent_id == area_obj.id)
-            )
-            query_ResidentialComplex = query_ResidentialComplex.join(Area).filter(
-                or_(Area.id == area_obj.id, Area.parent_id == area_obj.id)
-            )
-        # Если это микрорайон, ищем только комплексы с этим area_id
-        else:
-            query = query.filter(ResidentialComplex.area_id == area_obj.id)
-            query_ResidentialComplex = query_ResidentialComplex.join(Area).filter(
-                ResidentialComplex.area_id == area_obj.id
-            )
-            
-        print(area_obj)
-        # query_ResidentialComplex = query_ResidentialComplex.join(Area).filter(
-        #     or_(Area.id == area.id, Area.parent_id == area.id)
-        # )
-        results = query_ResidentialComplex.all()
-        complex_filtered = "Список ЖК в этом районе, но не факт что в них есть квартира: \n"
-        complex_filtered += "\n".join(f"{r.short_text} ({r.city}, {r.area_name})" for r in results if r.short_text)
-        print('complex_filtered: ', complex_filtered)
-        print('---------------')
-
-    print(str(query.statement.compile(compile_kwargs={"literal_binds": True})))
-    
-    apartments = query.all()
-    if len(apartments) == 0:
-        return "Результат промежуточного анализа запроса: /n нету квартир под ваши параметры."
-    
-    # Группировка по (complex_name, apartment_type, price)
-    # grouped = defaultdict(list)
-    # for apt in apartments:
-    #     key = (apt.complex.complex_name, apt.apartment_type, apt.price)
-    #     grouped[key].append({
-    #         "square": apt.size_sqm,
-    #         "num_rooms": apt.num_rooms,
-    #     })
-        
+        complexes_query = complexes_query.where(ResidentialComplex.city == city)
+    complex_filtered = "Список ЖК в этом районе, но не факт что в них есть квартира: \n"
+    complex_filtered += "\n".join(
+        f"{r.short_text} ({r.city}, {r.area_name})" for r in session.execute(complexes_query) if r.short_text
+    )
+    logger.debug(f"complex_filtered: {complex_filtered}")
+    return rows, complex_filtered
+
+
+def _format_filtered_apartments(rows, complex_filtered, complex_names, limit, complex_full_info):
+    # Группировка по (complex_name, apartment_type, price, num_rooms)
     grouped = defaultdict(list)
-    for apt in apartments:
-        key = (apt.complex.complex_name, apt.apartment_type, apt.price, apt.num_rooms)
+    for complex_name, apartment_type, price, num_rooms, size_sqm, general_texts in rows:
+        key = (complex_name, apartment_type, price, num_rooms)
         grouped[key].append({
-            "square": apt.size_sqm,
-            "num_rooms": apt.num_rooms,
-            "complex_text": apt.complex.general_texts,
+            "square": size_sqm,
+            "num_rooms": num_rooms,
+            "complex_text": general_texts,
         })
-        
-    # first_three_dd = defaultdict(list, islice(grouped.items(), 3))
-    first_three_dd = defaultdict(list, grouped.items())
-    result = []
-    compResidentialComplex_set = set()
-    # инфа по комлексам из трёх подходящих результатов, добавляем в другом месте!
-    # for (complex_name, apartment_type, price), apts in first_three_dd.items()[0:3]:
-    #     result.append({
-    #         "complex_name": complex_name,
-    #         "apartment_type": apartment_type,
-    #         "price": price,
-    #     })
-    #     compResidentialComplex_set.add(apts[0]['complex_text'])
 
     # Формируем результат
-    # result = []
-    # compResidentialComplex_set = set()
-    # for (complex_name, apartment_type, price), apts in grouped.items()[:3]:
-    #     result.append({
-    #         "complex_name": complex_name,
-    #         "apartment_type": apartment_type,
-    #         "price": price,
-    #     })
-    #     compResidentialComplex_set.add(apts.general_texts)
-        
-    # return result
-
-    # Формируем результат
-    # first_three_dd = defaultdict(list, islice(grouped.items(), 3))
-    # result = []
-    compResidentialComplex_set = set()
-    # инфа по комлексам из трёх подходящих результатов, добавляем в другом месте!
-    for (complex_name, apartment_type, price, num_rooms), apts in first_three_dd.items():
+    result = []
+    for (complex_name, apartment_type, price, num_rooms), apts in grouped.items():
         result.append({
             "complex_name": complex_name,
             "apartment_type": apartment_type,
             "price": price,
             "num_rooms": num_rooms,
         })
-        compResidentialComplex_set.add(f"{complex_name}: {apts[0]['complex_text']}")
     # results_str = "Промежуточный анализ запроса. Если вопрос по квартирам, наприиер, самая дешёвая или типа того, то лучше брать информацию из этого списка: /n "
     results_str = ""
     cleared_results_str = ""
     cleared_result = _clear_unused_data(result)
     if limit is not None:
         cleared_result_limited = cleared_result[:limit]
-        results_str = results_str[:limit]
     else:
         cleared_result_limited = cleared_result
         
@@ -170,8 +201,6 @@ def get_filtered_apartments(
             results_str += f"{apt['apartment_type']} Цена: {apt['price']} ЖК: {apt['complex_name']}\n"
         results_str += "\n"
         
-    
-    
     logger.info("-------------------Варианты от промежуточного анализа диалога-----")
     logger.info(results_str)
     logger.info("------------------------------------------------------------------")
@@ -179,13 +208,7 @@ def get_filtered_apartments(
     logger.info(cleared_results_str)
     logger.info("------------------------------------------------------------------")
     
-    # for compResidentialComplex in compResidentialComplex_set:
-    #     results_str += f"{compResidentialComplex}\n\n"
     results_str += complex_filtered
-    complex_full_info = ""
-    if complex_names is not None and len(complex_names) == 1:
-        complex_full_info = format_complex_with_apartments(session, complex_names[0])
-    # results_str += "конец. "
     return "Результат промежуточного анализа запроса: /n" + results_str + "/n" + complex_full_info
 
 def _clear_unused_data(apartments):
@@ -229,46 +252,84 @@ def get_app_type(value):
     elif value == 5:
         return "Пятикомнатная квартира"
 
+def _complex_details_sql(session, complex_name):
+    # ЖК с названием района и его квартиры по id — два запроса, без ORM-объектов
+    complex_row = session.execute(
+        select(
+            ResidentialComplex.id,
+            ResidentialComplex.complex_name,
+            ResidentialComplex.city,
+            Area.name.label("area_name"),
+            ResidentialComplex.short_text,
+            ResidentialComplex.general_texts,
+        )
+        .outerjoin(Area, ResidentialComplex.area_id == Area.id)
+        .where(ResidentialComplex.complex_name == complex_name)
+        .order_by(ResidentialComplex.id)
+        .limit(1)
+    ).first()
+    if complex_row is None:
+        return None
+    details = complex_row._asdict()
+    apartments = [
+        row._asdict() for row in session.execute(
+            select(Apartment.apartment_type, Apartment.price, Apartment.size_sqm, Apartment.num_rooms)
+            .where(Apartment.complex_id == details.pop("id"))
+            .order_by(Apartment.id)
+        )
+    ]
+    return details, apartments
+
+
 def format_complex_with_apartments(session: Session, complex_name: str) -> str:
-    complex_obj = session.query(ResidentialComplex).filter_by(complex_name=complex_name).first()
-    if not complex_obj:
+    return format_complex_details(complex_name, _complex_details_sql(session, complex_name))
+
+
+def format_complex_details(complex_name, details):
+    # Общий вывод для обоих движков поиска; details — (ЖК, квартиры) или None, если ЖК не найден
+    if details is None:
         return f"Жилой комплекс '{complex_name}' не найден."
+    complex_row, apartments = details
 
     result = []
-    result.append(f"Жилой комплекс: {complex_obj.complex_name}")
-    result.append(f"Город: {complex_obj.city or 'не указано'}")
-    result.append(f"Район: {complex_obj.area or 'не указано'}")
-    result.append(f"Краткое описание: {complex_obj.short_text or 'не указано'}")
-    result.append(f"Полное описание: {complex_obj.general_texts or 'не указано'}")
-    result.append(f"Количество квартир: {len(complex_obj.apartments)}")
+    result.append(f"Жилой комплекс: {complex_row['complex_name']}")
+    result.append(f"Город: {complex_row['city'] or 'не указано'}")
+    result.append(f"Район: {complex_row['area_name'] or 'не указано'}")
+    result.append(f"Краткое описание: {complex_row['short_text'] or 'не указано'}")
+    result.append(f"Полное описание: {complex_row['general_texts'] or 'не указано'}")
+    result.append(f"Количество квартир: {len(apartments)}")
 
     result.append("Квартиры:")
-    for apt in complex_obj.apartments:
-        apt_type = apt.apartment_type or "не указано"
-        size = f"{apt.size_sqm:.1f} м²" if apt.size_sqm else "размер не указан"
-        rooms = f"{apt.num_rooms} комн." if apt.num_rooms else "кол-во комнат не указано"
-        price = f"{apt.price:,} ₽" if apt.price else "цена не указана"
+    for apt in apartments:
+        apt_type = apt["apartment_type"] or "не указано"
+        size = f"{apt['size_sqm']:.1f} м²" if apt["size_sqm"] else "размер не указан"
+        rooms = f"{apt['num_rooms']} комн." if apt["num_rooms"] else "кол-во комнат не указано"
+        price = f"{apt['price']:,} ₽" if apt["price"] else "цена не указана"
 
         result.append(f" - {apt_type}, {rooms}, {size}, {price}")
 
     return "\n".join(result)
 
-
 def get_complex_info_by_names(complex_name_list):
-    session = Session()
-    complexes = session.query(ResidentialComplex).filter(
-        ResidentialComplex.complex_name.in_(complex_name_list)
-    ).all()
-    
+    with session_scope() as session:
+        complexes = session.execute(
+            select(ResidentialComplex.complex_name, ResidentialComplex.general_texts, Area.name.label("area_name"))
+            .outerjoin(Area, ResidentialComplex.area_id == Area.id)
+            .where(ResidentialComplex.complex_name.in_(complex_name_list))
+            .order_by(ResidentialComplex.id)
+        ).all()
+
     result_str = "\n".join(
-        f"{c.complex_name}, {c.area or '—'}, {c.general_texts or '—'}"
+        f"{c.complex_name}, {c.area_name or '—'}, {c.general_texts or '—'}"
         for c in complexes
     )
     return result_str
 
 def extract_russian_names():
-    session = Session()
-    complexes = session.query(ResidentialComplex).all()
+    with session_scope() as session:
+        complexes = session.execute(
+            select(ResidentialComplex.complex_name, ResidentialComplex.general_texts)
+        ).all()
     name_mapping = {}
 
     # pattern = re.compile(r'ЖК\s*["«](.+?)["»]')
@@ -0,0 +1,78 @@
+# Окружение задаётся до импорта модулей проекта: движок каталога создаётся при импорте models.models
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+TMP_DIR = tempfile.mkdtemp(prefix="complexes-tests-")
+
+os.environ["IN_DOCKER"] = "1"
+os.environ["DB_PATH"] = os.path.join(TMP_DIR, "complexes.db")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:test")
+os.environ["CONVERSATION_PERSISTENCE"] = "0"
+os.environ["CATALOG_SYNC"] = "0"
+os.environ["EMBEDDER"] = "hashing"
+os.environ["EMBEDDING_CACHE_PATH"] = ""
+
+import pytest
+
+
+# Небольшой каталог с краевыми случаями: район с микрорайонами, ЖК без района и без квартир,
+# квартиры без цены, площади или числа комнат, одинаковые цены и значения ровно на границах фильтров
+AREAS = [
+    {"id": 1, "name": "Первомайский", "parent_id": None},
+    {"id": 2, "name": "Патрокл", "parent_id": 1},
+    {"id": 3, "name": "Чуркин", "parent_id": 1},
+    {"id": 4, "name": "Эгершельд", "parent_id": None},
+]
+COMPLEXES = [
+    {"id": 1, "complex_name": "Андерсен", "area_id": 2, "city": "Владивосток",
+     "short_text": "ЖК Андерсен у моря", "general_texts": "ЖК Андерсен — дома у моря с парком"},
+    {"id": 2, "complex_name": "Лайм", "area_id": 1, "city": "Владивосток",
+     "short_text": "ЖК Лайм", "general_texts": "ЖК Лайм в Первомайском районе"},
+    {"id": 3, "complex_name": "Сабанеева", "area_id": 4, "city": "Владивосток",
+     "short_text": None, "general_texts": None},
+    {"id": 4, "complex_name": "Артём Сити", "area_id": None, "city": "Артём",
+     "short_text": "ЖК Артём Сити", "general_texts": "ЖК Артём Сити в центре Артёма"},
+    {"id": 5, "complex_name": "Чуркин Парк", "area_id": 3, "city": "Владивосток",
+     "short_text": "ЖК Чуркин Парк", "general_texts": "ЖК Чуркин Парк без квартир в продаже"},
+]
+APARTMENTS = [
+    # id, complex_id, apartment_type, price, size_sqm, num_rooms
+    (1, 1, "Студия", 5_000_000, 25.0, 0),
+    (2, 1, "1-комнатная", 7_000_000, 40.0, 1),
+    (3, 1, "1-комнатная", 7_000_000, 41.5, 1),
+    (4, 1, "2-комнатная", 9_000_000, 60.0, 2),
+    (5, 1, "3-комнатная", 12_500_000, 85.0, 3),
+    (6, 1, "2-комнатная", None, 58.0, 2),
+    (7, 2, "Студия", 4_999_999, 22.0, 0),
+    (8, 2, "2-комнатная", 8_100_000, None, 2),
+    (9, 2, "3-комнатная", 9_000_000, 75.0, 3),
+    (10, 2, "Апартаменты", 6_000_000, 33.0, None),
+    (11, 3, "4-комнатная", 21_000_000, 120.0, 4),
+    (12, 3, "5-комнатная", 30_000_000, 160.0, 5),
+    (13, 3, "2-комнатная", 7_000_000, 55.0, 2),
+    (14, 4, "1-комнатная", 3_900_000, 38.0, 1),
+    (15, 4, "2-комнатная", 5_000_000, 60.0, 2),
+    (16, 4, "2-комнатная", 5_000_000, 60.0, 2),
+]
+
+
+@pytest.fixture(scope="session")
+def catalog():
+    from models.models import Area, ResidentialComplex, Apartment, session_scope
+    from models.catalog import bump_catalog_version
+
+    with session_scope() as session:
+        session.add_all(Area(**area) for area in AREAS)
+        session.flush()
+        session.add_all(ResidentialComplex(**row) for row in COMPLEXES)
+        session.flush()
+        session.add_all(
+            Apartment(id=i, complex_id=c, apartment_type=t, price=p, size_sqm=s, num_rooms=r)
+            for i, c, t, p, s, r in APARTMENTS
+        )
+    bump_catalog_version()
+    return {"areas": len(AREAS), "complexes": len(COMPLEXES), "apartments": len(APARTMENTS)}
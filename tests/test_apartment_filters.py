@@ -0,0 +1,34 @@
+import pytest
+from models.apartment_filters import ApartmentFilters, parse_number
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("5 000 000", 5_000_000),
+    ("5,5 млн", 5_500_000),
+    ("3.2млн", 3_200_000),
+    ("800 тыс", 800_000),
+    ("7.5", 7.5),
+    ("без ограничений", None),
+])
+def test_parse_number(text, expected):
+    assert parse_number(text) == expected
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ({"max_price": 7.5}, {"max_price": 7_500_000}),
+    ({"max_price": "7,5 млн"}, {"max_price": 7_500_000}),
+    ({"min_price": 6.25, "max_price": 9}, {"min_price": 6_250_000, "max_price": 9_000_000}),
+    ({"min_price": 9.9, "max_price": 7}, {"min_price": 7_000_000, "max_price": 9_900_000}),
+    ({"max_price": 0}, {"max_price": None}),
+    ({"min_square": "40,4", "max_square": 45.6}, {"min_square": 40, "max_square": 46}),
+])
+def test_prices_keep_fraction_until_scaled(raw, expected):
+    params = ApartmentFilters(**raw).to_params()
+    for name, value in expected.items():
+        assert params[name] == value
+        assert value is None or type(params[name]) is int
+
+
+def test_structured_answer_with_fractional_millions():
+    filters = ApartmentFilters.model_validate_json('{"max_price": 7.5, "num_rooms": [2]}')
+    assert filters.to_params()["max_price"] == 7_500_000
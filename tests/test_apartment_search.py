@@ -0,0 +1,91 @@
+import random
+import itertools
+import pytest
+from sqlalchemy import func, select
+from config import Config
+from models.models import Apartment, Area, ResidentialComplex, session_scope
+from models.query import get_filtered_apartments
+from models.apartment_search import get_apartment_search_engine
+
+NOT_FOUND = "нету квартир"
+SAMPLE = 2000
+
+
+def filter_grid():
+    areas = [None, "нет такого района", "Первомайский", "Патрокл", "Чуркин", "Эгершельд"]
+    cities = [None, "Владивосток", "Артём"]
+    complex_names = [None, ["нет такого ЖК"], ["Андерсен"], ["Чуркин Парк"], ["Андерсен", "Лайм"], ["Артём Сити"]]
+    rooms = [None, [0], [1], [2, 3], [3, 2, 2], [4, 5]]
+    prices = [(None, None), (None, 7_000_000), (5_000_000, 9_000_000), (None, 100), (4_999_999, 4_999_999)]
+    squares = [(None, None), (40, None), (None, 60), (60, 60)]
+    for r, p, sq, a, c, n, sort, limit in itertools.product(
+        rooms, prices, squares, areas, cities, complex_names, ["asc", "desc", None], [3, None]
+    ):
+        yield dict(
+            num_rooms=r, min_price=p[0], max_price=p[1], min_square=sq[0], max_square=sq[1],
+            area=a, city=c, complex_names=n, sort_price=sort, limit=limit,
+        )
+
+
+def run(filters, engine, cache):
+    Config.APARTMENT_SEARCH_ENGINE = engine
+    Config.FILTER_CACHE_ENABLED = cache
+    return [get_filtered_apartments(**f) for f in filters]
+
+
+@pytest.fixture
+def search_config():
+    saved = Config.APARTMENT_SEARCH_ENGINE, Config.FILTER_CACHE_ENABLED
+    yield
+    Config.APARTMENT_SEARCH_ENGINE, Config.FILTER_CACHE_ENABLED = saved
+
+
+def test_catalog_is_seeded(catalog):
+    with session_scope() as session:
+        counts = {
+            "areas": session.scalar(select(func.count()).select_from(Area)),
+            "sub_areas": session.scalar(select(func.count()).select_from(Area).where(Area.parent_id.is_not(None))),
+            "complexes": session.scalar(select(func.count()).select_from(ResidentialComplex)),
+            "apartments": session.scalar(select(func.count()).select_from(Apartment)),
+        }
+    assert all(counts.values()), counts
+    engine = get_apartment_search_engine()
+    assert len(engine._apartments) == counts["apartments"]
+
+
+def test_engines_and_cache_match(catalog, search_config):
+    random.seed(0)
+    filters = random.sample(list(filter_grid()), SAMPLE)
+
+    sql = run(filters, "sql", cache=False)
+    columnar = run(filters, "columnar", cache=False)
+    run(filters, "columnar", cache=True)
+    cached = run(filters, "columnar", cache=True)
+
+    # Сравнение имеет смысл, только если заметная часть запросов действительно находит квартиры
+    found = sum(NOT_FOUND not in output for output in sql)
+    assert found >= 100, found
+    for f, a, b, c in zip(filters, sql, columnar, cached):
+        assert a == b == c, f
+
+
+@pytest.mark.parametrize("filters", [
+    dict(area="Первомайский"),
+    dict(area="Патрокл", num_rooms=[1], sort_price="desc"),
+    dict(complex_names=["Андерсен"], limit=None),
+    dict(complex_names=["Лайм"], num_rooms=[2]),
+    dict(city="Артём", min_price=5_000_000, max_price=5_000_000, min_square=60, max_square=60),
+    dict(num_rooms=[0, 1], max_price=7_000_000, limit=None),
+])
+def test_engines_match_on_edge_filters(catalog, search_config, filters):
+    sql = run([filters], "sql", cache=False)[0]
+    columnar = run([filters], "columnar", cache=False)[0]
+    assert NOT_FOUND not in sql
+    assert sql == columnar
+
+
+def test_complex_details_for_complex_without_area(catalog, search_config):
+    output = run([dict(complex_names=["Артём Сити"])], "sql", cache=False)[0]
+    assert "Район: не указано" in output
+    assert "Количество квартир: 3" in output
+    assert output == run([dict(complex_names=["Артём Сити"])], "columnar", cache=False)[0]
@@ -0,0 +1,77 @@
+import asyncio
+import pytest
+from models.conversation_store import ConversationStore
+from models.conversation_manager import ConversationManager
+
+
+@pytest.fixture
+def store(tmp_path):
+    # Фоновый поток почти не просыпается: всё, что не сброшено явно, остаётся в очереди
+    store = ConversationStore(str(tmp_path / "conversations.sqlite3"), flush_interval=3600, batch_size=10_000)
+    yield store
+    store.close()
+
+
+def turns(rows):
+    return [content for kind, _, _, content in rows if kind == ConversationStore.TURN]
+
+
+def test_load_merges_pending_without_flushing(store):
+    store.append_turn(1, "user", "первое")
+    store.set_message_count(1, 1)
+    store.flush()
+    store.append_turn(1, "assistant", "второе")
+    store.append_turn(2, "user", "чужой чат")
+    store.set_message_count(1, 2)
+
+    rows, count = store.load(1)
+    assert turns(rows) == ["первое", "второе"]
+    assert count == 2
+    # load ничего не пишет: несброшенное остаётся в очереди
+    assert store.get_stats()["pending"] == 2
+    assert store.get_stats()["flushes"] == 1
+
+
+def test_pending_reset_hides_earlier_events(store):
+    store.append_turn(1, "user", "до сброса")
+    store.flush()
+    store.append_turn(1, "user", "тоже до сброса")
+    store.reset(1)
+    store.append_turn(1, "user", "после сброса")
+
+    rows, count = store.load(1)
+    assert turns(rows) == ["после сброса"]
+    assert count == 0
+    store.flush()
+    assert store.load(1) == (rows, count)
+
+
+def test_preload_restores_evicted_chat(store, monkeypatch):
+    manager = ConversationManager()
+    monkeypatch.setattr(manager, "store", store)
+    chat_id = 424242
+    store.append_turn(chat_id, "user", "вопрос")
+    store.set_message_count(chat_id, 3)
+    manager._drop(chat_id)
+
+    asyncio.run(manager.preload(chat_id))
+    assert manager.get_chat_stats(chat_id)["messages"] == 3
+    assert manager.get_message_count(chat_id) == 3
+    manager._drop(chat_id)
+
+
+def test_preload_attaches_new_chat_without_journal(store, monkeypatch):
+    manager = ConversationManager()
+    monkeypatch.setattr(manager, "store", store)
+    chat_id = 434343
+    manager._drop(chat_id)
+
+    asyncio.run(manager.preload(chat_id))
+
+    # После preload первое сообщение нового чата не читает SQLite в цикле событий
+    def load(chat_id):
+        raise AssertionError("store.load вызван после preload")
+    monkeypatch.setattr(store, "load", load)
+    manager.initialize_conversation(chat_id)
+    assert manager.get_message_count(chat_id) == 0
+    manager._drop(chat_id)
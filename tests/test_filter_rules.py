@@ -0,0 +1,35 @@
+import asyncio
+import pytest
+from config import Config
+from utils.filter_rules import RuleFilterExtractor
+
+
+@pytest.fixture(scope="module")
+def extractor(catalog):
+    extractor = RuleFilterExtractor()
+    asyncio.run(extractor.refresh())
+    return extractor
+
+
+def test_named_complex_with_features_is_not_confident(extractor):
+    params, confidence = extractor.extract("Андерсен у моря с парком")
+    assert params["complex_names"] == ["Андерсен"]
+    assert params["complex_search"] is True
+    assert params["complex_search_phrase"] == "моря с парком"
+    assert confidence < Config.FAST_FILTERS_CONFIDENCE
+
+
+def test_fully_parsed_message_is_confident(extractor):
+    params, confidence = extractor.extract("хочу двушку на Патрокле до 7,5 млн")
+    assert params["area"] == "патрокл"
+    assert params["num_rooms"] == [2]
+    assert params["max_price"] == 7_500_000
+    assert params["complex_search_phrase"] is None
+    assert confidence >= Config.FAST_FILTERS_CONFIDENCE
+
+
+def test_features_without_other_criteria(extractor):
+    params, confidence = extractor.extract("двушка с видом на море")
+    assert params["num_rooms"] == [2]
+    assert params["complex_search_phrase"] == "видом на море"
+    assert confidence < Config.FAST_FILTERS_CONFIDENCE
@@ -0,0 +1,60 @@
+import json
+import shutil
+import asyncio
+import threading
+from pathlib import Path
+import pytest
+from config import Config
+from utils.chromadb_client import ChromaDbClient
+
+KNOWLEDGE_DIR = Path(__file__).resolve().parent.parent / "knowledge_files"
+FILES = sorted(KNOWLEDGE_DIR.glob("*.json"))[:5]
+
+
+@pytest.fixture
+def knowledge(tmp_path, monkeypatch):
+    directory = tmp_path / "knowledge"
+    directory.mkdir()
+    for path in FILES:
+        shutil.copy(path, directory / path.name)
+    monkeypatch.setattr(Config, "KNOWLEDGE_DIR", str(directory))
+    monkeypatch.setattr(Config, "VECTOR_STORE", "numpy")
+    return directory
+
+
+def make_client(tmp_path, monkeypatch, name):
+    monkeypatch.setattr(Config, "NUMPY_INDEX_PATH", str(tmp_path / name))
+    return ChromaDbClient(None)
+
+
+def snapshot(client):
+    manifest = json.loads(Path(client.manifest_path).read_text(encoding="utf-8"))
+    return client.vector_store.get_ids(), manifest["chunks"], client.lexical_index.documents
+
+
+def test_changed_files_are_reindexed_off_the_loop(knowledge, tmp_path, monkeypatch):
+    client = make_client(tmp_path, monkeypatch, "incremental")
+    asyncio.run(client.load_knowledge_files())
+
+    changed, removed = FILES[0].name, FILES[1].name
+    data = json.loads((knowledge / changed).read_text(encoding="utf-8"))
+    data["short_text"] = "Новый текст про вид на море"
+    (knowledge / changed).write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    (knowledge / removed).unlink()
+
+    reads = []
+    read_document = client.read_document
+
+    def tracked(path):
+        reads.append((Path(path).name, threading.current_thread() is threading.main_thread()))
+        return read_document(path)
+    monkeypatch.setattr(client, "read_document", tracked)
+    asyncio.run(client.load_knowledge_files([changed, removed]))
+
+    # Перечитан только изменённый файл, и не в потоке цикла событий
+    assert reads == [(changed, False)]
+    # Результат тот же, что у полной пересборки с нуля
+    fresh = make_client(tmp_path, monkeypatch, "full")
+    asyncio.run(fresh.load_knowledge_files())
+    assert snapshot(client) == snapshot(fresh)
+    assert Path(removed).stem not in client.lexical_index.documents
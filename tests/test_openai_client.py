@@ -0,0 +1,21 @@
+import asyncio
+from config import Config
+from models.conversation_manager import PromptType
+from utils.openai_client import OpenAIClient
+
+
+def test_text_filters_use_filter_model(monkeypatch):
+    client = OpenAIClient()
+    chat_id = 515151
+    client._conversation_manager.initialize_conversation(chat_id)
+    client._conversation_manager.add_user_message(chat_id, "двушка до 7 млн")
+    models = []
+
+    async def ask(messages, model, **kwargs):
+        models.append(model)
+        return "max_price = 7000000", 0, 0
+    monkeypatch.setattr(client, "_ask_openai", ask)
+
+    asyncio.run(client.get_gpt4o_mini_response(chat_id, PromptType.MINI_DIALOG))
+    assert models == [Config.FILTER_MODEL]
+    client._conversation_manager.reset_conversation(chat_id)
@@ -0,0 +1,61 @@
+import pytest
+from sqlalchemy import event
+from config import Config
+from models.models import engine
+from models.query import get_filtered_apartments
+
+
+@pytest.fixture
+def sql_path():
+    saved = Config.APARTMENT_SEARCH_ENGINE, Config.FILTER_CACHE_ENABLED
+    Config.APARTMENT_SEARCH_ENGINE = "sql"
+    Config.FILTER_CACHE_ENABLED = False
+    yield
+    Config.APARTMENT_SEARCH_ENGINE, Config.FILTER_CACHE_ENABLED = saved
+
+
+def count_statements(**filters):
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        output = get_filtered_apartments(**filters)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    return output, len(statements)
+
+
+# Число запросов не зависит от количества найденных квартир и ЖК:
+# квартиры; + ЖК района, если задан район; + ЖК с районом и его квартиры, если запрошен один ЖК
+@pytest.mark.parametrize("filters, expected", [
+    (dict(), 1),
+    (dict(num_rooms=[2, 3], max_price=9_000_000), 1),
+    (dict(area="Первомайский"), 2),
+    (dict(area="Патрокл", num_rooms=[1]), 2),
+    (dict(area="Первомайский", city="Владивосток", sort_price="desc", limit=None), 2),
+    (dict(complex_names=["Андерсен"]), 3),
+    (dict(complex_names=["Лайм"], num_rooms=[2, 3]), 3),
+    (dict(complex_names=["Андерсен", "Лайм"]), 1),
+    (dict(area="Первомайский", complex_names=["Лайм"]), 4),
+    # Ничего не нашлось — остальные запросы не выполняются
+    (dict(area="нет такого района"), 1),
+    (dict(complex_names=["нет такого ЖК"]), 1),
+    (dict(complex_names=["Чуркин Парк"]), 1),
+])
+def test_sql_statement_count(catalog, sql_path, filters, expected):
+    output, statements = count_statements(**filters)
+    assert statements == expected, output
+
+
+def test_columnar_does_not_query(catalog):
+    saved = Config.APARTMENT_SEARCH_ENGINE, Config.FILTER_CACHE_ENABLED
+    Config.APARTMENT_SEARCH_ENGINE, Config.FILTER_CACHE_ENABLED = "columnar", False
+    try:
+        get_filtered_apartments()  # построение индекса
+        for filters in (dict(area="Первомайский"), dict(complex_names=["Андерсен"])):
+            assert count_statements(**filters)[1] == 0
+    finally:
+        Config.APARTMENT_SEARCH_ENGINE, Config.FILTER_CACHE_ENABLED = saved
@@ -0,0 +1,123 @@
+import time
+import asyncio
+import pytest
+from telegram import Chat, Message, Update
+from utils.update_processor import ChatOrderedUpdateProcessor
+
+
+def update(update_id, chat_id):
+    chat = Chat(chat_id, Chat.PRIVATE)
+    message = Message(update_id, date=None, chat=chat, text=f"сообщение {update_id}")
+    return Update(update_id, message=message)
+
+
+async def handle(log, name, delay):
+    log.append(("start", name))
+    await asyncio.sleep(delay)
+    log.append(("end", name))
+
+
+def test_updates_of_one_chat_run_in_order():
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor(8)
+        log = []
+        # Первые сообщения обрабатываются дольше последующих: без очереди по чату порядок сбился бы
+        delays = [0.05, 0.03, 0.01, 0]
+        await asyncio.gather(*(
+            processor.process_update(update(n, 1), handle(log, n, delay))
+            for n, delay in enumerate(delays)
+        ))
+        return processor, log
+
+    processor, log = asyncio.run(scenario())
+    assert log == [(event, n) for n in range(4) for event in ("start", "end")]
+    stats = processor.get_stats()
+    assert stats["updates"] == 4
+    assert stats["waited"] == 3
+    assert stats["active_chats"] == 0
+    assert stats["in_flight"] == 0
+
+
+def test_waiting_updates_of_busy_chat_do_not_take_slots():
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor(2)
+        finished = {}
+
+        async def reply(name, delay):
+            await asyncio.sleep(delay)
+            finished[name] = time.monotonic() - started
+
+        started = time.monotonic()
+        busy = [processor.process_update(update(n, 1), reply(("busy", n), 0.1)) for n in range(5)]
+        other = processor.process_update(update(100, 2), reply("other", 0.01))
+        await asyncio.gather(*busy, other)
+        return finished
+
+    finished = asyncio.run(scenario())
+    # Второй чат не ждёт очереди первого: его ответ готов раньше второго ответа занятого чата
+    assert finished["other"] < finished[("busy", 1)]
+    assert finished["other"] < 0.08
+
+
+def test_in_flight_never_exceeds_limit():
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor(3)
+        peak = 0
+
+        async def reply():
+            nonlocal peak
+            peak = max(peak, processor.current_concurrent_updates)
+            await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(processor.process_update(update(n, n % 7), reply()) for n in range(40)))
+        return processor, peak
+
+    processor, peak = asyncio.run(scenario())
+    assert peak == 3
+    assert processor.max_concurrent_updates == 3
+    assert processor.get_stats()["max_concurrent"] == 3
+
+
+def test_error_does_not_break_chat_order():
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor(4)
+        log = []
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("ошибка обработчика")
+
+        results = await asyncio.gather(
+            processor.process_update(update(1, 1), fail()),
+            processor.process_update(update(2, 1), handle(log, 2, 0)),
+            return_exceptions=True,
+        )
+        return processor, log, results
+
+    processor, log, results = asyncio.run(scenario())
+    assert isinstance(results[0], RuntimeError)
+    assert log == [("start", 2), ("end", 2)]
+    assert processor.get_stats()["errors"] == 1
+
+
+def test_cancelled_waiter_keeps_chat_order():
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor(4)
+        log = []
+        first = asyncio.create_task(processor.process_update(update(1, 1), handle(log, 1, 0.05)))
+        second = asyncio.create_task(processor.process_update(update(2, 1), handle(log, 2, 0)))
+        third = asyncio.create_task(processor.process_update(update(3, 1), handle(log, 3, 0)))
+        await asyncio.sleep(0.01)
+        second.cancel()
+        await asyncio.gather(first, second, third, return_exceptions=True)
+        return processor, log
+
+    processor, log = asyncio.run(scenario())
+    # Отменённое обновление не запускается, а следующее всё равно ждёт окончания первого
+    assert log == [("start", 1), ("end", 1), ("start", 3), ("end", 3)]
+    assert processor.get_stats()["active_chats"] == 0
+
+
+def test_rejects_non_positive_limit():
+    with pytest.raises(ValueError):
+        ChatOrderedUpdateProcessor(0)
@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import signal
+import socket
+import asyncio
+import httpx
+import pytest
+from telegram.ext import Application, MessageHandler, filters
+from telegram.request import BaseRequest
+from config import Config
+from utils.update_processor import ChatOrderedUpdateProcessor
+from utils.webhook_server import WebhookServer
+
+SECRET = "secret"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class FakeRequest(BaseRequest):
+    # Bot API без сети: getMe возвращает бота, остальные методы — успех
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        if url.endswith("/getMe"):
+            result = {"id": 1, "is_bot": True, "first_name": "test", "username": "test_bot"}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def update(update_id, chat_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": int(time.time()), "text": f"сообщение {update_id}",
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+        },
+    }
+
+
+def build_application(handled, delay=0.0):
+    async def reply(update, context):
+        await asyncio.sleep(delay)
+        handled.append(update.update_id)
+
+    application = (
+        Application.builder()
+        .token(os.environ["TELEGRAM_BOT_TOKEN"])
+        .updater(None)
+        .request(FakeRequest())
+        .get_updates_request(FakeRequest())
+        .concurrent_updates(ChatOrderedUpdateProcessor(8))
+        .build()
+    )
+    application.add_handler(MessageHandler(filters.TEXT, reply))
+    return application
+
+
+@pytest.fixture
+def webhook_config(monkeypatch):
+    monkeypatch.setattr(Config, "WEBHOOK_LISTEN", "127.0.0.1")
+    monkeypatch.setattr(Config, "WEBHOOK_PORT", free_port())
+    monkeypatch.setattr(Config, "WEBHOOK_URL", None)
+    monkeypatch.setattr(Config, "WEBHOOK_SECRET", SECRET)
+    monkeypatch.setattr(Config, "WEBHOOK_GRACEFUL_TIMEOUT", 5)
+
+
+
+async def request(server, method, path, **kwargs):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.request(method, path, **kwargs)
+
+
+def test_healthz_follows_server_state(webhook_config):
+    async def scenario():
+        server = WebhookServer(build_application([]), health=lambda: {"catalog": "ok"})
+        codes = {}
+        for state in ("starting", "running", "draining"):
+            server.state = state
+            response = await request(server, "GET", "/healthz")
+            codes[state] = response.status_code, response.json()
+        return codes
+
+    codes = asyncio.run(scenario())
+    assert codes["starting"][0] == 503
+    assert codes["running"][0] == 200
+    assert codes["draining"][0] == 503
+    body = codes["running"][1]
+    assert body["status"] == "running"
+    assert body["catalog"] == "ok"
+    assert body["updates"]["max_concurrent"] == 8
+
+
+def test_update_is_queued_or_refused(webhook_config):
+    async def scenario():
+        application = build_application([])
+        server = WebhookServer(application)
+        server.state = "running"
+        headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+        codes = [
+            (await request(server, "POST", Config.WEBHOOK_PATH, json=update(1, 1), headers=headers)).status_code,
+            (await request(server, "POST", Config.WEBHOOK_PATH, json=update(2, 1))).status_code,
+            (await request(server, "POST", Config.WEBHOOK_PATH, content=b"{", headers=headers)).status_code,
+        ]
+        server.stop()
+        codes.append(
+            (await request(server, "POST", Config.WEBHOOK_PATH, json=update(3, 1), headers=headers)).status_code
+        )
+        queued = application.update_queue.get_nowait().update_id
+        return codes, queued, application.update_queue.qsize(), server.stats
+
+    codes, queued, left, stats = asyncio.run(scenario())
+    assert codes == [200, 403, 400, 503]
+    assert queued == 1 and left == 0
+    assert stats == {"received": 1, "rejected": 1, "invalid": 1, "refused_draining": 1}
+
+
+def test_sigterm_drains_accepted_updates(webhook_config):
+    async def scenario():
+        handled = []
+        shutdown = []
+
+        async def post_shutdown(application):
+            shutdown.append(list(handled))
+
+        server = WebhookServer(build_application(handled, delay=0.2), post_shutdown=post_shutdown)
+        task = asyncio.create_task(server.run())
+        headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+        base = f"http://127.0.0.1:{Config.WEBHOOK_PORT}"
+        async with httpx.AsyncClient(base_url=base) as client:
+            while True:
+                try:
+                    if (await client.get("/healthz")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.02)
+            # Два сообщения одного чата и по одному от других: все приняты до сигнала
+            accepted = [(1, 1), (2, 1), (3, 2), (4, 3)]
+            codes = [
+                (await client.post(Config.WEBHOOK_PATH, json=update(u, c), headers=headers)).status_code
+                for u, c in accepted
+            ]
+            os.kill(os.getpid(), signal.SIGTERM)
+            while server.state != "draining":
+                await asyncio.sleep(0.01)
+        # Пока очередь дообрабатывается, балансировщик видит 503, а новые обновления не принимаются
+        health = (await request(server, "GET", "/healthz")).status_code
+        refused = (await request(server, "POST", Config.WEBHOOK_PATH, json=update(5, 4), headers=headers)).status_code
+        await asyncio.wait_for(task, 10)
+        return codes, (health, refused), handled, shutdown
+
+    codes, draining, handled, shutdown = asyncio.run(scenario())
+    assert codes == [200] * 4
+    assert draining == (503, 503)
+    assert sorted(handled) == [1, 2, 3, 4]
+    assert handled.index(1) < handled.index(2)
+    # post_shutdown вызывается, когда очередь уже дообработана
+    assert shutdown == [handled]
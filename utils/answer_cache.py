@@ -0,0 +1,128 @@
+import time
+import itertools
+from collections import OrderedDict
+import numpy as np
+from config import Config
+from models.catalog import get_catalog_version
+from models.filter_cache import make_filter_key, normalize_filter_value
+from logger_config import logger
+
+
+def make_answer_key(filters):
+    # Ответ зависит от найденных квартир и от поиска по базе знаний — оба входят в ключ
+    search = {
+        name: filters.get(name)
+        for name in ("area", "num_rooms", "min_square", "max_square", "min_price", "max_price",
+                     "city", "sort_price", "complex_names", "limit")
+    }
+    return (
+        make_filter_key(**search),
+        bool(filters.get("complex_search")),
+        normalize_filter_value(filters.get("complex_search_phrase")),
+        filters.get("isfilter", True),
+    )
+
+
+# Кэш готовых ответов на первые реплики диалога. Ответ берётся, если у нового сообщения те же
+# параметры поиска и эмбеддинг близок к уже отвеченному (косинус не ниже порога).
+# LRU по всем записям, срок жизни, весь кэш сбрасывается при смене версии каталога — цены в ответах
+# всегда из текущего каталога.
+class AnswerCache:
+
+    def __init__(self, max_size=None, ttl=None, threshold=None):
+        self.max_size = Config.ANSWER_CACHE_SIZE if max_size is None else max_size
+        self.ttl = Config.ANSWER_CACHE_TTL if ttl is None else ttl
+        self.threshold = Config.ANSWER_CACHE_THRESHOLD if threshold is None else threshold
+        # id -> (ключ фильтров, нормированный эмбеддинг, ответ, время записи)
+        self._entries = OrderedDict()
+        # ключ фильтров -> id записей: сравниваются только эмбеддинги с теми же фильтрами
+        self._buckets = {}
+        self._ids = itertools.count()
+        self._version = get_catalog_version()
+        self.stats = {
+            "hits": 0, "misses": 0, "ineligible": 0, "stores": 0,
+            "stale_stores": 0, "evictions": 0, "expired": 0, "invalidations": 0,
+        }
+
+    def _check_version(self):
+        version = get_catalog_version()
+        if version != self._version:
+            if self._entries:
+                self.stats["invalidations"] += 1
+            self._entries.clear()
+            self._buckets.clear()
+            self._version = version
+        return version
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+    def _remove(self, entry_id):
+        key = self._entries.pop(entry_id)[0]
+        bucket = self._buckets[key]
+        bucket.discard(entry_id)
+        if not bucket:
+            del self._buckets[key]
+
+    def _nearest(self, vector, key):
+        now = time.time()
+        best_id, best = None, -1.0
+        for entry_id in list(self._buckets.get(key, ())):
+            _, stored, _, created_at = self._entries[entry_id]
+            if self.ttl and now - created_at > self.ttl:
+                self._remove(entry_id)
+                self.stats["expired"] += 1
+                continue
+            if stored.shape != vector.shape:
+                continue
+            similarity = float(np.dot(vector, stored))
+            if similarity > best:
+                best_id, best = entry_id, similarity
+        return best_id, best
+
+    def get(self, embedding, key):
+        self._check_version()
+        entry_id, similarity = self._nearest(self._normalize(embedding), key)
+        if entry_id is None or similarity < self.threshold:
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(entry_id)
+        self.stats["hits"] += 1
+        logger.debug(f"Ответ из кэша, сходство {similarity:.3f}")
+        return self._entries[entry_id][2]
+
+    def put(self, embedding, key, answer, version):
+        # version — версия каталога на момент поиска; ответ по устаревшим ценам не сохраняем
+        if self._check_version() != version:
+            self.stats["stale_stores"] += 1
+            return
+        vector = self._normalize(embedding)
+        entry_id, similarity = self._nearest(vector, key)
+        if entry_id is not None and similarity >= self.threshold:
+            # Почти такой же вопрос уже есть — обновляем ответ, а не плодим соседей
+            self._remove(entry_id)
+        entry_id = next(self._ids)
+        self._entries[entry_id] = (key, vector, answer, time.time())
+        self._buckets.setdefault(key, set()).add(entry_id)
+        self.stats["stores"] += 1
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._buckets.clear()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["size"] = len(self._entries)
+        stats["version"] = self._version
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+answer_cache = AnswerCache()
@@ -0,0 +1,79 @@
+import asyncio
+from config import Config
+from logger_config import logger
+from models.async_query import run_in_db_executor
+from models.catalog import bump_catalog_version
+from utils.db_parser import sync_catalog_files
+
+try:
+    from watchfiles import awatch
+except ImportError:
+    awatch = None
+
+
+class CatalogSyncService:
+    # Следит за knowledge_files и без перезапуска бота доносит изменения до SQL-каталога
+    # и векторного индекса. Пересчитываются только изменённые файлы, затем поднимается версия каталога,
+    # и все кэши, привязанные к старой версии, перестают использоваться.
+
+    def __init__(self, chromadb_client, directory=None):
+        self.chromadb_client = chromadb_client
+        self.directory = directory or Config.KNOWLEDGE_DIR
+        self._lock = asyncio.Lock()
+        self._stop_event = None
+        self._task = None
+
+    async def start(self):
+        # При старте векторный индекс сверяется всегда: файлы могли поменяться, пока бот был выключен
+        await self.sync(force_vector=True)
+        self._stop_event = asyncio.Event()
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stop_event.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=5)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            self._task.cancel()
+        self._task = None
+
+    async def sync(self, force_vector=False):
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            try:
+                changed = await run_in_db_executor(sync_catalog_files, self.directory)
+                if force_vector:
+                    await self.chromadb_client.load_knowledge_files()
+                elif changed:
+                    await self.chromadb_client.load_knowledge_files(changed)
+            except Exception as e:
+                logger.error(f"Ошибка синхронизации каталога: {e}")
+                return []
+            if changed:
+                version = bump_catalog_version()
+                logger.info(
+                    f"Опубликована версия каталога {version}: файлов {len(changed)}, "
+                    f"{(loop.time() - started) * 1000:.0f} мс"
+                )
+            return changed
+
+    async def _watch(self):
+        if awatch is None:
+            logger.warning("watchfiles не установлен, knowledge_files проверяется по таймеру")
+            while not self._stop_event.is_set():
+                try:
+                    await asyncio.wait_for(self._stop_event.wait(), timeout=Config.CATALOG_SYNC_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    await self.sync()
+            return
+
+        async for _ in awatch(
+            self.directory,
+            watch_filter=lambda change, path: path.endswith(".json"),
+            debounce=Config.CATALOG_SYNC_DEBOUNCE_MS,
+            stop_event=self._stop_event,
+        ):
+            await self.sync()
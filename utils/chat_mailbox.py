@@ -0,0 +1,131 @@
+import asyncio
+from config import Config
+from logger_config import logger
+
+
+class Turn:
+    __slots__ = ("chat_id", "items", "committed", "task")
+
+    def __init__(self, chat_id, items):
+        self.chat_id = chat_id
+        self.items = items
+        self.committed = False
+        self.task = None
+
+    def commit(self):
+        # Ответ записан в историю: дальше ход доводится до конца, даже если пришли новые сообщения
+        self.committed = True
+
+
+class _ChatBox:
+    __slots__ = ("pending", "carried", "first_at", "last_at", "turn", "worker")
+
+    def __init__(self):
+        self.pending = []
+        self.carried = []
+        self.first_at = 0.0
+        self.last_at = 0.0
+        self.turn = None
+        self.worker = None
+
+
+# Почтовый ящик на каждый чат: ходы одного чата выполняются строго по очереди, разные чаты — параллельно.
+# Сообщения, пришедшие в пределах debounce или пока ход ещё не записал ответ, склеиваются в один ход;
+# незаписанный ход при этом отменяется и перезапускается уже со всеми сообщениями.
+class ChatMailbox:
+
+    def __init__(self, handler, debounce=None, max_delay=None, cancel_superseded=None):
+        self.handler = handler
+        self.debounce = Config.CHAT_DEBOUNCE if debounce is None else debounce
+        self.max_delay = Config.CHAT_DEBOUNCE_MAX if max_delay is None else max_delay
+        self.cancel_superseded = Config.CHAT_CANCEL_SUPERSEDED if cancel_superseded is None else cancel_superseded
+        self._boxes = {}
+        self.stats = {"messages": 0, "turns": 0, "merged": 0, "superseded": 0, "errors": 0}
+
+    def submit(self, chat_id, item):
+        loop = asyncio.get_running_loop()
+        box = self._boxes.get(chat_id)
+        if box is None:
+            box = self._boxes[chat_id] = _ChatBox()
+        now = loop.time()
+        if not box.pending:
+            box.first_at = now
+        box.pending.append(item)
+        box.last_at = now
+        self.stats["messages"] += 1
+        turn = box.turn
+        if self.cancel_superseded and turn is not None and not turn.committed and not turn.task.done():
+            turn.task.cancel()
+            self.stats["superseded"] += 1
+        if box.worker is None:
+            box.worker = asyncio.create_task(self._worker(chat_id, box), name=f"chat:{chat_id}")
+
+    def cancel(self, chat_id):
+        # Сброс диалога: ожидающие сообщения выбрасываются, незаписанный ход отменяется
+        box = self._boxes.get(chat_id)
+        if box is None:
+            return
+        box.pending.clear()
+        box.carried.clear()
+        if box.turn is not None and not box.turn.committed:
+            box.turn.task.cancel()
+
+    async def _debounce(self, box):
+        loop = asyncio.get_running_loop()
+        while True:
+            deadline = min(box.last_at + self.debounce, box.first_at + self.max_delay)
+            delay = deadline - loop.time()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    async def _worker(self, chat_id, box):
+        try:
+            while box.pending or box.carried:
+                if box.pending:
+                    await self._debounce(box)
+                new_items, box.pending = box.pending, []
+                items, box.carried = box.carried + new_items, []
+                if not items:
+                    continue
+                turn = box.turn = Turn(chat_id, items)
+                turn.task = asyncio.create_task(self.handler(turn))
+                self.stats["turns"] += 1
+                try:
+                    await asyncio.wait({turn.task})
+                except asyncio.CancelledError:
+                    turn.task.cancel()
+                    raise
+                finally:
+                    box.turn = None
+                if turn.task.cancelled():
+                    # Ход вытеснен новыми сообщениями: его сообщения войдут в следующий
+                    if box.pending:
+                        box.carried = items
+                elif turn.task.exception() is not None:
+                    self.stats["errors"] += 1
+                    logger.error(f"Ошибка при обработке сообщений чата {chat_id}", exc_info=turn.task.exception())
+                else:
+                    self.stats["merged"] += len(items) - 1
+        finally:
+            box.worker = None
+            if self._boxes.get(chat_id) is box and not box.pending:
+                del self._boxes[chat_id]
+
+    async def drain(self, timeout=None):
+        # Остановка: даём начатым ходам доработать, по таймауту отменяем оставшиеся
+        workers = [box.worker for box in self._boxes.values() if box.worker is not None]
+        if not workers:
+            return
+        done, pending = await asyncio.wait(workers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"Не дождались обработки сообщений в {len(pending)} чатах")
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["active_chats"] = len(self._boxes)
+        stats["in_flight"] = sum(1 for box in self._boxes.values() if box.turn is not None)
+        return stats
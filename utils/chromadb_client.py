@@ -1,139 +1,260 @@
+import os
 import json
-import logging
-import chromadb
-from datetime import datetime
-from chromadb.errors import ChromaError
+import asyncio
+import hashlib
 from config import Config
 from pathlib import Path
-from models.conversation_manager import ConversationManager, Role
-from sentence_transformers import SentenceTransformer
 from logger_config import logger
-from utils.db_parser import parse_json_files, parse_filter_text
-from models.query import get_filtered_apartments, get_complex_info_by_names
-import json
-import asyncio
-import pickle
+from utils.embedding_cache import EmbeddingCache
+from utils.vector_store import create_vector_store
+from utils.embedders import create_embedder
+from utils.openai_scheduler import BACKGROUND
+from utils.lexical_index import LexicalIndex, reciprocal_rank_fusion
 
 
 class ChromaDbClient:
+
+    MANIFEST_FILE = "manifest.json"
+
     def __init__(self, openai_client):
         self.client = openai_client
+        self.embedder = create_embedder(openai_client)
         self.current_complexes = {}
-        self.chroma_client = chromadb.Client()
+        # Индекс хранится на диске, поэтому после рестарта пересчитываются только изменённые части
         try:
-            self.knowledge_collection = self._load_or_create_collection("knowledge_embeddings")
-            logger.info("Коллекция 'knowledge_embeddings' успешно загружена.")
+            self.vector_store = create_vector_store()
         except Exception as e:
-            logging.error(f"Ошибка при инициализации коллекции: {e}")
-            self.knowledge_collection = None
-        # self.embedding_model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-        self.load_knowledge_files()
-        print('--end--')
-
-    def _load_or_create_collection(self, collection_name):
-        try:
-            return self.chroma_client.get_collection(collection_name)
-        except ChromaError:
-            logger.error(f"Коллекция '{collection_name}' не найдена, создаём новую.")
-            return self.chroma_client.create_collection(collection_name)
-        except Exception as e:
-            logger.error(f"Ошибка с коллекцией {e}")
+            logger.error(f"Ошибка при инициализации векторного хранилища: {e}")
+            self.vector_store = None
+        self.manifest_path = os.path.join(
+            self.vector_store.path if self.vector_store else Config.CHROMA_DB_PATH, self.MANIFEST_FILE
+        )
+        self.lexical_index = LexicalIndex(min_coverage=Config.LEXICAL_MIN_COVERAGE)
+        self.query_cache = EmbeddingCache(
+            Config.EMBEDDING_CACHE_PATH,
+            max_size=Config.EMBEDDING_CACHE_SIZE,
+            ttl=Config.EMBEDDING_CACHE_TTL,
+            max_disk_entries=Config.EMBEDDING_CACHE_MAX_DISK_ENTRIES,
+            prune_interval=Config.EMBEDDING_CACHE_PRUNE_INTERVAL,
+        )
 
     async def search_in_vector_db(self, query, city=None):
         try:
             # logger.info(f"----------vectorDB query: {query}")
-            # query_embedding = self.embedding_model.encode(query).tolist()
-            
-            # response = await self.client.embeddings.create(input=query, model="text-embedding-3-large")
-            response = await self.client.embeddings.create(input=query, model="text-embedding-3-large")
-            query_embedding = response.data[0].embedding
-
-            if city:
-                results = self.knowledge_collection.query(
-                    query_embeddings=[query_embedding],
-                    n_results=100,
-                    where={"city": city}
-                )
+            documents_by_source = dict(self.lexical_index.documents)
+            confident_source = None
+            if Config.HYBRID_SEARCH:
+                confident_source = self.lexical_index.match_name(query, city=city)
+
+            if confident_source:
+                # Запрос называет ЖК напрямую — эмбеддинг и векторный поиск не нужны
+                logger.info(f"----------lexical match: {confident_source}")
+                ranking = [confident_source]
             else:
-                results = self.knowledge_collection.query(
-                    query_embeddings=[query_embedding],
-                    n_results=100
+                query_embedding = await self.embed_query(query)
+
+                results = self.vector_store.query(
+                    query_embedding,
+                    n_results=100,
+                    where={"city": city} if city else None
                 )
-            
-            # Потом фильтруем сами
-            final_results = []
-
-            for doc, distance in zip(results["documents"][0], results["distances"][0]):
-                print(doc, distance)
-                if distance < 0.2:  # например, оставить только очень похожие
-                    final_results.append(doc)
-        
+
+                vector_ranking = []
+                for meta in results["metadatas"][0]:
+                    if meta["source"] not in vector_ranking:
+                        vector_ranking.append(meta["source"])
+                    documents_by_source.setdefault(meta["source"], {
+                        "complex_name": meta.get("complex_name"),
+                        "content": meta.get("content"),
+                    })
+                ranking = vector_ranking
+                if Config.HYBRID_SEARCH:
+                    lexical_ranking = [source for source, _ in self.lexical_index.search(query, limit=100, city=city)]
+                    ranking = reciprocal_rank_fusion([vector_ranking, lexical_ranking], k=Config.RRF_K)
+
             logger.info("----------vectorDB result:")
-            complex_names = []
-            if results and results["metadatas"]:
-                # documents = []
-                for meta, distance in zip(results["metadatas"][0], results["distances"][0]):
-                    # if "content" in meta and distance < 1.45:
-                    data = json.loads(meta["content"])
-                        # new_data = {}
-                        # new_data['complex_name'] = data.get("complex_name")
-                    complex_names.append(data.get("complex_name"))
-                    print(data.get("complex_name"), distance)
-                        # new_data['area'] = data.get("area")
-                        # new_data['general_texts'] = data.get("general_texts")
-                        # new_json_str = json.dumps(new_data, ensure_ascii=False)
-                        # documents.append(new_json_str)
-                documents = [meta["content"] for meta in results["metadatas"][0][0:3] if "content" in meta]
-                # [complex_name.strip() for complex_name in complex_names]
-                # [n.strip() for n in value.split(",")]
-                return "Результат поиска в базе знаний запроса:/n"+"\n".join(documents), complex_names[0:3]
-            return "Извините, информация не найдена."
+            top_sources = [source for source in ranking if source in documents_by_source][0:3]
+            if top_sources:
+                documents = [documents_by_source[source]["content"] for source in top_sources]
+                complex_names = [documents_by_source[source]["complex_name"] for source in top_sources]
+                logger.info(complex_names)
+                return "Результат поиска в базе знаний запроса:/n"+"\n".join(documents), complex_names
+            return "Извините, информация не найдена.", []
         except Exception as e:
             logger.error(f"Ошибка поиска в векторной базе данных: {e}")
-            return "Произошла ошибка при обработке запроса."
-    
-    def load_knowledge_files(self):
-        folder_path = Path("knowledge_files")
-        for file in folder_path.glob("*.json"):
-            self.read_and_embed(str(file), file.stem)
-
-    def read_and_embed(self, file_path, source):
+            return "Произошла ошибка при обработке запроса.", []
+
+    async def embed_query(self, query):
+        # Повторяющиеся поисковые фразы не ходят в сеть
+        key = EmbeddingCache.make_key(query, self.embedder.model_name, self.embedder.dimensions)
+        embedding = await self.query_cache.get(key)
+        if embedding is None:
+            embedding = (await self.embedder.encode([query]))[0]
+            self.query_cache.put(key, embedding)
+        return embedding
+
+    async def load_knowledge_files(self, changed=None):
+        # Инкрементальная синхронизация: эмбеддинги считаются только для новых или изменённых частей.
+        # Чтение файлов, хеши, запись в индекс и сборка лексического индекса идут в пуле потоков,
+        # в цикле событий остаются только запросы эмбеддингов. changed — имена изменённых файлов
+        # от CatalogSyncService: перечитываются только они, None — полная сверка.
+        if self.vector_store is None:
+            return
+        loop = asyncio.get_running_loop()
+        manifest, stored_ids, pending, stale_ids, lexical_documents, files = await loop.run_in_executor(
+            None, self._scan_knowledge_files, changed
+        )
+        if stale_ids:
+            await loop.run_in_executor(None, self._delete_chunks, manifest, stored_ids, stale_ids)
+            logger.info(f"Удалено устаревших частей из индекса: {len(stale_ids)}")
+
+        for start in range(0, len(pending), Config.EMBEDDING_BATCH_SIZE):
+            batch = pending[start:start + Config.EMBEDDING_BATCH_SIZE]
+            try:
+                # Пересчёт индекса — фоновая работа, ответы пользователям идут в очереди впереди
+                embeddings = await self.embedder.encode([chunk for _, chunk, _, _ in batch], priority=BACKGROUND)
+            except Exception as e:
+                logger.error(f"Ошибка при создании эмбеддингов: {e}")
+                break
+            await loop.run_in_executor(None, self._store_batch, manifest, batch, embeddings)
+
+        self.lexical_index = await loop.run_in_executor(None, self._build_lexical_index, lexical_documents)
+        logger.info(
+            f"Индекс базы знаний синхронизирован: перечитано файлов {files}, всего частей {len(manifest['chunks'])}, "
+            f"пересчитано {len(pending)}, удалено {len(stale_ids)}"
+        )
+
+    def _scan_knowledge_files(self, changed):
+        manifest = self._read_manifest()
+        model = self.embedder.model_name
+        if self.embedder.dimensions:
+            model = f"{model}:{self.embedder.dimensions}"
+        if manifest.get("model") != model:
+            if manifest:
+                logger.info(f"Модель эмбеддингов изменилась ({manifest.get('model')} -> {model}), индекс пересоздаётся.")
+                self.vector_store.reset()
+            manifest = {"model": model, "chunks": {}}
+            changed = None
+        if not self.lexical_index.documents:
+            # Лексического индекса ещё нет — собрать его можно только по всем файлам
+            changed = None
+        chunk_hashes = manifest["chunks"]
+        stored_ids = self.vector_store.get_ids()
+
+        if changed is None:
+            files = sorted(Path(Config.KNOWLEDGE_DIR).glob("*.json"))
+            lexical_documents = {}
+        else:
+            # Удалённые файлы тоже в changed: их части уйдут в устаревшие, документ — из лексического индекса
+            sources = {Path(name).stem for name in changed}
+            files = sorted(
+                path for path in (Path(Config.KNOWLEDGE_DIR) / name for name in changed)
+                if path.suffix == ".json" and path.exists()
+            )
+            lexical_documents = {
+                source: doc for source, doc in self.lexical_index.documents.items() if source not in sources
+            }
+
+        pending = []
+        seen_ids = set()
+        for file in files:
+            document_data = self.read_document(str(file))
+            if document_data is None:
+                continue
+            chunks = self.make_chunks(document_data, file.stem)
+            lexical_documents[file.stem] = {
+                "complex_name": document_data.get("complex_name", "Unknown"),
+                "city": document_data.get("city") or "Unknown",
+                "content": " ".join(chunk for _, chunk, _ in chunks),
+                "texts": [document_data.get("area"), document_data.get("short_text"), document_data.get("general_texts")],
+                "aliases": document_data.get("aliases", []),
+            }
+            for chunk_id, chunk, metadata in chunks:
+                seen_ids.add(chunk_id)
+                content_hash = self._hash_chunk(chunk)
+                if chunk_hashes.get(chunk_id) == content_hash and chunk_id in stored_ids:
+                    continue
+                pending.append((chunk_id, chunk, metadata, content_hash))
+
+        known_ids = stored_ids | set(chunk_hashes)
+        if changed is not None:
+            known_ids = {chunk_id for chunk_id in known_ids if self._chunk_source(chunk_id) in sources}
+        stale_ids = sorted(known_ids - seen_ids)
+        return manifest, stored_ids, pending, stale_ids, dict(sorted(lexical_documents.items())), len(files)
+
+    def _delete_chunks(self, manifest, stored_ids, stale_ids):
+        self.vector_store.delete([i for i in stale_ids if i in stored_ids])
+        for chunk_id in stale_ids:
+            manifest["chunks"].pop(chunk_id, None)
+        self._write_manifest(manifest)
+
+    def _store_batch(self, manifest, batch, embeddings):
+        self.vector_store.upsert(
+            ids=[chunk_id for chunk_id, _, _, _ in batch],
+            embeddings=embeddings,
+            metadatas=[metadata for _, _, metadata, _ in batch],
+        )
+        for chunk_id, _, _, content_hash in batch:
+            manifest["chunks"][chunk_id] = content_hash
+        # Манифест сохраняем после каждой пачки, чтобы при сбое не пересчитывать готовое
+        self._write_manifest(manifest)
+
+    @staticmethod
+    def _build_lexical_index(documents):
+        return LexicalIndex(min_coverage=Config.LEXICAL_MIN_COVERAGE).build(documents)
+
+    @staticmethod
+    def _chunk_source(chunk_id):
+        return chunk_id.rsplit("_chunk_", 1)[0]
+
+    def read_document(self, file_path):
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
-                document_data = json.load(f)
-                complex_name = document_data.get("complex_name", "Unknown")
-                city = document_data.get("city", "Unknown")
-                document_text = json.dumps(document_data, ensure_ascii=False)
-                chunks = self.split_text_into_chunks(document_text)
-                for i, chunk in enumerate(chunks):
-                    # CREATE AND DUMP TO FILE
-                    # response = self.client.embeddings.create(input=chunk, model="text-embedding-3-large")
-                    # response = asyncio.run(self.client.embeddings.create(input=chunk, model="text-embedding-3-large"))
-                    # embedding = response.data[0].embedding
-                    # with open(f"saved_embeddings/{source}.pkl", "wb") as f:
-                    #     pickle.dump(embedding, f)
-                        
-                    embedding = None
-                    with open(f"saved_embeddings/{source}.pkl", "rb") as f:
-                        embedding = pickle.load(f)
-                    
-                    # if i > 0:
-                    #     logger.info(i)
-                    # embedding = self.embedding_model.encode(chunk).tolist()
-                    self.knowledge_collection.add(
-                        embeddings=[embedding],
-                        metadatas=[{
-                            "source": source,
-                            "chunk_index": i,
-                            "content": chunk,
-                            "complex_name": complex_name,
-                            "city": city
-                        }],
-                        ids=[f"{source}_chunk_{i}"]
-                    )
-                    logger.info(f"Добавлен эмбеддинг для {source}, часть {i}, complex_name: {complex_name}")
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Ошибка при чтении файла {file_path}: {e}")
+            return None
+
+    def make_chunks(self, document_data, source):
+        complex_name = document_data.get("complex_name", "Unknown")
+        city = document_data.get("city") or "Unknown"
+        document_text = json.dumps(document_data, ensure_ascii=False)
+        chunks = self.split_text_into_chunks(document_text)
+        return [
+            (
+                f"{source}_chunk_{i}",
+                chunk,
+                {
+                    "source": source,
+                    "chunk_index": i,
+                    "content": chunk,
+                    "complex_name": complex_name,
+                    "city": city
+                },
+            )
+            for i, chunk in enumerate(chunks)
+        ]
+
+    @staticmethod
+    def _hash_chunk(chunk):
+        return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
         except Exception as e:
-            logger.error(f"Ошибка при создании эмбеддингов для {file_path}: {e}")
+            logger.error(f"Манифест индекса повреждён, индекс будет пересчитан: {e}")
+            return {}
+
+    def _write_manifest(self, manifest):
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
 
     def split_text_into_chunks(self, text: str, chunk_size: int = 2300) -> list:
         words = text.split()
@@ -1,7 +1,15 @@
 import os
 import json
 import re
-from models.models import ResidentialComplex, Apartment, Session
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import create_engine, delete, insert, select, update
+from config import Config
+from models.models import Area, ResidentialComplex, Apartment, CatalogFile, Base, engine, session_scope
+from models.catalog import bump_catalog_version
+from models.apartment_filters import ApartmentFilters, parse_number
+from pydantic import ValidationError
 from logger_config import logger
 
 def clean_text(text):
@@ -27,20 +35,24 @@ def extract_square_meters(apartment_type):
     match = re.search(r'(\d+)\s*м²', apartment_type)
     return float(match.group(1)) if match else None
 
+# Основы слов «комнатности» в описаниях квартир, по порядку проверки.
+# Тот же словарь использует быстрый разбор сообщений пользователя (utils.filter_rules)
+ROOM_WORDS = (
+    ("однокомна", 1),
+    ("одонкомнатная", 1),
+    ("двухкомна", 2),
+    ("трехкомн", 3),
+    ("трёх", 3),
+    ("четырехко", 4),
+    ("пятикомнат", 5),
+    ("студия", 0),
+)
+
 def extract_rooms(apartment_type):
     lower = apartment_type.lower().replace(" ", "")
-    if "однокомна" in lower or "одонкомнатная" in lower:
-        return 1
-    if "двухкомна" in lower:
-        return 2
-    if "трехкомн" in lower or "трёх" in lower:
-        return 3
-    if "четырехко" in lower:
-        return 4
-    if "пятикомнат" in lower:
-        return 5
-    if "студия" in lower or "студия" in lower:
-        return 0
+    for stem, rooms in ROOM_WORDS:
+        if stem in lower:
+            return rooms
     return None
 
 def parse_apartment_data(apartment):
@@ -57,99 +69,313 @@ def parse_apartment_data(apartment):
         "num_rooms": int(num_rooms) if num_rooms is not None else None
     }
     
-def parse_json_files(directory="knowledge_files"):
-    session = Session()
-    
-    session.query(Apartment).delete()
-    session.query(ResidentialComplex).delete()
-    session.commit()
-    
-    for filename in os.listdir(directory):
-        if filename.endswith(".json"):
-            filepath = os.path.join(directory, filename)
-            with open(filepath, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            complex_obj = ResidentialComplex(
-                complex_name=data.get("complex_name"),
-                area=data.get("area"),
-                general_texts=data.get("general_texts", "")
-            )
-            session.add(complex_obj)
-            session.flush()  # Получаем ID для связки
+def parse_json_file(filepath):
+    # Выполняется в отдельном процессе: чтение JSON и разбор квартир регулярками.
+    # Файлы без complex_name (например, статистика) тоже возвращаются — с пустым ЖК, чтобы учесть их хеш
+    with open(filepath, "rb") as f:
+        raw = f.read()
+    data = json.loads(raw.decode("utf-8"))
+    item = {
+        "filename": os.path.basename(filepath),
+        "content_hash": hashlib.sha256(raw).hexdigest(),
+        "complex_name": None,
+        "area": None,
+        "general_texts": "",
+        "apartments": [],
+    }
+    if isinstance(data, dict) and data.get("complex_name"):
+        item.update(
+            complex_name=data["complex_name"],
+            area=data.get("area"),
+            general_texts=data.get("general_texts", ""),
+            apartments=[parse_apartment_data(apt) for apt in data.get("apartments_with_prices") or []],
+        )
+    return item
 
-            for apt in data.get("apartments_with_prices", []):
-                apt_data = parse_apartment_data(apt)
-                apartment = Apartment(
-                    apartment_type=apt_data["apartment_type"],
-                    price=apt_data["price"],
-                    size_sqm=apt_data["size_sqm"],
-                    num_rooms=apt_data["num_rooms"],
-                    complex_id=complex_obj.id
-                )
-                session.add(apartment)
 
-    session.commit()
-    session.close()
-    logger.info("Данные успешно загружены в БД.")
+def hash_json_file(filepath):
+    with open(filepath, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
 
 
-import re
+def _parse_files(filepaths, workers):
+    if workers <= 1 or len(filepaths) <= 1:
+        return [parse_json_file(path) for path in filepaths]
+    with ProcessPoolExecutor(max_workers=min(workers, len(filepaths))) as pool:
+        return list(pool.map(parse_json_file, filepaths, chunksize=max(1, len(filepaths) // (workers * 4))))
 
-def parse_filter_text(text: str, complex_names=None):
-    params = {
-        "complex_search": None,
-        "city": None,
-        "area": None,
-        "complex_search_phrase": None,
-        "complex_names": None,
-        "num_rooms": None,
-        "min_square": None,
-        "max_square": None,
-        "min_price": None,
-        "max_price": None,
-        "sort_price": None,
-        "isfilter": True,
-        "limit": 3,
+
+def _read_carried_data(source_engine):
+    # Привязка ЖК к району/городу в JSON не хранится — переносим её и районы из текущей БД
+    with source_engine.connect() as conn:
+        areas = [row._asdict() for row in conn.execute(
+            select(Area.id, Area.name, Area.parent_id).order_by(Area.id)
+        )]
+        complexes = {}
+        for row in conn.execute(
+            select(
+                ResidentialComplex.complex_name,
+                ResidentialComplex.area_id,
+                ResidentialComplex.short_text,
+                ResidentialComplex.city,
+            ).order_by(ResidentialComplex.id)
+        ):
+            complexes.setdefault(row.complex_name, row._asdict())
+    return areas, complexes
+
+
+def read_areas_file(path):
+    # [{"id": 1, "name": "первомайский", "parent_id": null}, ...]; id должны совпадать с id в БД,
+    # на них ссылаются перенесённые привязки ЖК
+    with open(path, "r", encoding="utf-8") as f:
+        areas = [
+            {"id": int(area["id"]), "name": area["name"].strip().lower(), "parent_id": area.get("parent_id")}
+            for area in json.load(f)
+        ]
+    ids = {area["id"] for area in areas}
+    orphans = [area["name"] for area in areas if area["parent_id"] is not None and area["parent_id"] not in ids]
+    if len(ids) != len(areas) or orphans:
+        raise ValueError(f"Справочник районов {path} некорректен: повторяющиеся id или неизвестные родители {orphans}")
+    return areas
+
+
+def export_areas(path=None):
+    # Выгрузка районов текущей БД в справочник, чтобы хранить его в репозитории
+    path = path or Config.AREAS_FILE
+    areas, _ = _read_carried_data(engine)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(areas, f, ensure_ascii=False, indent=2)
+    logger.info(f"Районов выгружено в {path}: {len(areas)}")
+    return len(areas)
+
+
+def _match_area_id(area_text, area_ids):
+    # "Район: Бам" -> id района "бам", если такой есть
+    if not area_text:
+        return None
+    name = re.sub(r"^\s*район\s*:\s*", "", area_text.lower()).strip()
+    return area_ids.get(name)
+
+
+def _build_catalog_db(path, parsed, areas, carried):
+    target = create_engine(f"sqlite:///{path}")
+    try:
+        Base.metadata.create_all(target)
+        area_ids = {}
+        for area in areas:
+            area_ids.setdefault(area["name"], area["id"])
+        known_area_ids = {area["id"] for area in areas}
+
+        complex_rows, apartment_rows, file_rows = [], [], []
+        for item in parsed:
+            if not item["complex_name"]:
+                file_rows.append({"filename": item["filename"], "content_hash": item["content_hash"], "complex_id": None})
+                continue
+            complex_id = len(complex_rows) + 1
+            file_rows.append({"filename": item["filename"], "content_hash": item["content_hash"], "complex_id": complex_id})
+            previous = carried.get(item["complex_name"])
+            if previous is not None:
+                area_id, short_text, city = previous["area_id"], previous["short_text"], previous["city"]
+                if area_id not in known_area_ids:
+                    area_id = _match_area_id(item["area"], area_ids)
+            else:
+                area_id, short_text, city = _match_area_id(item["area"], area_ids), None, "Владивосток"
+            complex_rows.append({
+                "id": complex_id,
+                "complex_name": item["complex_name"],
+                "area_id": area_id,
+                "general_texts": item["general_texts"],
+                "short_text": short_text,
+                "city": city,
+            })
+            for apt in item["apartments"]:
+                apartment_rows.append({**apt, "complex_id": complex_id})
+
+        # Одна транзакция, вставка через executemany без ORM и flush на каждую запись
+        with target.begin() as conn:
+            if areas:
+                conn.execute(insert(Area.__table__), areas)
+            if complex_rows:
+                conn.execute(insert(ResidentialComplex.__table__), complex_rows)
+            if apartment_rows:
+                conn.execute(insert(Apartment.__table__), apartment_rows)
+            if file_rows:
+                conn.execute(insert(CatalogFile.__table__), file_rows)
+        return len(complex_rows), len(apartment_rows)
+    finally:
+        target.dispose()
+
+
+def parse_json_files(directory="knowledge_files", workers=None):
+    # Каталог собирается в новом файле рядом с рабочим и подменяет его через os.replace:
+    # читатели видят либо старый каталог целиком, либо новый, но никогда не пустой или частичный
+    started = time.perf_counter()
+    filepaths = sorted(
+        os.path.join(directory, filename) for filename in os.listdir(directory) if filename.endswith(".json")
+    )
+    parsed = _parse_files(filepaths, workers or Config.PARSER_WORKERS)
+
+    areas, carried = _read_carried_data(engine)
+    if os.path.exists(Config.AREAS_FILE):
+        areas = read_areas_file(Config.AREAS_FILE)
+    if not areas:
+        # Без районов фильтр по району молча ничего не находит — такой каталог не подменяем
+        raise RuntimeError(
+            f"Нет районов для каталога: файла {Config.AREAS_FILE} нет, а в текущей БД районов нет. "
+            f"Положите справочник районов в {Config.AREAS_FILE} (export_areas выгружает его из рабочей БД)."
+        )
+    tmp_path = f"{Config.DB_PATH}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        complexes_count, apartments_count = _build_catalog_db(tmp_path, parsed, areas, carried)
+        os.replace(tmp_path, Config.DB_PATH)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    # Соединения из пула указывают на старый файл
+    engine.dispose()
+    bump_catalog_version()
+    logger.info(
+        f"Данные успешно загружены в БД: ЖК {complexes_count}, квартир {apartments_count}, районов {len(areas)}, "
+        f"{time.perf_counter() - started:.2f} с."
+    )
+
+
+def _upsert_complex(session, item, complex_id, area_ids):
+    # Обновляет ЖК на месте: описание и квартиры из файла, район/город/краткое описание остаются прежними
+    if complex_id is None:
+        complex_id = session.execute(
+            select(ResidentialComplex.id)
+            .where(ResidentialComplex.complex_name == item["complex_name"])
+            .order_by(ResidentialComplex.id)
+            .limit(1)
+        ).scalar()
+    if complex_id is None:
+        complex_id = session.execute(
+            insert(ResidentialComplex).values(
+                complex_name=item["complex_name"],
+                area_id=_match_area_id(item["area"], area_ids),
+                general_texts=item["general_texts"],
+                city="Владивосток",
+            )
+        ).inserted_primary_key[0]
+    else:
+        session.execute(
+            update(ResidentialComplex)
+            .where(ResidentialComplex.id == complex_id)
+            .values(complex_name=item["complex_name"], general_texts=item["general_texts"])
+        )
+    session.execute(delete(Apartment).where(Apartment.complex_id == complex_id))
+    if item["apartments"]:
+        session.execute(insert(Apartment), [{**apt, "complex_id": complex_id} for apt in item["apartments"]])
+    return complex_id
+
+
+def _delete_complex(session, complex_id):
+    session.execute(delete(Apartment).where(Apartment.complex_id == complex_id))
+    session.execute(delete(ResidentialComplex).where(ResidentialComplex.id == complex_id))
+
+
+def sync_catalog_files(directory="knowledge_files"):
+    # Инкрементальная синхронизация каталога с knowledge_files: по хешам из catalog_files находим
+    # новые, изменённые и удалённые файлы и в одной транзакции обновляем только их ЖК.
+    # Возвращает имена затронутых файлов; версию каталога поднимает вызывающий код.
+    current = {
+        filename: os.path.join(directory, filename)
+        for filename in os.listdir(directory) if filename.endswith(".json")
     }
-    if complex_names:
-        params["complex_names"] = complex_names
+    with session_scope() as session:
+        known = {row.filename: row for row in session.scalars(select(CatalogFile))}
+        changed = []
+        for filename, path in sorted(current.items()):
+            try:
+                content_hash = hash_json_file(path)
+            except OSError as e:
+                # Файл удалили или ещё пишут — разберёмся при следующем событии
+                logger.warning(f"Не удалось прочитать {path}: {e}")
+                continue
+            if filename not in known or known[filename].content_hash != content_hash:
+                changed.append(path)
+        removed = sorted(set(known) - set(current))
+        if not changed and not removed:
+            return []
+
+        area_ids = {}
+        for area_id, name in session.execute(select(Area.id, Area.name).order_by(Area.id)):
+            area_ids.setdefault(name, area_id)
 
-    for line in text.strip().splitlines():
+        for filename in removed:
+            if known[filename].complex_id is not None:
+                _delete_complex(session, known[filename].complex_id)
+            session.execute(delete(CatalogFile).where(CatalogFile.filename == filename))
+
+        for path in changed:
+            try:
+                item = parse_json_file(path)
+            except (OSError, ValueError) as e:
+                logger.error(f"Ошибка разбора {path}: {e}")
+                continue
+            previous = known.get(item["filename"])
+            complex_id = previous.complex_id if previous is not None else None
+            if item["complex_name"]:
+                complex_id = _upsert_complex(session, item, complex_id, area_ids)
+            elif complex_id is not None:
+                _delete_complex(session, complex_id)
+                complex_id = None
+            session.merge(CatalogFile(
+                filename=item["filename"], content_hash=item["content_hash"], complex_id=complex_id
+            ))
+    touched = [os.path.basename(path) for path in changed] + removed
+    logger.info(f"Каталог синхронизирован, изменённые файлы: {', '.join(touched)}")
+    return touched
+
+
+def parse_filter_text(text: str, complex_names=None):
+    # Разбор ответа модели в формате «ключ = значение». Значения проверяются той же моделью
+    # ApartmentFilters, что и структурированный ответ; строка, которую не удалось разобрать,
+    # пропускается, а не роняет обработку сообщения.
+    raw = {"complex_names": complex_names or None}
+    for line in (text or "").strip().splitlines():
         if "=" not in line:
             continue
         key, value = line.split("=", 1)
-        key = key.strip().lower()
+        key = key.strip().lstrip("-• ").strip().lower()
         value = value.strip()
 
-        if value == "" or value == "пусто":
+        if value == "" or value.lower() == "пусто":
             continue
         if key == "комнат":
-            params["num_rooms"] = [int(n.strip()) for n in value.split(",")]
+            rooms = [parse_number(n) for n in re.split(r"[,;\s]+", value)]
+            raw["num_rooms"] = [n for n in rooms if n is not None]
         elif key == "минимальная площадь":
-            params["min_square"] = int(value)
+            raw["min_square"] = parse_number(value)
         elif key == "максимальная площадь":
-            params["max_square"] = int(value)
+            raw["max_square"] = parse_number(value)
         elif key == "минимальная цена":
-            params["min_price"] = int(value)
+            raw["min_price"] = parse_number(value)
         elif key == "максимальная цена":
-            params["max_price"] = int(value)
+            raw["max_price"] = parse_number(value)
         elif key == "город":
-            params["city"] = value
-        elif key == "район" and value is not None and value.lower() == "неправильный район":
-            params["isfilter"] = False
-            params["area"] = None
+            raw["city"] = value
         elif key == "район":
-            params["area"] = value.lower()
-        elif key == "жк" and value is not None:
-            params["complex_names"] = [n.strip() for n in value.split(",")]
+            raw["area"] = value
+        elif key == "жк":
+            raw["complex_names"] = [n.strip() for n in value.split(",")]
         elif key == "поиск жк":
-            params["complex_search"] = True if value == "да" else False
+            raw["complex_search"] = value.lower() == "да"
         elif key == "весь список":
-            params["limit"] = None if value == "да" else 3
+            raw["full_list"] = value.lower() == "да"
         elif key == "фраза для поиска жк":
-            params["complex_search_phrase"] = value
+            raw["complex_search_phrase"] = value
         elif key == "сортировка цены":
             if value in ["asc", "desc"]:
-                params["sort_price"] = value
+                raw["sort_price"] = value
 
-    return params
\ No newline at end of file
+    try:
+        return ApartmentFilters(**raw).to_params()
+    except ValidationError as e:
+        logger.warning(f"Не удалось разобрать параметры поиска: {e}")
+        return ApartmentFilters().to_params()
\ No newline at end of file
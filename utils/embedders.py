@@ -0,0 +1,131 @@
+import re
+import zlib
+import asyncio
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from utils.helpers import count_text_tokens
+from utils.openai_scheduler import openai_scheduler, INTERACTIVE
+
+
+class Embedder:
+    # Общий интерфейс: encode() принимает список текстов и возвращает список векторов.
+    # model_name и dimensions входят в ключи кэшей и в манифест индекса.
+    # priority нужен только сетевым эмбеддерам — для планировщика запросов к OpenAI.
+    model_name = None
+    dimensions = None
+
+    async def encode(self, texts, priority=None):
+        raise NotImplementedError
+
+
+class OpenAIEmbedder(Embedder):
+
+    def __init__(self, client, model=None, dimensions=None, batch_size=None):
+        self.client = client
+        self.model_name = model or Config.EMBEDDING_MODEL
+        self.dimensions = dimensions or Config.EMBEDDING_DIMENSIONS
+        self.batch_size = batch_size or Config.EMBEDDING_BATCH_SIZE
+
+    async def encode(self, texts, priority=None):
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            params = {"input": texts[start:start + self.batch_size], "model": self.model_name}
+            if self.dimensions:
+                params["dimensions"] = self.dimensions
+            tokens = sum(count_text_tokens(text) for text in params["input"])
+            response = await openai_scheduler.submit(
+                self.model_name,
+                lambda: self.client.embeddings.create(**params),
+                tokens=tokens,
+                priority=INTERACTIVE if priority is None else priority,
+            )
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                openai_scheduler.record_usage(self.model_name, tokens, usage.total_tokens)
+            embeddings.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+        return embeddings
+
+
+class HashingEmbedder(Embedder):
+    # Полностью локальный эмбеддер: символьные n-граммы слов хешируются со знаком в вектор
+    # фиксированной длины (feature hashing). Модель не нужно скачивать, работает на CPU.
+
+    TOKEN_PATTERN = re.compile(r"\w+")
+
+    def __init__(self, dimensions=None, ngram_range=(3, 5), batch_size=None, workers=None):
+        self.dimensions = dimensions or Config.HASHING_EMBEDDER_DIMENSIONS
+        self.ngram_range = ngram_range
+        self.batch_size = batch_size or Config.EMBEDDING_BATCH_SIZE
+        self.model_name = f"hashing-char{ngram_range[0]}-{ngram_range[1]}"
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or Config.EMBEDDER_WORKERS, thread_name_prefix="embedder"
+        )
+
+    def _features(self, text):
+        text = text.lower().replace("ё", "е")
+        low, high = self.ngram_range
+        for word in self.TOKEN_PATTERN.findall(text):
+            yield word
+            padded = f" {word} "
+            for n in range(low, high + 1):
+                for i in range(len(padded) - n + 1):
+                    yield padded[i:i + n]
+
+    def encode_one(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        hashes = np.fromiter(
+            (zlib.crc32(feature.encode("utf-8")) for feature in self._features(text)), dtype=np.uint64
+        )
+        if hashes.size:
+            indices = (hashes % self.dimensions).astype(np.intp)
+            signs = np.where((hashes >> np.uint64(31)) & np.uint64(1), -1.0, 1.0).astype(np.float32)
+            np.add.at(vector, indices, signs)
+            norm = np.linalg.norm(vector)
+            if norm:
+                vector /= norm
+        return vector
+
+    def encode_batch(self, texts):
+        return [self.encode_one(text).tolist() for text in texts]
+
+    async def encode(self, texts, priority=None):
+        loop = asyncio.get_running_loop()
+        batches = [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+        results = await asyncio.gather(
+            *(loop.run_in_executor(self._executor, self.encode_batch, batch) for batch in batches)
+        )
+        return [embedding for batch in results for embedding in batch]
+
+
+class SentenceTransformerEmbedder(Embedder):
+
+    def __init__(self, model_name=None, batch_size=None, workers=None):
+        # Импорт тяжёлый (torch), поэтому только при выборе этого бэкенда
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name or Config.SENTENCE_TRANSFORMER_MODEL
+        self.model = SentenceTransformer(self.model_name)
+        self.dimensions = self.model.get_sentence_embedding_dimension()
+        self.batch_size = batch_size or Config.EMBEDDING_BATCH_SIZE
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or Config.EMBEDDER_WORKERS, thread_name_prefix="embedder"
+        )
+
+    def encode_batch(self, texts):
+        return self.model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True).tolist()
+
+    async def encode(self, texts, priority=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.encode_batch, list(texts))
+
+
+def create_embedder(openai_client=None, backend=None):
+    backend = backend or Config.EMBEDDER
+    if backend == "openai":
+        return OpenAIEmbedder(openai_client)
+    if backend == "hashing":
+        return HashingEmbedder()
+    if backend == "sentence_transformers":
+        return SentenceTransformerEmbedder()
+    raise ValueError(f"Неизвестный эмбеддер: {backend}")
@@ -0,0 +1,222 @@
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import atexit
+import asyncio
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from logger_config import logger
+
+
+def normalize_phrase(text):
+    text = text.lower().replace("ё", "е")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+# Двухуровневый кэш эмбеддингов запросов: LRU в памяти + SQLite на диске.
+# Диск не трогается из цикла событий: чтение идёт в отдельном потоке, запись отложенная —
+# фоновый поток пишет накопленное пачками и периодически удаляет устаревшие и лишние строки.
+class EmbeddingCache:
+
+    def __init__(self, path, max_size=1024, ttl=None, max_disk_entries=None, flush_interval=1.0,
+                 prune_interval=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.flush_interval = flush_interval
+        self.prune_interval = prune_interval
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        # key -> (blob, created_at): записи, ещё не сброшенные на диск
+        self._pending = {}
+        self._db_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = threading.Event()
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expired": 0,
+            "disk_evictions": 0,
+            "flushes": 0,
+            "write_errors": 0,
+        }
+        self._db = None
+        self._executor = None
+        self._thread = None
+        if path:
+            try:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("PRAGMA synchronous=NORMAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS embeddings ("
+                    "key TEXT PRIMARY KEY, embedding BLOB NOT NULL, created_at REAL NOT NULL)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_created_at ON embeddings (created_at)")
+                self._db.commit()
+                self.prune()
+            except sqlite3.Error as e:
+                logger.error(f"Не удалось открыть кэш эмбеддингов {path}: {e}")
+                self._db = None
+        if self._db is not None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-cache")
+            self._thread = threading.Thread(target=self._run, name="embedding-cache-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    @staticmethod
+    def make_key(text, model, dimensions=None):
+        raw = f"{model}|{dimensions or ''}|{normalize_phrase(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _is_expired(self, created_at):
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def _get_memory(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                embedding, created_at = entry
+                if not self._is_expired(created_at):
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return embedding
+                del self._memory[key]
+                self.stats["expired"] += 1
+            pending = self._pending.get(key)
+            if pending is not None and not self._is_expired(pending[1]):
+                # Вытеснена из памяти раньше, чем попала на диск
+                embedding = array("f", pending[0]).tolist()
+                self._remember(key, embedding, pending[1])
+                self.stats["memory_hits"] += 1
+                return embedding
+        return None
+
+    def _read_disk(self, key):
+        with self._db_lock:
+            return self._db.execute(
+                "SELECT embedding, created_at FROM embeddings WHERE key = ?", (key,)
+            ).fetchone()
+
+    async def get(self, key):
+        embedding = self._get_memory(key)
+        if embedding is not None:
+            return embedding
+        if self._db is not None:
+            try:
+                row = await asyncio.get_running_loop().run_in_executor(self._executor, self._read_disk, key)
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка чтения кэша эмбеддингов: {e}")
+                row = None
+            if row is not None:
+                blob, created_at = row
+                with self._lock:
+                    if not self._is_expired(created_at):
+                        embedding = array("f", blob).tolist()
+                        self._remember(key, embedding, created_at)
+                        self.stats["disk_hits"] += 1
+                        return embedding
+                    # Строку удалит ближайшая чистка
+                    self.stats["expired"] += 1
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def put(self, key, embedding):
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, list(embedding), created_at)
+            if self._db is not None:
+                self._pending[key] = (array("f", embedding).tobytes(), created_at)
+
+    def _remember(self, key, embedding, created_at):
+        self._memory[key] = (embedding, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending or self._db is None:
+            return
+        with self._db_lock:
+            try:
+                with self._db:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO embeddings (key, embedding, created_at) VALUES (?, ?, ?)",
+                        [(key, blob, created_at) for key, (blob, created_at) in pending.items()],
+                    )
+                self.stats["flushes"] += 1
+            except sqlite3.Error as e:
+                self.stats["write_errors"] += 1
+                logger.error(f"Ошибка записи в кэш эмбеддингов: {e}")
+                with self._lock:
+                    for key, value in pending.items():
+                        self._pending.setdefault(key, value)
+
+    def prune(self):
+        # Устаревшие по сроку жизни строки и всё сверх max_disk_entries (самые старые)
+        if self._db is None:
+            return
+        with self._db_lock, self._db:
+            expired = 0
+            if self.ttl is not None:
+                expired = self._db.execute(
+                    "DELETE FROM embeddings WHERE created_at < ?", (time.time() - self.ttl,)
+                ).rowcount
+            evicted = 0
+            if self.max_disk_entries:
+                evicted = self._db.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    "SELECT key FROM embeddings ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,),
+                ).rowcount
+        with self._lock:
+            self.stats["expired"] += expired
+            self.stats["disk_evictions"] += evicted
+        if expired or evicted:
+            logger.info(f"Кэш эмбеддингов очищен: устаревших {expired}, сверх лимита {evicted}")
+
+    def _run(self):
+        next_prune = time.monotonic() + self.prune_interval
+        while not self._closed.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            if self.prune_interval and time.monotonic() >= next_prune:
+                next_prune = time.monotonic() + self.prune_interval
+                try:
+                    self.prune()
+                except sqlite3.Error as e:
+                    logger.error(f"Ошибка очистки кэша эмбеддингов: {e}")
+
+    def close(self):
+        if self._db is None or self._closed.is_set():
+            return
+        self._closed.set()
+        self._wakeup.set()
+        self._thread.join(timeout=5)
+        self._executor.shutdown(wait=True)
+        self.flush()
+        with self._db_lock:
+            self._db.close()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_size"] = len(self._memory)
+            stats["pending"] = len(self._pending)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,334 @@
+import re
+from sqlalchemy import select
+from pydantic import ValidationError
+from config import Config
+from models.models import Area, ResidentialComplex, session_scope
+from models.catalog import get_catalog_version
+from models.async_query import run_in_db_executor
+from models.apartment_filters import ApartmentFilters, parse_number
+from utils.db_parser import ROOM_WORDS
+from utils.lexical_index import LexicalIndex, WORD_PATTERN, normalize_token, tokenize
+from logger_config import logger
+
+# Разговорные названия квартир сверх словаря описаний каталога
+COLLOQUIAL_ROOMS = (
+    ("студи", 0), ("однушк", 1), ("однокомн", 1), ("двушк", 2), ("евродвушк", 2), ("двухкомн", 2),
+    ("трешк", 3), ("евротрешк", 3), ("четырехкомн", 4),
+)
+# Длинные основы проверяются первыми: «евродвушка» не должна остаться недоразобранной
+ROOM_STEMS = sorted(
+    {(stem.replace("ё", "е"), rooms) for stem, rooms in ROOM_WORDS + COLLOQUIAL_ROOMS},
+    key=lambda item: len(item[0]), reverse=True,
+)
+ROOM_PATTERN = re.compile(r"\b(?:" + "|".join(re.escape(stem) for stem, _ in ROOM_STEMS) + r")\w*")
+# «2к», «2-к», «2-х комнатную», «3 комн.»
+NUMERIC_ROOMS_PATTERN = re.compile(r"\b([1-5])\s*-?\s*(?:х\s*)?(?:комн\w*|к)\b")
+
+NUMBER = r"\d{1,3}(?: \d{3})+|\d+(?:[.,]\d+)?"
+PRICE_UNIT = r"млн\w*|миллион\w*|лям\w*|тыс\w*|руб\w*|₽"
+SQUARE_UNIT = r"м²|м2|кв\.?\s*м\w*|квадрат\w*|метр\w*|м\b"
+MIN_WORDS = r"от|с|больше|более|не\s+менее|не\s+меньше|минимум"
+MAX_WORDS = r"до|не\s+дороже|не\s+больше|не\s+более|максимум|дешевле|меньше|в\s+пределах|за|бюджет\w*"
+UNIT = rf"(?:(?P<price>{PRICE_UNIT})|(?P<square>{SQUARE_UNIT}))"
+RANGE_PATTERN = re.compile(rf"\b(?P<low>{NUMBER})\s*[-–—]\s*(?P<high>{NUMBER})\s*{UNIT}?")
+AMOUNT_PATTERN = re.compile(
+    rf"(?:\b(?P<min>{MIN_WORDS})|\b(?P<max>{MAX_WORDS}))?\s*\b(?P<number>{NUMBER})\s*{UNIT}?"
+)
+FULL_LIST_PATTERN = re.compile(r"\b(?:все|весь|всех)\s+(?:вариант|квартир|список|предложени)\w*|\bполный\s+список\b")
+
+ASC_STEMS = ("дешев", "недорог", "бюджетн")
+DESC_STEMS = ("дорог", "элитн", "премиум")
+CITIES = {
+    normalize_token("Владивосток"): "Владивосток",
+    normalize_token("Владик"): "Владивосток",
+    normalize_token("Артём"): "Артём",
+}
+# Слова, которые не несут параметров поиска: их отсутствие в разборе не снижает уверенность
+FILLER = frozenset("""
+    а в во на до от и или с со по за у к для из о об же ли бы не да нет то что как какие какая какой
+    я мне меня мы нам нас нашей семьи хочу хотим хотел хотела хотелось ищу ищем нужна нужно нужен нужны
+    интересует интересуют интересна рассматриваю рассматриваем купить куплю покупка можно есть
+    покажи покажите подбери подберите подскажите посмотреть найди найдите пожалуйста спасибо
+    здравствуйте привет добрый день вечер утро
+    квартира квартиру квартиры квартир квартирка квартирку вариант варианты вариантов
+    район районе районах районы жк комплекс комплексе жилой жилом город городе
+    цена цене ценой стоимость стоимостью площадь площадью метров метра руб рублей млн тыс
+    примерно около где какой-нибудь любой любую любые
+""".split())
+# Слова-отсылки к прошлым репликам: без истории диалога такой запрос правильно не разобрать
+REFERENCE_WORDS = frozenset("""
+    еще тоже также подешевле подороже побольше поменьше другие другой другую другое остальные
+    этот эта это этом этой этого эти там тот том та такую такие такой них него нее туда
+""".split())
+# Потолок уверенности, если в сообщении остались неразобранные описательные слова: это поиск ЖК
+# по признакам («у моря с парком»), границы такой фразы надёжно определяет только модель
+DESCRIPTIVE_CONFIDENCE = 0.5
+CRITERIA = ("num_rooms", "min_price", "max_price", "min_square", "max_square", "city", "area", "complex_names")
+
+
+def _normalize_text(text):
+    # Длина строки не меняется, поэтому позиции совпадений совпадают с исходным текстом
+    return text.lower().replace("ё", "е").replace("\u00A0", " ").replace("\u202F", " ")
+
+
+def _same_token(word, token):
+    # «баме» — это «бам»: у коротких основ нормализация не срезает окончание
+    return word == token or (len(token) >= 3 and word.startswith(token) and len(word) - len(token) <= 2)
+
+
+def _load_lexicon():
+    # Словари районов и ЖК из каталога: выполняется в пуле потоков БД
+    with session_scope() as session:
+        areas = [name for (name,) in session.execute(select(Area.name)) if name]
+        complexes = session.execute(
+            select(ResidentialComplex.complex_name, ResidentialComplex.general_texts)
+        ).all()
+    area_entries = {}
+    for name in areas:
+        tokens = tuple(tokenize(name))
+        if tokens:
+            area_entries.setdefault(tokens, name)
+    complex_entries = {}
+    for complex_name, general_texts in complexes:
+        aliases = LexicalIndex.extract_aliases({"complex_name": complex_name, "texts": [general_texts]})
+        for alias in aliases:
+            for tokens in {tuple(tokenize(alias)), tuple(tokenize(alias, split_camel=False))}:
+                if tokens:
+                    complex_entries.setdefault(tokens, set()).add(complex_name)
+    return _index_entries(area_entries), _index_entries(complex_entries)
+
+
+def _index_entries(entries):
+    # Индекс по первым трём буквам первого слова, внутри — от длинных фраз к коротким
+    index = {}
+    for tokens, value in sorted(entries.items(), key=lambda item: len(item[0]), reverse=True):
+        index.setdefault(tokens[0][:3], []).append((tokens, value))
+    return index
+
+
+# Быстрый разбор параметров поиска без модели: регулярки и словари районов и ЖК из каталога.
+# Возвращает те же параметры, что parse_filter_text, и уверенность — долю содержательных слов
+# сообщения, которые удалось разобрать. Уверенный разбор позволяет не ждать мини-модель.
+class RuleFilterExtractor:
+
+    def __init__(self):
+        self._version = None
+        self._areas = {}
+        self._complexes = {}
+        self.stats = {
+            "messages": 0, "confident": 0, "skipped_llm": 0,
+            "compared": 0, "agreed": 0, "confident_compared": 0, "confident_agreed": 0,
+        }
+        self.mismatches = {}
+
+    async def refresh(self):
+        # Словари перестраиваются при смене версии каталога; при ошибке остаются прежние
+        version = get_catalog_version()
+        if version == self._version:
+            return
+        try:
+            self._areas, self._complexes = await run_in_db_executor(_load_lexicon)
+        except Exception as e:
+            logger.warning(f"Не удалось загрузить словари районов и ЖК для быстрого разбора: {e}")
+            return
+        self._version = version
+
+    def extract(self, text, follow_up=False):
+        # follow_up — в чате уже был ответ, и сообщение может уточнять прошлый запрос
+        self.stats["messages"] += 1
+        normalized = _normalize_text(text or "")
+        covered = bytearray(len(normalized))
+        raw = {}
+
+        def cover(start, end):
+            covered[start:end] = b"\x01" * (end - start)
+
+        rooms = set()
+        for match in NUMERIC_ROOMS_PATTERN.finditer(normalized):
+            rooms.add(int(match.group(1)))
+            cover(*match.span())
+        for match in ROOM_PATTERN.finditer(normalized):
+            word = match.group(0)
+            rooms.add(next(count for stem, count in ROOM_STEMS if word.startswith(stem)))
+            cover(*match.span())
+        if rooms:
+            raw["num_rooms"] = sorted(rooms)
+
+        for match in RANGE_PATTERN.finditer(normalized):
+            if self._free(covered, match) and self._range(match, raw):
+                cover(*match.span())
+        matches = [m for m in AMOUNT_PATTERN.finditer(normalized) if self._free(covered, m)]
+        for i, match in enumerate(matches):
+            # «от 5 до 7 млн»: единица измерения первого числа — как у второго
+            unit_match = match
+            if not (match.group("price") or match.group("square")) and i + 1 < len(matches):
+                following = matches[i + 1]
+                if following.start() - match.end() <= 1 and following.group("max"):
+                    unit_match = following
+            if self._amount(match, unit_match, raw):
+                cover(*match.span())
+
+        for match in FULL_LIST_PATTERN.finditer(normalized):
+            raw["full_list"] = True
+            cover(*match.span())
+
+        words = [
+            (normalize_token(m.group(0)), m.start(), m.end())
+            for m in WORD_PATTERN.finditer(normalized)
+            if not covered[m.start()]
+        ]
+        complex_names = set()
+        for names, start, end in self._match_phrases(words, self._complexes):
+            complex_names.update(names)
+            cover(start, end)
+        if complex_names:
+            raw["complex_names"] = sorted(complex_names)
+        for area, start, end in self._match_phrases(words, self._areas):
+            raw.setdefault("area", area)
+            cover(start, end)
+        for token, start, end in words:
+            if token in CITIES and not covered[start]:
+                raw.setdefault("city", CITIES[token])
+                cover(start, end)
+
+        for match in WORD_PATTERN.finditer(normalized):
+            word = match.group(0)
+            if covered[match.start()]:
+                continue
+            if word.startswith(ASC_STEMS):
+                raw.setdefault("sort_price", "asc")
+                cover(*match.span())
+            elif word.startswith(DESC_STEMS):
+                raw.setdefault("sort_price", "desc")
+                cover(*match.span())
+
+        # Оставшиеся содержательные слова — признаки ЖК: ищем по ним в базе знаний, как сделала бы модель
+        descriptive = self._descriptive(normalized, covered)
+        if descriptive:
+            raw["complex_search"] = True
+            raw["complex_search_phrase"] = text[descriptive[0][0]:descriptive[-1][1]]
+
+        try:
+            params = ApartmentFilters(**raw).to_params()
+        except ValidationError as e:
+            logger.warning(f"Быстрый разбор параметров поиска не прошёл проверку: {e}")
+            return ApartmentFilters().to_params(), 0.0
+        confidence = self._confidence(normalized, covered, params, follow_up)
+        self.stats["confident"] += confidence >= Config.FAST_FILTERS_CONFIDENCE
+        return params, confidence
+
+    @staticmethod
+    def _free(covered, match):
+        return not any(covered[match.start():match.end()])
+
+    @staticmethod
+    def _value(number, unit_match):
+        if unit_match.group("price"):
+            unit = unit_match.group("price")
+            return "price", parse_number(f"{number} {'млн' if unit.startswith('лям') else unit}")
+        if unit_match.group("square"):
+            return "square", parse_number(number)
+        value = parse_number(number)
+        # Число без единиц от ста тысяч — это цена в рублях; меньшие числа без единиц неоднозначны
+        return ("price", value) if value is not None and value >= 100_000 else (None, None)
+
+    def _range(self, match, raw):
+        kind, low = self._value(match.group("low"), match)
+        _, high = self._value(match.group("high"), match)
+        if kind is None or low is None or high is None:
+            return False
+        raw[f"min_{kind}"], raw[f"max_{kind}"] = low, high
+        return True
+
+    def _amount(self, match, unit_match, raw):
+        if not (match.group("min") or match.group("max")):
+            return False
+        kind, value = self._value(match.group("number"), unit_match)
+        if kind is None or value is None:
+            return False
+        raw[f"{'min' if match.group('min') else 'max'}_{kind}"] = value
+        return True
+
+    @staticmethod
+    def _match_phrases(words, index):
+        # Совпадения фраз словаря с подряд идущими словами сообщения, без пересечений
+        used = set()
+        for i, (token, _, _) in enumerate(words):
+            if i in used:
+                continue
+            for tokens, value in index.get(token[:3], ()):
+                end = i + len(tokens)
+                if end > len(words) or used.intersection(range(i, end)):
+                    continue
+                if all(_same_token(words[i + k][0], tokens[k]) for k in range(len(tokens))):
+                    used.update(range(i, end))
+                    yield value, words[i][1], words[end - 1][2]
+                    break
+
+    @staticmethod
+    def _descriptive(normalized, covered):
+        # Позиции неразобранных слов, которые не служебные и не отсылки к прошлым репликам
+        return [
+            match.span() for match in WORD_PATTERN.finditer(normalized)
+            if not covered[match.start()] and match.group(0) not in FILLER
+            and match.group(0) not in REFERENCE_WORDS and not match.group(0).isdigit()
+        ]
+
+    @staticmethod
+    def _confidence(normalized, covered, params, follow_up):
+        criteria = sum(1 for key in CRITERIA if params[key] is not None)
+        if not criteria and params["sort_price"] is None:
+            return 0.0
+        words = [(m.group(0), m.start()) for m in WORD_PATTERN.finditer(normalized)]
+        if any(word in REFERENCE_WORDS for word, _ in words):
+            return 0.0
+        if follow_up and normalized.lstrip().startswith(("а ", "и ")):
+            return 0.0
+        content = [(word, start) for word, start in words if word not in FILLER]
+        leftover = sum(1 for _, start in content if not covered[start])
+        confidence = 1.0 - leftover / len(content) if content else 1.0
+        if params["complex_search_phrase"] is not None:
+            confidence = min(confidence, DESCRIPTIVE_CONFIDENCE)
+        # Короткое уточнение посреди диалога модель дополнит прошлыми параметрами, а мы — нет
+        if follow_up and criteria < 2:
+            confidence = min(confidence, 0.5)
+        return confidence
+
+    @staticmethod
+    def _comparable(value):
+        # Порядок ЖК и комнат в списке не важен
+        return sorted(value) if isinstance(value, list) else value
+
+    def record(self, params, confidence, llm_params):
+        # Сверка с ответом модели: насколько быстрый разбор с ней совпадает
+        mismatched = [
+            key for key in llm_params if self._comparable(params.get(key)) != self._comparable(llm_params[key])
+        ]
+        self.stats["compared"] += 1
+        self.stats["agreed"] += not mismatched
+        if confidence >= Config.FAST_FILTERS_CONFIDENCE:
+            self.stats["confident_compared"] += 1
+            self.stats["confident_agreed"] += not mismatched
+        for key in mismatched:
+            self.mismatches[key] = self.mismatches.get(key, 0) + 1
+        if mismatched:
+            logger.info(
+                f"Быстрый разбор расходится с моделью (уверенность {confidence:.2f}): "
+                + ", ".join(f"{key}: {params.get(key)!r} / {llm_params[key]!r}" for key in mismatched)
+            )
+        else:
+            logger.info(f"Быстрый разбор совпал с моделью (уверенность {confidence:.2f})")
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["agreement"] = round(stats["agreed"] / stats["compared"], 3) if stats["compared"] else 0.0
+        stats["confident_agreement"] = (
+            round(stats["confident_agreed"] / stats["confident_compared"], 3) if stats["confident_compared"] else 0.0
+        )
+        stats["mismatched_fields"] = dict(self.mismatches)
+        stats["areas"] = sum(len(entries) for entries in self._areas.values())
+        stats["complex_aliases"] = sum(len(entries) for entries in self._complexes.values())
+        return stats
+
+
+rule_filter_extractor = RuleFilterExtractor()
@@ -1,15 +1,56 @@
 import json
 import re
 import tiktoken
+from config import Config
 from logger_config import logger
 
 
+# Служебные токены чата на каждое сообщение и на начало ответа (формат ChatML)
+MESSAGE_TOKEN_OVERHEAD = 4
+REPLY_TOKEN_OVERHEAD = 3
+
+_encoding = None
+_encoding_loaded = False
+
+
+def get_encoding(model=None):
+    # Кодировщик создаётся один раз на процесс. Без доступа к файлам кодировки считаем токены приблизительно
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        try:
+            _encoding = tiktoken.encoding_for_model(model or Config.MODEL_GPT4O)
+        except Exception as e:
+            logger.warning(f"Кодировщик tiktoken недоступен, токены считаются приблизительно: {e}")
+            _encoding = None
+        _encoding_loaded = True
+    return _encoding
+
+
+def count_text_tokens(text):
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is None:
+        return len(text) // 3 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(content):
+    return count_text_tokens(content) + MESSAGE_TOKEN_OVERHEAD
+
+
 def count_tokens(messages, response, model="gpt-4"):
-    encoding = tiktoken.encoding_for_model(model)
-    num_tokens = 0
+    num_tokens = REPLY_TOKEN_OVERHEAD
     for message in messages:
-        num_tokens += len(encoding.encode(message["content"]))
-    return num_tokens, len(encoding.encode(response))
+        num_tokens += count_message_tokens(message["content"])
+    return num_tokens, count_text_tokens(response)
+
+
+def estimate_tokens(messages):
+    # Быстрая оценка по длине текста, без токенизатора — для запросов, собранных не из ConversationManager
+    return REPLY_TOKEN_OVERHEAD + sum(
+        len(message["content"] or "") // 3 + 1 + MESSAGE_TOKEN_OVERHEAD for message in messages
+    )
 
 
 def trim_conversation_history(history, max_tokens=3500):
@@ -0,0 +1,122 @@
+import time
+import asyncio
+import importlib.util
+from collections import deque
+import httpx
+from config import Config
+from logger_config import logger
+
+
+def http2_available():
+    return importlib.util.find_spec("h2") is not None
+
+
+# Общий пул соединений к API: лимиты и keep-alive, раздельные таймауты, HTTP/2, если установлен h2.
+# При старте соединения открываются заранее, а в простое поддерживаются лёгкими запросами,
+# поэтому первый пользователь после деплоя или паузы не ждёт TLS и рукопожатия с прокси.
+class HttpPool:
+
+    def __init__(self, warm_url=None):
+        self.warm_url = warm_url
+        self.http2 = Config.HTTP2 and http2_available()
+        if Config.HTTP2 and not self.http2:
+            logger.info("Пакет h2 не установлен, запросы к API идут по HTTP/1.1")
+        self.transport = httpx.AsyncHTTPTransport(
+            proxy=Config.PROXY_URL or None,
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=Config.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=Config.HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=Config.HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
+        self.client = httpx.AsyncClient(
+            transport=self.transport,
+            timeout=httpx.Timeout(
+                connect=Config.HTTP_CONNECT_TIMEOUT,
+                read=Config.HTTP_READ_TIMEOUT,
+                write=Config.HTTP_WRITE_TIMEOUT,
+                pool=Config.HTTP_POOL_TIMEOUT,
+            ),
+            event_hooks={"request": [self._on_request], "response": [self._on_response]},
+        )
+        self.latencies = deque(maxlen=1000)
+        self.last_used = 0.0
+        self.stats = {"requests": 0, "warmups": 0, "pings": 0, "ping_errors": 0}
+        self._task = None
+
+    async def _on_request(self, request):
+        request.extensions["started"] = time.monotonic()
+        self.last_used = time.monotonic()
+        self.stats["requests"] += 1
+
+    async def _on_response(self, response):
+        started = response.request.extensions.get("started")
+        if started is not None:
+            # Время до заголовков ответа: сюда входят ожидание соединения, TLS и работа сервера
+            self.latencies.append(time.monotonic() - started)
+
+    async def _ping(self):
+        # Любой ответ сервера годится — важно, что соединение открыто и осталось в пуле
+        response = await self.client.get(self.warm_url)
+        await response.aclose()
+
+    async def warm_up(self, connections=None):
+        if not self.warm_url:
+            return
+        # По HTTP/2 запросы идут в одном соединении, по HTTP/1.1 открываем несколько параллельно
+        connections = 1 if self.http2 else (connections or Config.HTTP_WARM_CONNECTIONS)
+        started = time.monotonic()
+        results = await asyncio.gather(*(self._ping() for _ in range(connections)), return_exceptions=True)
+        errors = [r for r in results if isinstance(r, Exception)]
+        self.stats["warmups"] += 1
+        if errors:
+            logger.warning(f"Прогрев соединений к API: ошибок {len(errors)} из {connections}: {errors[0]!r}")
+        logger.info(
+            f"Соединения к API прогреты: {connections - len(errors)} за {(time.monotonic() - started) * 1000:.0f} мс"
+        )
+
+    async def start(self):
+        await self.warm_up()
+        if self.warm_url and Config.HTTP_PING_INTERVAL and self._task is None:
+            self._task = asyncio.create_task(self._keep_warm())
+
+    async def _keep_warm(self):
+        while True:
+            await asyncio.sleep(Config.HTTP_PING_INTERVAL)
+            # Пинг нужен только в простое: живой трафик и так держит соединения открытыми
+            if time.monotonic() - self.last_used < Config.HTTP_PING_INTERVAL:
+                continue
+            try:
+                await self._ping()
+                self.stats["pings"] += 1
+            except Exception as e:
+                self.stats["ping_errors"] += 1
+                logger.warning(f"Не удалось поддержать соединение к API: {e!r}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.client.aclose()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["http2"] = self.http2
+        # Внутренности httpcore: при смене версии метрики пула просто пропадут, а не сломают бота
+        connections = getattr(getattr(self.transport, "_pool", None), "connections", None) or []
+        idle = sum(1 for connection in connections if connection.is_idle())
+        stats["connections"] = len(connections)
+        stats["idle_connections"] = idle
+        stats["active_connections"] = len(connections) - idle
+        stats["max_connections"] = Config.HTTP_MAX_CONNECTIONS
+        latencies = sorted(self.latencies)
+        stats["latency_p50_ms"] = round(latencies[len(latencies) // 2] * 1000, 1) if latencies else 0.0
+        stats["latency_p95_ms"] = (
+            round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1) if latencies else 0.0
+        )
+        return stats
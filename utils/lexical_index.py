@@ -0,0 +1,165 @@
+import re
+import math
+from collections import Counter, defaultdict
+
+TRANSLIT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh", "з": "z",
+    "и": "i", "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r",
+    "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "shch",
+    "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+}
+# Кириллические буквы, которые выглядят как латинские (в именах файлов встречается "Сhaika")
+HOMOGLYPHS = str.maketrans("АВЕКМНОРСТХаекорсух", "ABEKMHOPCTXaekopcyx")
+# Приводим разные варианты транслитерации к одному виду: Tihvinskiy / Тихвинский -> tihvinskii
+PHONETIC = (("kh", "h"), ("ts", "c"), ("tz", "c"), ("ck", "k"), ("ph", "f"), ("w", "v"), ("x", "ks"), ("j", "i"), ("y", "i"))
+# Падежные окончания (после PHONETIC), от длинных к коротким
+ENDINGS = sorted(
+    ("iami", "ami", "iah", "ah", "ogo", "ego", "omu", "emu", "iia", "aia", "oi", "ei", "ii", "ia",
+     "oe", "ee", "ie", "am", "om", "em", "ov", "ev", "iu", "u", "a", "o", "e", "i"),
+    key=len, reverse=True,
+)
+WORD_PATTERN = re.compile(r"[^\W_]+")
+CAMEL_PATTERN = re.compile(r"(?<=[a-zа-яё])(?=[A-ZА-ЯЁ])|(?<=\D)(?=\d)|(?<=\d)(?=\D)")
+ALIAS_PATTERN = re.compile(r'ЖК\s*[«"“]([^»"”]{2,40})[»"”]')
+STOPWORDS = {"zhk", "zk", "zhiloi", "kompleks", "v", "na", "i", "s", "u", "po", "dlia", "pro"}
+
+
+def transliterate(word):
+    if re.search(r"[a-zA-Z]", word):
+        word = word.translate(HOMOGLYPHS)
+    word = word.lower()
+    return "".join(TRANSLIT.get(ch, ch) for ch in word)
+
+
+def normalize_token(word):
+    token = transliterate(word)
+    for src, dst in PHONETIC:
+        token = token.replace(src, dst)
+    if not token.isdigit():
+        for ending in ENDINGS:
+            if token.endswith(ending) and len(token) - len(ending) >= 4:
+                token = token[:-len(ending)]
+                break
+    return token
+
+
+def tokenize(text, split_camel=True):
+    if split_camel:
+        text = CAMEL_PATTERN.sub(" ", text)
+    tokens = (normalize_token(word) for word in WORD_PATTERN.findall(text))
+    return [token for token in tokens if token and token not in STOPWORDS]
+
+
+class LexicalIndex:
+    # BM25 по названиям и текстам ЖК. Поле названия (complex_name + алиасы) весит больше текста.
+
+    def __init__(self, k1=1.5, b=0.75, name_weight=3.0, min_coverage=0.5):
+        self.k1 = k1
+        self.b = b
+        self.name_weight = name_weight
+        self.min_coverage = min_coverage
+        self.sources = []
+        self.documents = {}
+        self._fields = {"name": {}, "text": {}}
+        self._aliases = []
+
+    def build(self, documents):
+        # documents: {source: {"complex_name", "city", "content", "texts": [...], "aliases": [...]}}
+        self.sources = list(documents)
+        self.documents = documents
+        self._aliases = []
+        names, texts = [], []
+        for i, source in enumerate(self.sources):
+            doc = documents[source]
+            aliases = self.extract_aliases(doc)
+            name_tokens = []
+            for alias in aliases:
+                for variant in self._alias_variants(alias):
+                    if variant:
+                        self._aliases.append((variant, i))
+                        name_tokens.extend(variant)
+            names.append(name_tokens)
+            texts.append(tokenize(" ".join(t for t in doc.get("texts", []) if t)))
+        self._fields["name"] = self._build_field(names)
+        self._fields["text"] = self._build_field(texts)
+        return self
+
+    @staticmethod
+    def _alias_variants(alias):
+        split = tuple(tokenize(alias))
+        variants = {split, tuple(tokenize(alias, split_camel=False))}
+        # "Kurortniy1" находим и по запросу "Курортный", если без номера название не совпадает с другими ЖК
+        while split and split[-1].isdigit():
+            split = split[:-1]
+        variants.add(split)
+        return variants
+
+    @staticmethod
+    def extract_aliases(doc):
+        aliases = [doc.get("complex_name") or ""]
+        aliases.extend(doc.get("aliases") or [])
+        for text in doc.get("texts", []):
+            if text:
+                aliases.extend(match.strip() for match in ALIAS_PATTERN.findall(text))
+        return [alias.replace("_", " ") for alias in dict.fromkeys(aliases) if alias]
+
+    @staticmethod
+    def _build_field(token_lists):
+        postings = defaultdict(list)
+        for i, tokens in enumerate(token_lists):
+            for token, tf in Counter(tokens).items():
+                postings[token].append((i, tf))
+        lengths = [len(tokens) for tokens in token_lists]
+        avg_length = sum(lengths) / len(lengths) if lengths else 0.0
+        return {"postings": postings, "lengths": lengths, "avg_length": avg_length or 1.0}
+
+    def _score_field(self, field, tokens, scores, weight):
+        data = self._fields[field]
+        total = len(self.sources)
+        for token in set(tokens):
+            postings = data["postings"].get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for i, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * data["lengths"][i] / data["avg_length"])
+                scores[i] += weight * idf * tf * (self.k1 + 1) / (tf + norm)
+
+    def _allowed(self, i, city):
+        return city is None or self.documents[self.sources[i]].get("city") == city
+
+    def search(self, query, limit=10, city=None):
+        tokens = tokenize(query)
+        scores = defaultdict(float)
+        self._score_field("name", tokens, scores, self.name_weight)
+        self._score_field("text", tokens, scores, 1.0)
+        ranked = sorted(
+            ((self.sources[i], score) for i, score in scores.items() if self._allowed(i, city)),
+            key=lambda item: item[1], reverse=True,
+        )
+        return ranked[:limit]
+
+    def match_name(self, query, city=None):
+        # Уверенное совпадение: в запросе целиком встречается алиас ровно одного ЖК
+        # (при нескольких кандидатах побеждает самый длинный алиас). Описательные фразы вроде
+        # "квартиры с видом на море рядом с Гаванью" не считаются уверенным совпадением.
+        tokens = set(tokenize(query))
+        best_length, best = 0, set()
+        for alias_tokens, i in self._aliases:
+            if not self._allowed(i, city) or not tokens.issuperset(alias_tokens):
+                continue
+            if len(alias_tokens) > best_length:
+                best_length, best = len(alias_tokens), {i}
+            elif len(alias_tokens) == best_length:
+                best.add(i)
+        if len(best) == 1 and best_length >= self.min_coverage * len(tokens):
+            return self.sources[best.pop()]
+        return None
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, source in enumerate(ranking):
+            scores[source] += 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -0,0 +1,56 @@
+import asyncio
+from collections import deque
+from config import Config
+from logger_config import logger
+
+
+class LoopLagMonitor:
+    # Замеряет, насколько позже запланированного просыпается корутина со sleep(interval).
+    # Если кто-то блокирует event loop, задержка растёт у всех чатов сразу.
+
+    def __init__(self, interval=None, window=600, report_interval=None):
+        self.interval = interval or Config.LOOP_LAG_INTERVAL
+        self.report_interval = report_interval or Config.LOOP_LAG_REPORT_INTERVAL
+        self.samples = deque(maxlen=window)
+        self.max_lag = 0.0
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        last_report = loop.time()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            now = loop.time()
+            lag = max(now - started - self.interval, 0.0)
+            self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag > Config.LOOP_LAG_WARNING:
+                logger.warning(f"Event loop был заблокирован на {lag * 1000:.0f} мс")
+            if now - last_report >= self.report_interval:
+                last_report = now
+                logger.info(f"Задержка event loop: {self.stats()}")
+
+    def stats(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return {"samples": 0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        return {
+            "samples": len(samples),
+            "p50_ms": round(samples[len(samples) // 2] * 1000, 2),
+            "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 2),
+            "max_ms": round(self.max_lag * 1000, 2),
+        }
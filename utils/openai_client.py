@@ -1,11 +1,11 @@
-import json
-import logging
 import asyncio
-import httpx
-from datetime import datetime
 from config import Config
-from utils.helpers import count_tokens
+from utils.helpers import count_text_tokens, estimate_tokens
+from utils.openai_scheduler import openai_scheduler, INTERACTIVE
+from utils.http_pool import HttpPool
 from models.conversation_manager import ConversationManager, PromptType
+from models.apartment_filters import ApartmentFilters, FILTER_RESPONSE_FORMAT
+from pydantic import ValidationError
 from openai import AsyncOpenAI
 from logger_config import logger
 
@@ -21,29 +21,169 @@ class OpenAIClient:
         return cls._instance
     
     def __init__(self):
-        transport = httpx.AsyncHTTPTransport(proxy=Config.PROXY_URL)
-        http_async_client = httpx.AsyncClient(transport=transport)
-        self._client = AsyncOpenAI(api_key=Config.OPENAI_API_KEY, http_client=http_async_client)
+        # Синглтон: пул соединений создаётся один раз, повторный вызов конструктора его не заменяет
+        if getattr(self, "_initialized", False):
+            return
+        self._initialized = True
+        self.http_pool = HttpPool()
+        # Повторы и паузы при 429 делает планировщик, у SDK они выключены, чтобы не повторять дважды
+        self._client = AsyncOpenAI(api_key=Config.OPENAI_API_KEY, http_client=self.http_pool.client, max_retries=0)
+        # Прогревается тот же хост, куда уходят запросы
+        self.http_pool.warm_url = str(self._client.base_url)
+        self.scheduler = openai_scheduler
         self._conversation_manager = ConversationManager()
         self.model_gpt4omini = Config.MODEL_GPT4OMINI
+        # Токены по моделям, включая попадания в кэш промптов провайдера
+        self.usage_stats = {}
+        # Извлечение параметров поиска: запросы, успешные и отбракованные ответы по моделям
+        self.filter_stats = {}
+        self.filter_stats_fallbacks = 0
 
-    async def _ask_openai(self, messages, model):
+    async def _ask_openai(self, messages, model, estimated_tokens=None, on_delta=None, priority=INTERACTIVE):
+        # Резерв лимита токенов до ответа: оценка запроса плюс ожидаемая длина ответа.
+        # estimated_tokens — сумма закэшированных счётчиков сообщений (estimate_history_tokens);
+        # историю целиком в цикле событий заново не токенизируем
+        if estimated_tokens is None:
+            estimated_tokens = estimate_tokens(messages)
+        reserved = estimated_tokens + Config.OPENAI_COMPLETION_ESTIMATE
         try:
-            response = await self._client.chat.completions.create(
-                temperature=Config.TEMPERATURE,
-                model=model,
-                messages=messages
-            )
+            if on_delta is None:
+                response = await self.scheduler.submit(
+                    model,
+                    lambda: self._client.chat.completions.create(
+                        temperature=Config.TEMPERATURE,
+                        model=model,
+                        messages=messages
+                    ),
+                    tokens=reserved,
+                    priority=priority,
+                )
+                response_text = response.choices[0].message.content.strip()
+                usage = getattr(response, "usage", None)
+            else:
+                response_text, usage = await self._stream_openai(messages, model, on_delta, reserved, priority)
         except Exception as e:
             logger.error(f"Ошибка при обращении к OpenAI: {e}")
             return "Произошла ошибка при обработке запроса.", 0, 0
-        response_text = response.choices[0].message.content.strip()
-        input_tokens, output_tokens = count_tokens(messages, response_text)
+        input_tokens, output_tokens = self._account_usage(model, response_text, usage, estimated_tokens, reserved)
         # logger.info(f"Ответ от {model}: {response_text}")
         # logger.info(f"Входных токенов: {input_tokens}, Выходных токенов: {output_tokens}")
         return response_text, input_tokens, output_tokens
     
-    async def create_gpt4o_response(self, question, chat_id):
+    async def _stream_openai(self, messages, model, on_delta, reserved, priority):
+        # on_delta получает весь накопленный текст после каждого фрагмента; usage приходит последним чанком.
+        # Повторяется только открытие потока: после первых фрагментов пользователь уже видит текст.
+        stream = await self.scheduler.submit(
+            model,
+            lambda: self._client.chat.completions.create(
+                temperature=Config.TEMPERATURE,
+                model=model,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+            ),
+            tokens=reserved,
+            priority=priority,
+        )
+        text = ""
+        usage = None
+        async for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                text += chunk.choices[0].delta.content
+                on_delta(text)
+        return text.strip(), usage
+
+    def _account_usage(self, model, response_text, usage, estimated_tokens, reserved):
+        if usage is not None and usage.prompt_tokens:
+            # Фактические токены из ответа API; по ним же уточняется наша оценка для обрезки истории
+            input_tokens, output_tokens = usage.prompt_tokens, usage.completion_tokens
+            self._conversation_manager.record_prompt_usage(estimated_tokens, input_tokens)
+            self.scheduler.record_usage(model, reserved, input_tokens + (output_tokens or 0))
+            self._record_usage(model, usage)
+            return input_tokens, output_tokens
+        # Без usage: запрос — по уже посчитанной оценке, токенизируется только ответ
+        return estimated_tokens, count_text_tokens(response_text)
+
+    async def _ask_structured(self, messages, model, estimated_tokens=None):
+        # Ответ строго по JSON-схеме ApartmentFilters; ошибки API, отказ модели и невалидный JSON
+        # пробрасываются вызывающему, чтобы тот мог повторить запрос на другой модели
+        if estimated_tokens is None:
+            estimated_tokens = estimate_tokens(messages)
+        reserved = estimated_tokens + Config.OPENAI_COMPLETION_ESTIMATE
+        response = await self.scheduler.submit(
+            model,
+            lambda: self._client.chat.completions.create(
+                temperature=0,
+                model=model,
+                messages=messages,
+                response_format=FILTER_RESPONSE_FORMAT,
+            ),
+            tokens=reserved,
+        )
+        message = response.choices[0].message
+        content = message.content or ""
+        self._account_usage(model, content, getattr(response, "usage", None), estimated_tokens, reserved)
+        if getattr(message, "refusal", None):
+            raise ValueError(f"Модель отказалась отвечать: {message.refusal}")
+        return ApartmentFilters.model_validate_json(content)
+
+    async def extract_filters(self, chat_id, prompt_type: PromptType = PromptType.MINI_DIALOG):
+        # Параметры поиска квартир из диалога: сначала мини-модель, при ошибке — запасная модель.
+        # Если не справились обе, поиск идёт без фильтров, как раньше при пустом ответе.
+        self._conversation_manager.trim_history(chat_id, max_tokens=Config.MAX_TOKENS)
+        messages = self._conversation_manager.get_history_for_mini(chat_id, prompt_type)
+        estimated_tokens = self._conversation_manager.estimate_history_tokens(chat_id, prompt_type)
+        models = [Config.FILTER_MODEL]
+        if Config.FILTER_FALLBACK_MODEL and Config.FILTER_FALLBACK_MODEL != Config.FILTER_MODEL:
+            models.append(Config.FILTER_FALLBACK_MODEL)
+        for attempt, model in enumerate(models):
+            stats = self.filter_stats.setdefault(model, {"requests": 0, "ok": 0, "invalid": 0, "errors": 0})
+            stats["requests"] += 1
+            if attempt:
+                self.filter_stats_fallbacks += 1
+            try:
+                filters = await self._ask_structured(messages, model, estimated_tokens)
+            except (ValidationError, ValueError) as e:
+                stats["invalid"] += 1
+                logger.warning(f"{model}: ответ с параметрами поиска не прошёл проверку: {e}")
+                continue
+            except Exception as e:
+                stats["errors"] += 1
+                logger.error(f"{model}: ошибка при извлечении параметров поиска: {e}")
+                continue
+            stats["ok"] += 1
+            logger.info(f"Параметры поиска ({model}): {filters.model_dump(exclude_defaults=True)}")
+            return filters
+        return ApartmentFilters()
+
+    def get_filter_stats(self):
+        return {"models": {model: dict(stats) for model, stats in self.filter_stats.items()},
+                "fallbacks": self.filter_stats_fallbacks}
+
+    def _record_usage(self, model, usage):
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+        stats = self.usage_stats.setdefault(
+            model, {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+        )
+        stats["requests"] += 1
+        stats["prompt_tokens"] += usage.prompt_tokens
+        stats["cached_tokens"] += cached_tokens
+        stats["completion_tokens"] += usage.completion_tokens or 0
+        logger.debug(f"{model}: prompt_tokens {usage.prompt_tokens}, из кэша {cached_tokens}")
+
+    def get_usage_stats(self):
+        return {
+            model: dict(
+                stats,
+                cache_hit_rate=stats["cached_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0,
+            )
+            for model, stats in self.usage_stats.items()
+        }
+
+    async def create_gpt4o_response(self, question, chat_id, on_delta=None):
         # Добавляем новое сообщение пользователя
         # self._conversation_manager.add_user_message(chat_id, question)
         
@@ -53,11 +193,15 @@ class OpenAIClient:
         # Отправляем всю историю вместе с новым сообщением для GPT
         task_response = asyncio.create_task(self._ask_openai(
             self._conversation_manager.get_history(chat_id),
-            model=Config.MODEL_GPT4O
+            model=Config.MODEL_GPT4O,
+            estimated_tokens=self._conversation_manager.estimate_history_tokens(chat_id),
+            on_delta=on_delta,
         ))
-        task_delay = asyncio.create_task(asyncio.sleep(Config.ASSISTANT_DELAY))
+        # При потоковом ответе пользователь и так видит, как печатается текст, — искусственная пауза не нужна
+        task_delay = asyncio.create_task(asyncio.sleep(Config.ASSISTANT_DELAY if on_delta is None else 0))
         gpt4_response, input_tokens, output_tokens = await task_response
         await task_delay
+        # В историю попадает только полный ответ
         self._conversation_manager.add_assistant_message(chat_id, gpt4_response)
         
         return gpt4_response, input_tokens, output_tokens
@@ -71,7 +215,9 @@ class OpenAIClient:
         # Отправляем всю историю вместе с новым сообщением для GPT
         task_response = asyncio.create_task(self._ask_openai(
             history_for_mini,
-            model=Config.MODEL_GPT4O
+            # Разбор фильтров в формате «ключ = значение» идёт на той же модели, что и структурированный
+            model=Config.FILTER_MODEL,
+            estimated_tokens=self._conversation_manager.estimate_history_tokens(chat_id, prompt_type),
         ))
         gpt4_response, _, _ = await task_response
         logger.info("--get_gpt4o_mini response:")
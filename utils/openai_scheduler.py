@@ -0,0 +1,237 @@
+import time
+import bisect
+import random
+import asyncio
+import itertools
+from collections import deque
+import openai
+from config import Config
+from logger_config import logger
+
+# Приоритеты: меньше — раньше. Ответы в диалоге идут впереди пересчёта индекса.
+INTERACTIVE = 0
+BACKGROUND = 10
+
+
+class SchedulerOverloaded(Exception):
+    pass
+
+
+class TokenBucket:
+    # Ведро на минутный лимит: пополняется равномерно, ёмкость — лимит за минуту
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount, now):
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def consume(self, amount, now):
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, amount):
+        # Поправка по фактическому usage: перерасход уходит в долг, недорасход возвращается
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class ModelLimiter:
+    __slots__ = ("requests", "tokens", "blocked_until")
+
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.blocked_until = 0.0
+
+    def delay(self, tokens, now):
+        return max(self.blocked_until - now, self.requests.delay(1, now), self.tokens.delay(tokens, now))
+
+    def consume(self, tokens, now):
+        self.requests.consume(1, now)
+        self.tokens.consume(tokens, now)
+
+
+class _Request:
+    __slots__ = ("key", "model", "tokens", "future", "enqueued_at")
+
+    def __init__(self, key, model, tokens, future, enqueued_at):
+        self.key = key
+        self.model = model
+        self.tokens = tokens
+        self.future = future
+        self.enqueued_at = enqueued_at
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+
+# Общая очередь всех запросов к OpenAI. Запрос уходит, когда у его модели хватает лимита запросов
+# и токенов в минуту; внутри модели — строго по приоритету, разные модели друг друга не ждут.
+# 429 останавливает модель на Retry-After для всех, а не только для упавшего запроса.
+class OpenAIScheduler:
+
+    EMBEDDING_PREFIX = "text-embedding"
+    RETRYABLE = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+    def __init__(self, max_queue=None, queue_timeout=None, max_retries=None, window=1000):
+        self.max_queue = Config.OPENAI_MAX_QUEUE if max_queue is None else max_queue
+        self.queue_timeout = Config.OPENAI_QUEUE_TIMEOUT if queue_timeout is None else queue_timeout
+        self.max_retries = Config.OPENAI_MAX_RETRIES if max_retries is None else max_retries
+        self.limits = {}
+        self._limiters = {}
+        self._queue = []
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._dispatcher = None
+        self._loop = None
+        self.waits = deque(maxlen=window)
+        self.stats = {
+            "requests": 0, "retries": 0, "rate_limited": 0, "failures": 0,
+            "rejected": 0, "queue_timeouts": 0, "max_queue_depth": 0,
+        }
+
+    def set_limits(self, model, rpm, tpm):
+        self.limits[model] = (rpm, tpm)
+        self._limiters.pop(model, None)
+
+    def _limiter(self, model):
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            if model in self.limits:
+                rpm, tpm = self.limits[model]
+            elif model.startswith(self.EMBEDDING_PREFIX):
+                rpm, tpm = Config.OPENAI_EMBEDDING_RPM, Config.OPENAI_EMBEDDING_TPM
+            else:
+                rpm, tpm = Config.OPENAI_RPM, Config.OPENAI_TPM
+            limiter = self._limiters[model] = ModelLimiter(rpm, tpm)
+        return limiter
+
+    async def submit(self, model, call, tokens=0, priority=INTERACTIVE):
+        # call — функция без аргументов, возвращающая корутину запроса; вызывается заново на каждую попытку
+        attempt = 0
+        while True:
+            await self._acquire(model, tokens, priority)
+            self.stats["requests"] += 1
+            try:
+                return await call()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None or attempt >= self.max_retries:
+                    self.stats["failures"] += 1
+                    raise
+                attempt += 1
+                self.stats["retries"] += 1
+                if isinstance(e, openai.RateLimitError):
+                    self.stats["rate_limited"] += 1
+                    limiter = self._limiter(model)
+                    limiter.blocked_until = max(limiter.blocked_until, time.monotonic() + delay)
+                logger.warning(f"OpenAI {model}: {type(e).__name__}, попытка {attempt} через {delay:.1f} с")
+                await asyncio.sleep(delay)
+
+    def record_usage(self, model, reserved, actual):
+        if actual:
+            limiter = self._limiter(model)
+            limiter.tokens.adjust(actual - min(reserved, limiter.tokens.capacity))
+
+    def _retry_delay(self, error, attempt):
+        if not isinstance(error, self.RETRYABLE):
+            return None
+        # Закончившиеся деньги на счёте повтором не лечатся
+        if getattr(error, "code", None) == "insufficient_quota":
+            return None
+        backoff = min(Config.OPENAI_BACKOFF_MAX, Config.OPENAI_BACKOFF_BASE * 2 ** attempt)
+        delay = random.uniform(backoff / 2, backoff)
+        retry_after = self._retry_after(error)
+        return max(delay, retry_after) if retry_after is not None else delay
+
+    @staticmethod
+    def _retry_after(error):
+        response = getattr(error, "response", None)
+        if response is None:
+            return None
+        headers = response.headers
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after"):
+                return float(headers["retry-after"])
+        except ValueError:
+            return None
+        return None
+
+    async def _acquire(self, model, tokens, priority):
+        if len(self._queue) >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise SchedulerOverloaded(f"Очередь запросов к OpenAI переполнена ({len(self._queue)})")
+        loop = asyncio.get_running_loop()
+        if self._dispatcher is None or self._dispatcher.done() or self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch(), name="openai-scheduler")
+        request = _Request((priority, next(self._seq)), model, tokens, loop.create_future(), time.monotonic())
+        bisect.insort(self._queue, request)
+        self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], len(self._queue))
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(request.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.stats["queue_timeouts"] += 1
+            raise SchedulerOverloaded(f"Запрос к OpenAI ждал в очереди дольше {self.queue_timeout:.0f} с")
+        finally:
+            if not request.future.done():
+                # Ожидающий отменён или не дождался — место в очереди освобождается
+                request.future.cancel()
+                self._queue.remove(request)
+        self.waits.append(time.monotonic() - request.enqueued_at)
+
+    async def _dispatch(self):
+        while True:
+            now = time.monotonic()
+            wait = None
+            blocked = set()
+            dispatched = False
+            for request in self._queue:
+                if request.model in blocked:
+                    continue
+                limiter = self._limiter(request.model)
+                delay = limiter.delay(request.tokens, now)
+                if delay <= 0:
+                    limiter.consume(request.tokens, now)
+                    self._queue.remove(request)
+                    request.future.set_result(None)
+                    dispatched = True
+                    break
+                # Пока не ушёл запрос с более высоким приоритетом, остальные запросы этой модели ждут
+                blocked.add(request.model)
+                wait = delay if wait is None else min(wait, delay)
+            if dispatched:
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["queue_depth"] = len(self._queue)
+        waits = sorted(self.waits)
+        stats["wait_p50_ms"] = round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0
+        stats["wait_p95_ms"] = round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0
+        stats["models"] = {
+            model: {"requests_available": round(limiter.requests.tokens), "tokens_available": round(limiter.tokens.tokens)}
+            for model, limiter in self._limiters.items()
+        }
+        return stats
+
+
+openai_scheduler = OpenAIScheduler()
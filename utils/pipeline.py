@@ -0,0 +1,152 @@
+import asyncio
+from collections import deque
+from config import Config
+from logger_config import logger
+
+
+class Stage:
+    __slots__ = ("name", "func", "deps", "speculative")
+
+    def __init__(self, name, func, deps=(), speculative=False):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.speculative = speculative
+
+
+# Граф этапов обработки сообщения. Каждый этап стартует, как только готовы его зависимости,
+# поэтому независимые этапы идут параллельно. Спекулятивные этапы запускаются сразу и никого
+# не блокируют: их результат забирают через run.result(), а ненужные отменяются.
+class Pipeline:
+
+    def __init__(self, name, window=None):
+        self.name = name
+        self.stages = {}
+        self.window = window or Config.PIPELINE_STATS_WINDOW
+        self.durations = {}
+        self.totals = deque(maxlen=self.window)
+        self.stats = {"runs": 0, "errors": 0, "cancelled_runs": 0, "cancelled": 0}
+
+    def stage(self, name, deps=(), speculative=False):
+        def register(func):
+            for dep in deps:
+                if dep not in self.stages:
+                    raise ValueError(f"Этап {name} зависит от неизвестного этапа {dep}")
+                if self.stages[dep].speculative:
+                    raise ValueError(f"Этап {name} не может ждать спекулятивный этап {dep}")
+            self.stages[name] = Stage(name, func, deps, speculative)
+            self.durations[name] = deque(maxlen=self.window)
+            return func
+        return register
+
+    async def run(self, **inputs):
+        run = PipelineRun(self, inputs)
+        await run.execute()
+        return run
+
+    def _record(self, run, outcome):
+        self.stats["runs"] += 1
+        if outcome == "error":
+            self.stats["errors"] += 1
+        elif outcome == "cancelled":
+            self.stats["cancelled_runs"] += 1
+        self.totals.append(run.total)
+        for record in run.timings:
+            if record["status"] == "ok":
+                self.durations[record["stage"]].append(record["duration_ms"])
+            elif record["status"] == "cancelled":
+                self.stats["cancelled"] += 1
+
+    @staticmethod
+    def _percentiles(samples):
+        samples = sorted(samples)
+        if not samples:
+            return {"samples": 0, "p50_ms": 0.0, "p95_ms": 0.0}
+        return {
+            "samples": len(samples),
+            "p50_ms": round(samples[len(samples) // 2], 1),
+            "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 1),
+        }
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["total"] = self._percentiles(self.totals)
+        stats["stages"] = {name: self._percentiles(samples) for name, samples in self.durations.items()}
+        return stats
+
+
+class PipelineRun:
+
+    def __init__(self, pipeline, inputs):
+        self.pipeline = pipeline
+        self.inputs = inputs
+        self.results = {}
+        # Записи по этапам: смещение старта от начала прогона, длительность и итог (ok, error, cancelled)
+        self.timings = []
+        self.total = 0.0
+        self._tasks = {}
+        self._started = None
+
+    async def result(self, name):
+        return await self._tasks[name]
+
+    def cancel(self, name):
+        task = self._tasks.get(name)
+        if task is not None and not task.done():
+            task.cancel()
+
+    async def _run_stage(self, stage):
+        if stage.deps:
+            await asyncio.gather(*(self._tasks[dep] for dep in stage.deps))
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        status = "ok"
+        try:
+            result = await stage.func(self)
+            self.results[stage.name] = result
+            return result
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            self.timings.append({
+                "stage": stage.name,
+                "start_ms": round((started - self._started) * 1000, 1),
+                "duration_ms": round((loop.time() - started) * 1000, 1),
+                "status": status,
+            })
+
+    async def execute(self):
+        loop = asyncio.get_running_loop()
+        self._started = loop.time()
+        for stage in self.pipeline.stages.values():
+            self._tasks[stage.name] = asyncio.create_task(
+                self._run_stage(stage), name=f"{self.pipeline.name}:{stage.name}"
+            )
+        required = [self._tasks[stage.name] for stage in self.pipeline.stages.values() if not stage.speculative]
+        outcome = "error"
+        try:
+            await asyncio.gather(*required)
+            outcome = "ok"
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            # Спекулятивная работа, которую никто не забрал, и этапы упавшего прогона больше не нужны
+            pending = [task for task in self._tasks.values() if not task.done()]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+            self.total = round((loop.time() - self._started) * 1000, 1)
+            self.pipeline._record(self, outcome)
+            logger.info(f"Этапы {self.pipeline.name} за {self.total:.0f} мс: {self.describe()}")
+
+    def describe(self):
+        return ", ".join(
+            f"{r['stage']} {r['duration_ms']:.0f} мс (+{r['start_ms']:.0f})"
+            + ("" if r["status"] == "ok" else f" {r['status']}")
+            for r in sorted(self.timings, key=lambda r: r["start_ms"])
+        )
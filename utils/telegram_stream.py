@@ -0,0 +1,135 @@
+import asyncio
+from telegram.constants import MessageLimit
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from config import Config
+from logger_config import logger
+
+
+# Потоковый ответ в Telegram: заглушка отправляется сразу, дальше сообщение правится по мере
+# генерации. Правки склеиваются: пока ждём разрешённого момента, в сообщение уходит только
+# последний накопленный текст, поэтому число запросов к Telegram не зависит от числа токенов.
+class StreamingReply:
+
+    stats = {"replies": 0, "edits": 0, "edit_errors": 0, "retry_after": 0, "overflow_messages": 0, "discarded": 0}
+
+    def __init__(self, message, edit_interval=None, min_chars=None, placeholder=None):
+        self.message = message
+        self.edit_interval = Config.STREAM_EDIT_INTERVAL if edit_interval is None else edit_interval
+        self.min_chars = Config.STREAM_MIN_CHARS if min_chars is None else min_chars
+        self.placeholder = placeholder or Config.STREAM_PLACEHOLDER
+        self.sent = None
+        self.text = ""
+        self.shown = ""
+        self.edits = 0
+        self.first_text_at = None
+        self._changed = asyncio.Event()
+        self._next_edit = 0.0
+        self._started = None
+        self._task = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._started = loop.time()
+        self.sent = await self.message.reply_text(self.placeholder)
+        self.shown = self.placeholder
+        # Первая правка — сразу с первыми словами ответа, дальше не чаще edit_interval
+        self._next_edit = loop.time()
+        self._task = asyncio.create_task(self._run())
+        StreamingReply.stats["replies"] += 1
+
+    def update(self, text):
+        # Вызывается на каждый фрагмент ответа, поэтому только запоминает текст и будит цикл правок
+        self.text = text
+        self._changed.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._changed.wait()
+            delay = self._next_edit - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._changed.clear()
+            text = self.text[:MessageLimit.MAX_TEXT_LENGTH]
+            if len(text) - len(self.shown) < self.min_chars:
+                continue
+            await self._edit(text)
+            self._next_edit = max(self._next_edit, loop.time() + self.edit_interval)
+
+    async def _edit(self, text):
+        # None — текст в сообщении, число — через сколько секунд повторить, 0 — правка не удалась
+        if not text.strip() or text == self.shown:
+            return None
+        try:
+            await self.sent.edit_text(text)
+        except RetryAfter as e:
+            StreamingReply.stats["retry_after"] += 1
+            self._next_edit = asyncio.get_running_loop().time() + e.retry_after
+            self._changed.set()
+            return e.retry_after
+        except BadRequest as e:
+            # Telegram отвечает ошибкой, если текст не изменился, — для нас это успех
+            if "not modified" not in str(e).lower():
+                StreamingReply.stats["edit_errors"] += 1
+                logger.error(f"Ошибка при обновлении потокового ответа: {e}")
+                return 0
+        except TelegramError as e:
+            StreamingReply.stats["edit_errors"] += 1
+            logger.error(f"Ошибка при обновлении потокового ответа: {e}")
+            return 0
+        if self.first_text_at is None:
+            self.first_text_at = asyncio.get_running_loop().time()
+        self.shown = text
+        self.edits += 1
+        StreamingReply.stats["edits"] += 1
+        return None
+
+    async def _stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def discard(self):
+        # Ответ отменён — убираем заглушку вместе с уже показанной частью текста
+        await self._stop()
+        if self.sent is None:
+            return
+        StreamingReply.stats["discarded"] += 1
+        try:
+            await self.sent.delete()
+        except TelegramError as e:
+            logger.error(f"Не удалось удалить отменённый ответ: {e}")
+
+    async def finish(self, text):
+        loop = asyncio.get_running_loop()
+        await self._stop()
+        limit = MessageLimit.MAX_TEXT_LENGTH
+        chunks = [text[i:i + limit] for i in range(0, len(text), limit)] or [text]
+        # Последняя правка обязательна: при флуд-контроле ждём, при другой ошибке шлём текст новым сообщением
+        for _ in range(3):
+            retry_after = await self._edit(chunks[0])
+            if retry_after is None:
+                break
+            if not retry_after:
+                await self.message.reply_text(chunks[0])
+                break
+            await asyncio.sleep(retry_after)
+        else:
+            await self.message.reply_text(chunks[0])
+        for chunk in chunks[1:]:
+            StreamingReply.stats["overflow_messages"] += 1
+            await self.message.reply_text(chunk)
+        first_text = (self.first_text_at - self._started) * 1000 if self.first_text_at is not None else None
+        logger.info(
+            f"Потоковый ответ: первый текст через "
+            f"{'-' if first_text is None else f'{first_text:.0f}'} мс, правок {self.edits}, "
+            f"всего {(loop.time() - self._started) * 1000:.0f} мс"
+        )
+
+    @classmethod
+    def get_stats(cls):
+        return dict(cls.stats)
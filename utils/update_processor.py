@@ -0,0 +1,93 @@
+import sys
+import asyncio
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+# Параллельная обработка обновлений Telegram: разные чаты — одновременно (не больше
+# max_concurrent_updates), обновления одного чата — строго в порядке прихода.
+# Без этого медленный ответ модели одному пользователю задерживает сообщения всех остальных.
+# Обновления одного чата выстраиваются в цепочку, и слот получает только голова цепочки:
+# ожидающие своей очереди сообщения активного чата не занимают слоты других чатов.
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+
+    def __init__(self, max_concurrent_updates):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        # Семафор базового класса берётся ещё до do_process_update, поэтому он без ограничения
+        # (его размер базовый класс читает из max_concurrent_updates), а настоящие слоты выдаются
+        # ниже, когда подошла очередь обновления в его чате
+        self._limit = sys.maxsize
+        super().__init__(sys.maxsize)
+        self._limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        # chat_id -> future последнего принятого обновления чата, завершается после его обработки
+        self._tails = {}
+        self._running = 0
+        self.stats = {"updates": 0, "waited": 0, "errors": 0}
+
+    @property
+    def max_concurrent_updates(self):
+        return self._limit
+
+    @property
+    def current_concurrent_updates(self):
+        return self._running
+
+    @staticmethod
+    def _chat_id(update):
+        if isinstance(update, Update) and update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        self.stats["updates"] += 1
+        chat_id = self._chat_id(update)
+        previous = None
+        done = asyncio.get_running_loop().create_future()
+        if chat_id is not None:
+            previous = self._tails.get(chat_id)
+            self._tails[chat_id] = done
+        started = False
+        try:
+            if previous is not None and not previous.done():
+                self.stats["waited"] += 1
+                # wait, а не await: отмена ожидающего не должна отменять предыдущее обновление
+                await asyncio.wait((previous,))
+            async with self._slots:
+                started = True
+                self._running += 1
+                try:
+                    await coroutine
+                finally:
+                    self._running -= 1
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            if not started:
+                coroutine.close()
+            self._release(chat_id, previous, done)
+
+    def _release(self, chat_id, previous, done):
+        # Следующее обновление чата стартует не раньше предыдущего, даже если это ожидание отменили
+        if previous is not None and not previous.done():
+            previous.add_done_callback(lambda _: self._release(chat_id, None, done))
+            return
+        if not done.done():
+            done.set_result(None)
+        if self._tails.get(chat_id) is done:
+            del self._tails[chat_id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["in_flight"] = self._running
+        stats["max_concurrent"] = self._limit
+        stats["active_chats"] = len(self._tails)
+        return stats
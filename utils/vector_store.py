@@ -0,0 +1,262 @@
+import os
+import json
+import uuid
+import threading
+import chromadb
+import numpy as np
+from chromadb.errors import ChromaError
+from config import Config
+from logger_config import logger
+
+
+class VectorStore:
+    # Общий интерфейс хранилища векторов. query() возвращает результат в формате Chroma:
+    # {"ids": [[...]], "documents": [[...]], "metadatas": [[...]], "distances": [[...]]}
+    path = None
+
+    def get_ids(self):
+        raise NotImplementedError
+
+    def upsert(self, ids, embeddings, metadatas):
+        raise NotImplementedError
+
+    def delete(self, ids):
+        raise NotImplementedError
+
+    def reset(self):
+        raise NotImplementedError
+
+    def query(self, embedding, n_results=10, where=None):
+        raise NotImplementedError
+
+
+class ChromaVectorStore(VectorStore):
+
+    COLLECTION_NAME = "knowledge_embeddings"
+
+    def __init__(self, path):
+        self.path = path
+        self.chroma_client = chromadb.PersistentClient(path=path)
+        self.collection = self._load_or_create_collection(self.COLLECTION_NAME)
+        logger.info("Коллекция 'knowledge_embeddings' успешно загружена.")
+
+    def _load_or_create_collection(self, collection_name):
+        try:
+            return self.chroma_client.get_collection(collection_name)
+        except ChromaError:
+            logger.error(f"Коллекция '{collection_name}' не найдена, создаём новую.")
+            return self.chroma_client.create_collection(collection_name)
+
+    def get_ids(self):
+        return set(self.collection.get(include=[])["ids"])
+
+    def upsert(self, ids, embeddings, metadatas):
+        self.collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas)
+
+    def delete(self, ids):
+        if ids:
+            self.collection.delete(ids=list(ids))
+
+    def reset(self):
+        self.chroma_client.delete_collection(self.COLLECTION_NAME)
+        self.collection = self._load_or_create_collection(self.COLLECTION_NAME)
+
+    def query(self, embedding, n_results=10, where=None):
+        params = {"query_embeddings": [embedding], "n_results": n_results}
+        if where:
+            params["where"] = where
+        return self.collection.query(**params)
+
+
+class _NumpyIndex:
+    # Одна версия индекса: заменяется целиком, поэтому поиск никогда не видит её наполовину обновлённой
+
+    def __init__(self, mtime, ids, metadatas, matrix, mask_fields):
+        self.mtime = mtime
+        self.ids = ids
+        self.metadatas = metadatas
+        self.matrix = matrix
+        self.masks = {}
+        for field in mask_fields:
+            values = np.array([meta.get(field) for meta in metadatas], dtype=object)
+            self.masks[field] = {value: values == value for value in set(values.tolist())}
+
+
+class NumpyVectorStore(VectorStore):
+    # Все векторы лежат одной нормированной float32-матрицей в .npy, которая отображается в память.
+    # Расстояние — квадрат L2 между единичными векторами (2 - 2 * cos), как у Chroma по умолчанию,
+    # поэтому расстояния одинаково сравнимы для обоих бэкендов.
+    # Каждое сохранение пишет матрицу в новый файл vectors-<версия>.npy, а metadata.json ссылается
+    # на него — подмена metadata.json единственная точка переключения на новую версию.
+    # Запись идёт из пула потоков, поиск — из цикла событий: запись и перечитывание сериализуются
+    # блокировкой, а поиск её не ждёт и отвечает по текущей версии.
+
+    MATRIX_FILE = "vectors.npy"
+    MATRIX_PATTERN = "vectors-{}.npy"
+    METADATA_FILE = "metadata.json"
+    MASK_FIELDS = ("city",)
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.metadata_path = os.path.join(path, self.METADATA_FILE)
+        self._lock = threading.Lock()
+        self._index = self._load()
+
+    def _load(self):
+        mtime = None
+        try:
+            mtime = os.stat(self.metadata_path).st_mtime_ns
+            with open(self.metadata_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            # Индексы старого формата ссылаются на vectors.npy неявно
+            matrix_file = data.get("matrix", self.MATRIX_FILE)
+            matrix = np.load(os.path.join(self.path, matrix_file), mmap_mode="r")
+            if matrix.shape[0] != len(data["ids"]):
+                raise ValueError(f"в {matrix_file} {matrix.shape[0]} строк, в метаданных {len(data['ids'])}")
+        except FileNotFoundError:
+            data = {"ids": [], "metadatas": []}
+            matrix = np.zeros((0, 0), dtype=np.float32)
+            if mtime is not None:
+                logger.error(f"Векторный индекс {self.path} повреждён и будет пересоздан: нет файла матрицы")
+        except ValueError as e:
+            # Несогласованный индекс не используем: он будет пересчитан при синхронизации
+            logger.error(f"Векторный индекс {self.path} повреждён и будет пересоздан: {e}")
+            data = {"ids": [], "metadatas": []}
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        return _NumpyIndex(mtime, data["ids"], data["metadatas"], matrix, self.MASK_FIELDS)
+
+    def _refresh(self):
+        # Индекс мог пересобрать другой процесс — подхватываем новую версию. Вызывается под self._lock
+        try:
+            mtime = os.stat(self.metadata_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self._index.mtime:
+            self._index = self._load()
+        return self._index
+
+    def _current(self):
+        # Поиск не ждёт идущую в этом процессе запись: она сама опубликует новую версию
+        if not self._lock.acquire(blocking=False):
+            return self._index
+        try:
+            return self._refresh()
+        finally:
+            self._lock.release()
+
+    def get_ids(self):
+        return set(self._current().ids)
+
+    def upsert(self, ids, embeddings, metadatas):
+        with self._lock:
+            index = self._refresh()
+            new_vectors = self._normalize(np.asarray(embeddings, dtype=np.float32))
+            rows = {chunk_id: (i, None) for i, chunk_id in enumerate(index.ids)}
+            metadata_by_id = dict(zip(index.ids, index.metadatas))
+            for i, chunk_id in enumerate(ids):
+                rows[chunk_id] = (None, i)
+                metadata_by_id[chunk_id] = metadatas[i]
+
+            all_ids = list(rows)
+            dim = new_vectors.shape[1] if len(ids) else index.matrix.shape[1]
+            matrix = np.empty((len(all_ids), dim), dtype=np.float32)
+            for row, chunk_id in enumerate(all_ids):
+                old_row, new_row = rows[chunk_id]
+                matrix[row] = index.matrix[old_row] if new_row is None else new_vectors[new_row]
+            self._save(all_ids, [metadata_by_id[chunk_id] for chunk_id in all_ids], matrix)
+
+    def delete(self, ids):
+        with self._lock:
+            index = self._refresh()
+            removed = set(ids)
+            keep = [i for i, chunk_id in enumerate(index.ids) if chunk_id not in removed]
+            if len(keep) == len(index.ids):
+                return
+            matrix = np.ascontiguousarray(index.matrix[keep], dtype=np.float32)
+            self._save([index.ids[i] for i in keep], [index.metadatas[i] for i in keep], matrix)
+
+    def reset(self):
+        with self._lock:
+            self._save([], [], np.zeros((0, 0), dtype=np.float32))
+
+    def _save(self, ids, metadatas, matrix):
+        # Матрица пишется в новый файл, затем metadata.json со ссылкой на него атомарно подменяется:
+        # читатели видят либо старую пару файлов, либо новую, но не смесь
+        matrix_file = self.MATRIX_PATTERN.format(uuid.uuid4().hex)
+        metadata_tmp = f"{self.metadata_path}.tmp"
+        with open(os.path.join(self.path, matrix_file), 'wb') as f:
+            np.save(f, matrix)
+        with open(metadata_tmp, 'w', encoding='utf-8') as f:
+            json.dump({"matrix": matrix_file, "ids": ids, "metadatas": metadatas}, f, ensure_ascii=False)
+        os.replace(metadata_tmp, self.metadata_path)
+        self._remove_old_matrices(matrix_file)
+        self._index = self._load()
+
+    def _remove_old_matrices(self, current):
+        # Уже отображённые в память старые версии остаются доступны открывшим их читателям до перечитывания
+        for name in os.listdir(self.path):
+            if name != current and (name == self.MATRIX_FILE or (name.startswith("vectors-") and name.endswith(".npy"))):
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _normalize(vectors):
+        if vectors.size == 0:
+            return vectors
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    @staticmethod
+    def _where_mask(index, where):
+        mask = None
+        for field, value in where.items():
+            if field in index.masks:
+                field_mask = index.masks[field].get(value)
+                if field_mask is None:
+                    return np.zeros(len(index.ids), dtype=bool)
+            else:
+                field_mask = np.array([meta.get(field) == value for meta in index.metadatas], dtype=bool)
+            mask = field_mask if mask is None else mask & field_mask
+        return mask
+
+    def query(self, embedding, n_results=10, where=None):
+        index = self._current()
+        empty = {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]}
+        if not index.ids:
+            return empty
+
+        query_vector = self._normalize(np.asarray(embedding, dtype=np.float32))
+        scores = index.matrix @ query_vector
+        available = len(index.ids)
+        if where:
+            mask = self._where_mask(index, where)
+            available = int(mask.sum())
+            if available == 0:
+                return empty
+            scores = np.where(mask, scores, -np.inf)
+
+        k = min(n_results, available)
+        if k < len(scores):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")][:k]
+        return {
+            "ids": [[index.ids[i] for i in top]],
+            "documents": [[index.metadatas[i].get("content") for i in top]],
+            "metadatas": [[index.metadatas[i] for i in top]],
+            "distances": [np.maximum(2.0 - 2.0 * scores[top], 0.0).tolist()],
+        }
+
+
+def create_vector_store(backend=None):
+    backend = backend or Config.VECTOR_STORE
+    if backend == "numpy":
+        return NumpyVectorStore(Config.NUMPY_INDEX_PATH)
+    if backend == "chroma":
+        return ChromaVectorStore(Config.CHROMA_DB_PATH)
+    raise ValueError(f"Неизвестный бэкенд векторного хранилища: {backend}")
@@ -0,0 +1,131 @@
+import time
+import signal
+import asyncio
+from contextlib import contextmanager
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from telegram import Update
+from config import Config
+from logger_config import logger
+
+
+class _Server(uvicorn.Server):
+
+    @contextmanager
+    def capture_signals(self):
+        # Сигналы остановки обрабатывает WebhookServer: после остановки HTTP-сервера ещё нужно
+        # дообработать принятые обновления, а uvicorn повторно послал бы сигнал и завершил процесс
+        yield
+
+
+# Приём обновлений Telegram по вебхуку на локальном HTTP-сервере (starlette + uvicorn).
+# Запрос только кладёт обновление в очередь приложения и сразу отвечает 200 — обработка идёт
+# параллельно, через update_processor приложения. GET /healthz — состояние для балансировщика.
+# По SIGTERM/SIGINT сервер перестаёт принимать обновления (503, Telegram повторит доставку позже),
+# приложение дообрабатывает очередь, затем выполняется post_shutdown.
+class WebhookServer:
+
+    def __init__(self, application, post_init=None, post_shutdown=None, health=None):
+        self.application = application
+        self.post_init = post_init
+        self.post_shutdown = post_shutdown
+        # health() -> dict с дополнительными метриками для /healthz
+        self.health = health
+        self.state = "starting"
+        self.started_at = time.monotonic()
+        self.stats = {"received": 0, "rejected": 0, "invalid": 0, "refused_draining": 0}
+        self.server = None
+        self.app = Starlette(routes=[
+            Route(Config.WEBHOOK_PATH, self.handle_update, methods=["POST"]),
+            Route("/healthz", self.handle_health, methods=["GET"]),
+        ])
+
+    async def handle_update(self, request: Request):
+        if Config.WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != Config.WEBHOOK_SECRET:
+            self.stats["rejected"] += 1
+            return Response(status_code=403)
+        if self.state == "draining":
+            self.stats["refused_draining"] += 1
+            return Response(status_code=503)
+        try:
+            update = Update.de_json(await request.json(), self.application.bot)
+        except Exception as e:
+            self.stats["invalid"] += 1
+            logger.warning(f"Вебхук: не удалось разобрать обновление: {e}")
+            return Response(status_code=400)
+        self.stats["received"] += 1
+        await self.application.update_queue.put(update)
+        return Response(status_code=200)
+
+    async def handle_health(self, request: Request):
+        body = {
+            "status": self.state,
+            "uptime_s": round(time.monotonic() - self.started_at, 1),
+            "update_queue": self.application.update_queue.qsize(),
+            "webhook": dict(self.stats),
+        }
+        processor = self.application.update_processor
+        if hasattr(processor, "get_stats"):
+            body["updates"] = processor.get_stats()
+        if self.health is not None:
+            body.update(self.health())
+        return JSONResponse(body, status_code=200 if self.state == "running" else 503)
+
+    def stop(self):
+        if self.state != "draining":
+            logger.info("Вебхук: получен сигнал остановки, новые обновления не принимаются")
+        self.state = "draining"
+        if self.server is not None:
+            self.server.should_exit = True
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+        self.server = _Server(uvicorn.Config(
+            self.app,
+            host=Config.WEBHOOK_LISTEN,
+            port=Config.WEBHOOK_PORT,
+            log_level="warning",
+            lifespan="off",
+            timeout_graceful_shutdown=Config.WEBHOOK_GRACEFUL_TIMEOUT,
+        ))
+        async with self.application:
+            # HTTP-сервер поднимается сразу: /healthz отвечает «starting», пока грузится каталог,
+            # а пришедшие обновления ждут в очереди запуска приложения
+            serve = asyncio.create_task(self.server.serve(), name="webhook-server")
+            try:
+                if self.post_init is not None:
+                    await self.post_init(self.application)
+                if Config.WEBHOOK_URL:
+                    await self.application.bot.set_webhook(
+                        url=Config.WEBHOOK_URL.rstrip("/") + Config.WEBHOOK_PATH,
+                        secret_token=Config.WEBHOOK_SECRET or None,
+                        allowed_updates=Update.ALL_TYPES,
+                        max_connections=Config.WEBHOOK_MAX_CONNECTIONS,
+                    )
+                await self.application.start()
+                if self.state == "starting":
+                    self.state = "running"
+                logger.info(f"Вебхук слушает {Config.WEBHOOK_LISTEN}:{Config.WEBHOOK_PORT}{Config.WEBHOOK_PATH}")
+                await serve
+            finally:
+                self.stop()
+                await asyncio.gather(serve, return_exceptions=True)
+                # Обновления, уже принятые в очередь, обрабатываются до конца
+                if self.application.running:
+                    await self.application.stop()
+                if self.post_shutdown is not None:
+                    await self.post_shutdown(self.application)
+                for sig in (signal.SIGINT, signal.SIGTERM):
+                    try:
+                        loop.remove_signal_handler(sig)
+                    except (NotImplementedError, RuntimeError):
+                        pass
+                logger.info("Вебхук остановлен")